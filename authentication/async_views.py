@@ -0,0 +1,157 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+
+from usccoursemate.throttling import check_request_rates, retry_after
+
+from . import views
+from .http import get_async_oauth_http
+from .serializers import UserSerializer
+from .supabase import get_async_supabase_admin
+from .users import sync_identity
+from .views import (
+    SyncRequestError,
+    as_json,
+    frontend_callback_url,
+    google_identity,
+    supabase_identity,
+    sync_request_identity,
+    sync_throttle_email,
+    sync_user_payload,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _sync_and_serialize(identity):
+    """在线程池中执行的数据库部分：同步用户并序列化"""
+    user, changed = sync_identity(**identity)
+    return UserSerializer(user).data, changed
+
+
+def _request_data(request):
+    """解析JSON或表单请求体；JSON不是对象时原样返回，由调用方返回400"""
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGoogleCallbackView(View):
+    """
+    GoogleCallbackView的异步版本：等待Google和Supabase响应时不占用worker，
+    数据库操作通过sync_to_async在线程池中执行
+    """
+
+    async def get(self, request):
+        """处理传统OAuth回调"""
+        code = request.GET.get('code')
+
+        if not code:
+            return JsonResponse({'error': 'Authorization code not provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+        client = get_async_oauth_http()
+        token_data = {
+            'code': code,
+            'client_id': views.GOOGLE_CLIENT_ID,
+            'client_secret': views.GOOGLE_CLIENT_SECRET,
+            'redirect_uri': request.build_absolute_uri('/api/auth/google/callback/'),
+            'grant_type': 'authorization_code'
+        }
+
+        try:
+            token_response = await client.post(views.GOOGLE_TOKEN_URL, name='google_token', data=token_data)
+        except client.errors:
+            logger.warning('请求Google令牌接口失败', exc_info=True)
+            return JsonResponse({'error': 'Failed to obtain access token'}, status=status.HTTP_502_BAD_GATEWAY)
+
+        if token_response.status_code != 200:
+            return JsonResponse({'error': 'Failed to obtain access token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        access_token = token_response.json().get('access_token')
+
+        try:
+            user_info_response = await client.get(
+                views.GOOGLE_USER_INFO_URL,
+                name='google_userinfo',
+                headers={'Authorization': f'Bearer {access_token}'}
+            )
+        except client.errors:
+            logger.warning('请求Google用户信息接口失败', exc_info=True)
+            return JsonResponse({'error': 'Failed to get user info'}, status=status.HTTP_502_BAD_GATEWAY)
+
+        if user_info_response.status_code != 200:
+            return JsonResponse({'error': 'Failed to get user info'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user_data, changed = await sync_to_async(_sync_and_serialize)(google_identity(user_info_response.json()))
+
+        # 重定向到前端，带上用户数据
+        return redirect(frontend_callback_url(user_data, changed))
+
+    async def post(self, request):
+        """处理Supabase OAuth回调"""
+        data = _request_data(request)
+        code = data.get('code') if isinstance(data, dict) else None
+
+        if not code:
+            return JsonResponse({'error': '授权码未提供'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            supabase_admin = await get_async_supabase_admin()
+            auth_response = await supabase_admin.auth.exchange_code_for_session({"code": code})
+
+            if not auth_response.user:
+                return JsonResponse({'error': '无法获取用户数据'}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                identity = supabase_identity(auth_response.user)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+            user_data, changed = await sync_to_async(_sync_and_serialize)(identity)
+
+            return JsonResponse({
+                'user': user_data,
+                'session': as_json(auth_response.session),
+                'changed': changed,
+            })
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSyncUserView(View):
+    """SyncUserView的异步版本"""
+
+    async def post(self, request):
+        data = _request_data(request)
+        auth_header = request.headers.get('Authorization')
+        # 令牌验证通常命中本地缓存；JWKS刷新会发起网络请求，因此放到线程池中执行
+        email = await sync_to_async(sync_throttle_email, thread_sensitive=False)(auth_header, data)
+        # 限流只读写共享内存，耗时在微秒级，直接在事件循环中执行
+        wait = check_request_rates(request, 'sync_user', email)
+        if wait is not None:
+            response = JsonResponse({'detail': '请求过于频繁'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = retry_after(wait)
+            return response
+
+        try:
+            identity = await sync_to_async(sync_request_identity, thread_sensitive=False)(auth_header, data)
+        except SyncRequestError as e:
+            return JsonResponse({'error': str(e)}, status=e.status_code)
+
+        try:
+            return JsonResponse(await sync_to_async(sync_user_payload)(identity))
+        except Exception as e:
+            logger.exception('同步用户数据时出错')
+            return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,185 @@
+"""
+用户头像：后台从Google/Supabase下载一次原图，裁剪缩放为几种固定尺寸保存到MEDIA_ROOT，
+由/api/auth/avatars/<user_id>/?v=<source_key>带ETag和缓存头返回。
+文件名由原图URL的哈希决定，URL不变时不会重新下载，URL变化后生成新文件并删除不再使用的旧文件。
+"""
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
+
+from django.conf import settings
+
+from .http import avatar_http
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# 拒绝像素数过多的图片，防止解码占用过多内存
+MAX_PIXELS = 40_000_000
+# 下载原图时最多跟随的重定向次数
+MAX_REDIRECTS = 3
+
+
+
+def fetch_image(url):
+    """
+    下载头像原图并返回字节，超过MAX_BYTES时抛出ValueError；测试中替换此函数即可离线运行。
+    重定向逐跳处理，每一跳都重新检查is_allowed_source，不会被重定向到其他主机。
+    """
+    max_bytes = settings.AVATARS['MAX_BYTES']
+    for _ in range(MAX_REDIRECTS + 1):
+        if not is_allowed_source(url):
+            raise ValueError(f'不允许的头像地址: {url}')
+        response = avatar_http.get(url, name='avatar', stream=True, allow_redirects=False)
+        with response:
+            if response.is_redirect:
+                url = urljoin(url, response.headers['Location'])
+                continue
+            response.raise_for_status()
+            chunks, size = [], 0
+            for chunk in response.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f'头像超过{max_bytes}字节')
+                chunks.append(chunk)
+        return b''.join(chunks)
+    raise ValueError(f'头像重定向超过{MAX_REDIRECTS}次')
+
+
+def is_allowed_source(url):
+    """只下载和重定向到SOURCE_HOSTS（及其子域名）下的https地址"""
+    parts = urlsplit(url or '')
+    host = (parts.hostname or '').lower()
+    return parts.scheme == 'https' and any(
+        host == allowed or host.endswith('.' + allowed) for allowed in settings.AVATARS['SOURCE_HOSTS']
+    )
+
+
+def source_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+
+
+def avatar_dir():
+    return Path(settings.MEDIA_ROOT) / settings.AVATARS['SUBDIR']
+
+
+def avatar_path(key, size):
+    return avatar_dir() / f'{key}-{size}.webp'
+
+
+def pick_size(requested):
+    """返回不小于请求尺寸的最小预设尺寸，超过最大尺寸时返回最大尺寸"""
+    sizes = sorted(settings.AVATARS['SIZES'])
+    return next((size for size in sizes if size >= requested), sizes[-1])
+
+
+def is_processed(key):
+    return all(avatar_path(key, size).exists() for size in settings.AVATARS['SIZES'])
+
+
+def resize_avatar(content, sizes):
+    """把原图居中裁剪为正方形并缩放到各尺寸，返回{尺寸: WebP字节}"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError(f'头像尺寸过大: {image.width}x{image.height}')
+        largest = max(sizes)
+        # JPEG可以在解码时直接缩小，大图只解码到接近目标的尺寸
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        base = ImageOps.fit(image, (largest, largest), Image.LANCZOS)
+
+    results = {}
+    for size in sorted(sizes, reverse=True):
+        # 从已缩好的最大尺寸继续缩小，比每次都从原图缩放快
+        resized = base if size == largest else base.resize((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, 'WEBP', quality=82, method=4)
+        results[size] = buffer.getvalue()
+    return results
+
+
+def _atomic_write(path, content):
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix='.', suffix='.tmp', delete=False) as temp:
+        temp.write(content)
+    os.replace(temp.name, path)
+
+
+class AvatarPipeline:
+    """
+    在进程内的线程池中下载和处理头像。同一URL同时只处理一次；
+    失败的URL在RETRY_AFTER秒内不再重试，避免损坏的地址在每次请求时都触发下载。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+        self._failed = {}
+
+    def schedule(self, url):
+        """安排后台处理，返回是否已提交；WORKERS为0时在当前线程中处理"""
+        if not is_allowed_source(url):
+            return False
+        key = source_key(url)
+        with self._lock:
+            failed_at = self._failed.get(key)
+            if key in self._pending or (failed_at and time.monotonic() - failed_at < settings.AVATARS['RETRY_AFTER']):
+                return False
+            if is_processed(key):
+                return False
+            self._pending.add(key)
+            workers = settings.AVATARS['WORKERS']
+            if workers and self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='avatar')
+        if workers:
+            self._executor.submit(self.process, url)
+        else:
+            self.process(url)
+        return True
+
+    def process(self, url):
+        key = source_key(url)
+        started = time.perf_counter()
+        try:
+            images = resize_avatar(fetch_image(url), settings.AVATARS['SIZES'])
+            avatar_dir().mkdir(parents=True, exist_ok=True)
+            for size, content in images.items():
+                _atomic_write(avatar_path(key, size), content)
+        except Exception:
+            logger.warning('处理头像失败 %s', url, exc_info=True)
+            with self._lock:
+                self._failed[key] = time.monotonic()
+        else:
+            logger.debug('已处理头像 %s，耗时%.1fms', key, (time.perf_counter() - started) * 1000)
+            with self._lock:
+                self._failed.pop(key, None)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def discard(self, url):
+        """用户更换头像后删除旧地址的文件；仍有其他用户使用该地址或正在处理时保留"""
+        if not url or not is_allowed_source(url):
+            return
+        key = source_key(url)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._failed.pop(key, None)
+        if UserProfile.objects.filter(profile_image=url).exists():
+            return
+        for size in settings.AVATARS['SIZES']:
+            avatar_path(key, size).unlink(missing_ok=True)
+
+
+pipeline = AvatarPipeline()
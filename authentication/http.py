@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from usccoursemate.metrics import collector
+
+logger = logging.getLogger(__name__)
+
+
+class CallStats:
+    """单个外部接口的调用统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.total_seconds,
+            'max_seconds': self.max_seconds,
+        }
+
+
+class CallStatsRegistry:
+    """按接口名汇总调用次数、失败次数和耗时，同步和异步客户端共用"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, failed):
+        with self._lock:
+            stats = self._stats.setdefault(name, CallStats())
+            stats.count += 1
+            stats.errors += int(failed)
+            stats.total_seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+        collector.observe('oauth_call_duration_seconds', {'name': name}, seconds)
+        if failed:
+            collector.inc('oauth_call_errors_total', {'name': name})
+        logger.debug('外部调用 %s 耗时 %.1fms%s', name, seconds * 1000, '（失败）' if failed else '')
+
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._stats.items()}
+
+
+# 进程内所有OAuth外部调用的统计
+call_stats = CallStatsRegistry()
+
+
+class OAuthHTTPClient:
+    """
+    OAuth令牌交换和用户信息请求共用的HTTP客户端：
+    连接池保持长连接，每次调用都有连接/读取超时，重试次数有上限，并按接口记录耗时。
+    """
+
+    def __init__(self, connect_timeout, read_timeout, retries, pool_size, stats=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # 连接失败时请求尚未发出，任何方法都可以安全重试；读取超时和5xx只对GET重试，
+        # 避免重复提交一次性的授权码
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET'}),
+            backoff_factor=0.1,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.stats = stats or CallStatsRegistry()
+
+    def request(self, method, url, name=None, **kwargs):
+        name = name or urlsplit(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self.stats.record(name, time.perf_counter() - started, failed)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def snapshot(self):
+        return self.stats.snapshot()
+
+
+class AsyncOAuthHTTPClient:
+    """
+    OAuthHTTPClient的异步版本，基于httpx.AsyncClient，供ASGI下的异步视图使用。
+    httpx传输层的重试只针对连接失败，因此对POST同样安全。
+    """
+
+    def __init__(self, connect_timeout, read_timeout, retries, pool_size, stats=None):
+        import httpx
+
+        self.errors = (httpx.HTTPError,)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            transport=httpx.AsyncHTTPTransport(retries=retries, limits=limits),
+        )
+        self.stats = stats or CallStatsRegistry()
+
+    async def request(self, method, url, name=None, **kwargs):
+        name = name or urlsplit(url).netloc
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self.stats.record(name, time.perf_counter() - started, failed)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def snapshot(self):
+        return self.stats.snapshot()
+
+
+def build_client(config=None):
+    """按OAUTH_HTTP（或其中的子配置，如'AVATAR'）创建同步客户端"""
+    config = config or settings.OAUTH_HTTP
+    return OAuthHTTPClient(
+        connect_timeout=config['CONNECT_TIMEOUT'],
+        read_timeout=config['READ_TIMEOUT'],
+        retries=config['RETRIES'],
+        pool_size=config['POOL_SIZE'],
+        stats=call_stats,
+    )
+
+
+# 模块级共享客户端，各请求复用连接池
+oauth_http = build_client()
+# 下载头像原图，超时和连接池与OAuth调用分开配置
+avatar_http = build_client(settings.OAUTH_HTTP['AVATAR'])
+
+# httpx的连接池绑定在创建它的事件循环上，因此每个事件循环各用一个异步客户端
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_oauth_http():
+    """返回当前事件循环对应的异步客户端，不存在时创建"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        config = settings.OAUTH_HTTP
+        client = _async_clients[loop] = AsyncOAuthHTTPClient(
+            connect_timeout=config['CONNECT_TIMEOUT'],
+            read_timeout=config['READ_TIMEOUT'],
+            retries=config['RETRIES'],
+            pool_size=config['ASYNC_POOL_SIZE'],
+            stats=call_stats,
+        )
+    return client
+
+
+async def close_async_oauth_http():
+    """关闭当前事件循环的异步客户端及其连接池，在ASGI worker退出（lifespan.shutdown）时调用"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncRequestFactory, RequestFactory
+
+from authentication.async_views import AsyncGoogleCallbackView
+from authentication.http import close_async_oauth_http
+from authentication.stub_provider import StubProvider
+from authentication.users import sync_identity
+from authentication.views import GoogleCallbackView
+from usccoursemate.benchmark import temporary_test_database
+
+CALLBACK_PATH = '/api/auth/google/callback/'
+
+
+class Command(BaseCommand):
+    help = (
+        '以相同的并发数对比同步与异步Google回调视图在OAuth提供方有延迟时的吞吐量（使用本地桩服务器和临时测试数据库）。'
+        '请求直接调用视图，不经过WSGI/ASGI处理器和中间件，结果只反映视图本身'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='每种视图的登录次数')
+        parser.add_argument('--concurrency', type=int, default=25, help='并发登录数：同步视图使用同样数量的线程，异步视图在一个事件循环中并发')
+        parser.add_argument('--latency', type=float, default=50, help='桩服务器每次响应的延迟（毫秒）')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        with temporary_test_database():
+            with StubProvider(latency=options['latency'] / 1000) as provider, mock.patch.multiple(
+                'authentication.views',
+                GOOGLE_TOKEN_URL=provider.token_url,
+                GOOGLE_USER_INFO_URL=provider.user_info_url,
+            ):
+                sync_seconds = self.run_sync(total, options['concurrency'])
+                async_seconds = asyncio.run(self.run_async(total, options['concurrency']))
+
+        self.stdout.write(json.dumps({
+            'requests': total,
+            'latency_ms': options['latency'],
+            # 同步视图对应有concurrency个线程的WSGI worker，异步视图对应单线程的ASGI worker
+            'concurrency': options['concurrency'],
+            'sync_rps': round(total / sync_seconds, 1),
+            'async_rps': round(total / async_seconds, 1),
+        }, indent=2))
+
+    def run_sync(self, total, concurrency):
+        view = GoogleCallbackView.as_view()
+        factory = RequestFactory()
+
+        def login(i):
+            try:
+                self.check_response(view(factory.get(CALLBACK_PATH, {'code': f'sync{i}'})))
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with self.serialized_sqlite_writes(), ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(login, range(total)))
+        return time.perf_counter() - started
+
+    def serialized_sqlite_writes(self):
+        """
+        SQLite测试库不支持多个线程并发写入（table is locked），此时让同步视图的数据库操作逐个执行，
+        与异步视图中sync_to_async在单个线程里执行数据库操作的情况相同；外部调用仍然并发
+        """
+        if connection.vendor != 'sqlite':
+            return nullcontext()
+        lock = threading.Lock()
+
+        def locked_sync_identity(*args, **kwargs):
+            with lock:
+                return sync_identity(*args, **kwargs)
+
+        return mock.patch('authentication.views.sync_identity', locked_sync_identity)
+
+    async def run_async(self, total, concurrency):
+        view = AsyncGoogleCallbackView.as_view()
+        factory = AsyncRequestFactory()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def login(i):
+            async with semaphore:
+                self.check_response(await view(factory.get(CALLBACK_PATH, {'code': f'async{i}'})))
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(login(i) for i in range(total)))
+        finally:
+            await close_async_oauth_http()
+        return time.perf_counter() - started
+
+    def check_response(self, response):
+        if response.status_code != 302:
+            raise RuntimeError(f'登录失败: HTTP {response.status_code} {response.content[:200]!r}')
@@ -0,0 +1,60 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# 只在少数请求中用到、不应在启动阶段导入的重量级模块
+LAZY_MODULES = ('supabase', 'httpx', 'PIL')
+
+# 在新的解释器中执行，才能测到未缓存模块的真实导入耗时
+MEASURE_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'lazy_modules': sorted(name for name in %r if name in sys.modules),
+}))
+''' % (LAZY_MODULES,)
+
+
+class Command(BaseCommand):
+    help = '测量worker启动时django.setup()和URLconf导入的耗时，超出预算或提前导入了延迟加载的模块时失败'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget', type=float, default=settings.STARTUP_TIME_BUDGET,
+                            help='允许的启动耗时（秒），默认取STARTUP_TIME_BUDGET')
+        parser.add_argument('--runs', type=int, default=3, help='测量次数，取中位数')
+
+    def handle(self, *args, **options):
+        # override_settings生效期间（如测试中）settings.SETTINGS_MODULE为None
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE') or settings.SETTINGS_MODULE)
+        results = [self.measure(env) for _ in range(options['runs'])]
+        seconds = statistics.median(result['seconds'] for result in results)
+        lazy_modules = sorted({name for result in results for name in result['lazy_modules']})
+
+        self.stdout.write(json.dumps({
+            'seconds': round(seconds, 3),
+            'budget': options['budget'],
+            'lazy_modules_loaded': lazy_modules,
+        }))
+        if lazy_modules:
+            raise CommandError(f'启动时导入了应延迟加载的模块: {", ".join(lazy_modules)}')
+        if seconds > options['budget']:
+            raise CommandError(f'启动耗时{seconds:.3f}秒，超出预算{options["budget"]}秒')
+
+    def measure(self, env):
+        completed = subprocess.run(
+            [sys.executable, '-c', MEASURE_SCRIPT],
+            env=env, capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        if completed.returncode != 0:
+            raise CommandError(f'启动失败:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
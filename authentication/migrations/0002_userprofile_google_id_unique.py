@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:29
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+from usccoursemate.operations import AddUniqueConstraintConcurrentlyIfSupported
+
+
+def clear_duplicate_google_ids(apps, schema_editor):
+    """
+    并发首次登录可能为同一身份创建了多份资料（此前这些用户登录时会因MultipleObjectsReturned失败）。
+    保留最早的一份，其余清空google_id，以便添加唯一约束。
+    """
+    UserProfile = apps.get_model('authentication', 'UserProfile')
+    duplicates = (
+        UserProfile.objects.exclude(google_id__isnull=True).order_by()
+        .values('google_id').annotate(count=Count('id'), first_id=Min('id')).filter(count__gt=1)
+    )
+    for row in duplicates:
+        UserProfile.objects.filter(google_id=row['google_id']).exclude(id=row['first_id']).update(google_id=None)
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL的CREATE UNIQUE INDEX CONCURRENTLY不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('authentication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_google_ids, migrations.RunPython.noop, atomic=True),
+        # 模型状态改为unique=True，数据库中以不锁表的方式建唯一索引并挂为约束
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='userprofile',
+                    name='google_id',
+                    field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+                ),
+            ],
+            database_operations=[
+                AddUniqueConstraintConcurrentlyIfSupported(
+                    model_name='userprofile',
+                    constraint=models.UniqueConstraint(fields=('google_id',), name='authentication_userprofile_google_id_uniq'),
+                ),
+            ],
+        ),
+    ]
@@ -4,8 +4,16 @@ from django.contrib.auth.models import User
 class UserProfile(models.Model):
     """扩展Django默认用户模型的用户配置文件"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
-    google_id = models.CharField(max_length=100, blank=True, null=True)
+    # 第三方身份ID（Google或Supabase用户ID），每次登录都按它查找，唯一约束同时提供索引
+    google_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     profile_image = models.URLField(max_length=500, blank=True, null=True)
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录读取时的头像地址，更换头像后据此删除旧文件
+        instance._loaded_profile_image = instance.__dict__.get('profile_image')
+        return instance
+
     def __str__(self):
         return f"{self.user.username}'s profile"
\ No newline at end of file
@@ -1,11 +1,22 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.urls import reverse
+from .avatars import source_key
 from .models import UserProfile
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    # 经本站缩放和缓存的头像地址，可带&size=参数
+    avatar_url = serializers.SerializerMethodField()
+
     class Meta:
         model = UserProfile
-        fields = ['google_id', 'profile_image']
+        fields = ['google_id', 'profile_image', 'avatar_url']
+
+    def get_avatar_url(self, obj):
+        if not obj.profile_image:
+            return None
+        # 地址中带上原图的哈希，更换头像后地址随之变化，旧地址可以长期缓存
+        return f"{reverse('avatar', args=[obj.user_id])}?v={source_key(obj.profile_image)}"
 
 class UserSerializer(serializers.ModelSerializer):
     profile = UserProfileSerializer(read_only=True)
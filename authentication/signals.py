@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .avatars import pipeline
+from .models import UserProfile
+
+
+@receiver(post_save, sender=UserProfile)
+def fetch_avatar_on_change(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    """
+    新用户或头像地址变化时，在事务提交后安排后台下载并删除旧地址的文件；
+    地址未变时已处理的头像不会重新下载
+    """
+    if raw:
+        return
+    if not created and update_fields is not None and 'profile_image' not in update_fields:
+        return
+    url = instance.profile_image
+    previous = None if created else getattr(instance, '_loaded_profile_image', None)
+    instance._loaded_profile_image = url
+    if url:
+        transaction.on_commit(lambda: pipeline.schedule(url))
+    if previous and previous != url:
+        transaction.on_commit(lambda: pipeline.discard(previous))
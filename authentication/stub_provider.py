@@ -0,0 +1,68 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    """模拟Google的令牌和用户信息接口：授权码原样作为访问令牌，用户ID由访问令牌生成"""
+
+    # 与真实提供方一样保持长连接，连接池才能被复用
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        code = parse_qs(body).get('code', [''])[0]
+        self.respond({'access_token': code})
+
+    def do_GET(self):
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        self.respond({
+            'sub': f'stub-{token}',
+            'email': f'{token}@stub.usc.edu',
+            'name': 'Stub User',
+            'picture': None,
+        })
+
+    def respond(self, payload):
+        time.sleep(self.server.latency)
+        body = json.dumps(payload).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已因超时断开
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的监听队列只有5，基准测试的并发连接会被拒绝
+    request_queue_size = 256
+
+
+class StubProvider:
+    """在本地线程中运行的OAuth桩服务器，用于测试和基准测试，每个响应前等待latency秒"""
+
+    def __init__(self, latency=0.0):
+        self.server = StubServer(('127.0.0.1', 0), StubProviderHandler)
+        self.server.latency = latency
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.token_url = f'{self.base_url}/token'
+        self.user_info_url = f'{self.base_url}/userinfo'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,13 +1,51 @@
-from supabase import create_client
+import asyncio
 import os
+import threading
+import weakref
 
 # 从环境变量获取Supabase配置
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_KEY")
 supabase_secret = os.environ.get("SUPABASE_SECRET")  # 服务角色密钥，用于管理员操作
 
-# 创建Supabase客户端
-supabase = create_client(supabase_url, supabase_key)
+# supabase包及其依赖导入较慢，客户端在首次使用时才创建，
+# 避免每个worker和每条manage.py命令启动时都承担这部分开销
+_clients = {}
+_clients_lock = threading.Lock()
 
-# 创建服务角色客户端（具有管理权限）
-supabase_admin = create_client(supabase_url, supabase_secret) 
\ No newline at end of file
+
+def _get_client(name, key):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                from supabase import create_client
+
+                client = _clients[name] = create_client(supabase_url, key)
+    return client
+
+
+def get_supabase():
+    """返回Supabase客户端（匿名密钥）"""
+    return _get_client('anon', supabase_key)
+
+
+def get_supabase_admin():
+    """返回服务角色客户端（具有管理权限）"""
+    return _get_client('admin', supabase_secret)
+
+
+# 异步服务角色客户端，按事件循环缓存（其内部的httpx连接池绑定在创建它的事件循环上）
+_async_admin_clients = weakref.WeakKeyDictionary()
+
+
+async def get_async_supabase_admin():
+    """返回当前事件循环对应的异步服务角色客户端，供异步视图使用"""
+    from supabase import acreate_client
+
+    loop = asyncio.get_running_loop()
+    client = _async_admin_clients.get(loop)
+    if client is None:
+        client = _async_admin_clients[loop] = await acreate_client(supabase_url, supabase_secret)
+    return client
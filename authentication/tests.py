@@ -0,0 +1,412 @@
+import asyncio
+import json
+import tempfile
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from .avatars import avatar_path, fetch_image, pipeline, source_key
+from .async_views import AsyncGoogleCallbackView, AsyncSyncUserView
+from .http import OAuthHTTPClient, get_async_oauth_http
+from .models import UserProfile
+from .tokens import InvalidToken, SupabaseKeySet, TokenVerifier
+from .serializers import UserSerializer
+from .stub_provider import StubProvider
+from .users import create_user, next_free_username, sync_identity
+from .views import frontend_callback_url
+
+
+TEST_JWT_SECRET = 'test-jwt-secret'
+
+
+def supabase_token(secret=TEST_JWT_SECRET, **claims):
+    payload = {'sub': 'supabase-user-1', 'aud': 'authenticated', 'email': 'jane@usc.edu',
+               'exp': int(time.time()) + 3600, **claims}
+    return jwt.encode(payload, secret, algorithm='HS256')
+
+
+def jwt_test_settings(**extra):
+    """让令牌验证使用TEST_JWT_SECRET"""
+    return override_settings(SUPABASE_JWT={**settings.SUPABASE_JWT, 'SECRET': TEST_JWT_SECRET, **extra})
+
+
+class UsernameAllocationTests(TestCase):
+    """唯一用户名分配"""
+
+    def test_next_free_suffix_in_one_query(self):
+        for username in ('john', 'john1', 'john2', 'john4', 'johnny', 'john.doe', 'John3', 'john3x'):
+            User.objects.create(username=username)
+        with self.assertNumQueries(1):
+            self.assertEqual(next_free_username('john'), 'john3')
+        self.assertEqual(next_free_username('john.d'), 'john.d')
+        self.assertEqual(next_free_username('johnny'), 'johnny1')
+
+    def test_create_user(self):
+        User.objects.create(username='jane')
+        user = create_user('jane@usc.edu', first_name='Jane')
+        self.assertEqual((user.username, user.email, user.first_name), ('jane1', 'jane@usc.edu', 'Jane'))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class SupabaseTokenTests(TestCase):
+    """Supabase令牌验证"""
+
+    def setUp(self):
+        self.verifier = TokenVerifier(SupabaseKeySet(TEST_JWT_SECRET, None, ttl=600), 'authenticated', cache_size=8)
+        patcher = mock.patch('authentication.tokens._verifier', self.verifier)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_token(self, secret=TEST_JWT_SECRET, **claims):
+        return supabase_token(secret, **claims)
+
+    def test_verified_claims_are_cached(self):
+        token = self.make_token()
+        self.assertEqual(self.verifier.verify(token)['sub'], 'supabase-user-1')
+        with mock.patch('authentication.tokens.jwt.decode') as decode:
+            self.assertEqual(self.verifier.verify(token)['sub'], 'supabase-user-1')
+        decode.assert_not_called()
+
+    def test_rejects_bad_signature_and_expired_tokens(self):
+        with self.assertRaises(InvalidToken):
+            self.verifier.verify(self.make_token(secret='wrong-secret'))
+        with self.assertRaises(InvalidToken):
+            self.verifier.verify(self.make_token(exp=int(time.time()) - 10))
+
+    def test_sync_user_requires_valid_token(self):
+        url = '/api/auth/sync-user/'
+        response = self.client.post(url, {'email': 'jane@usc.edu'}, HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.post(url, {'first_name': 'Jane'}, HTTP_AUTHORIZATION=f'Bearer {self.make_token()}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'jane@usc.edu')
+        self.assertTrue(response.json()['changed'])
+        self.assertEqual(UserProfile.objects.get().google_id, 'supabase-user-1')
+
+    def test_sync_user_without_token_is_rejected(self):
+        data = {'supabase_id': 'supabase-attacker', 'email': 'jane@usc.edu'}
+        response = self.client.post('/api/auth/sync-user/', data)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(UserProfile.objects.exists())
+
+        # 只有显式开启时才允许不带令牌（仅限本地开发）
+        with jwt_test_settings(ALLOW_UNVERIFIED=True):
+            self.assertEqual(self.client.post('/api/auth/sync-user/', data).status_code, 200)
+
+
+class SyncIdentityTests(TestCase):
+    """按身份ID同步用户"""
+
+    def test_existing_identity_is_loaded_with_one_joined_query(self):
+        sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', None)
+        with CaptureQueriesContext(connection) as queries:
+            user, changed = sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Smith', 'https://example.com/a.png')
+            UserSerializer(user).data
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('JOIN "auth_user"', selects[0])
+        self.assertTrue(changed)
+        self.assertEqual(User.objects.get().last_name, 'Smith')
+
+    def test_unchanged_login_writes_nothing(self):
+        sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', 'https://example.com/a.png')
+        with CaptureQueriesContext(connection) as queries:
+            _, changed = sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', 'https://example.com/a.png')
+        self.assertFalse(changed)
+        self.assertEqual(len(queries), 1)
+
+    def test_only_changed_columns_are_written(self):
+        sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', None)
+        with CaptureQueriesContext(connection) as queries:
+            sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Smith', None)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"last_name"', updates[0])
+        self.assertNotIn('"email"', updates[0])
+
+    def test_concurrent_first_login_reuses_winner(self):
+        winner = create_user('jane@usc.edu')
+        UserProfile.objects.create(user=winner, google_id='google-1')
+        # 模拟查找时对方尚未提交：第一次查找未命中，插入时撞上唯一约束
+        real_get = QuerySet.get
+        calls = []
+
+        def get(queryset, *args, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise UserProfile.DoesNotExist
+            return real_get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get):
+            user, _ = sync_identity('google-1', 'jane@usc.edu', 'Jane', '', None)
+        self.assertEqual(user.pk, winner.pk)
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_exhausted_username_retries_raise_original_error(self):
+        error = IntegrityError('UNIQUE constraint failed: auth_user.username')
+        with mock.patch('authentication.users.create_user', side_effect=error):
+            with self.assertRaises(IntegrityError) as raised:
+                sync_identity('google-1', 'jane@usc.edu', 'Jane', '', None)
+        self.assertIs(raised.exception, error)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OAuthHTTPClientTests(TestCase):
+    """OAuth外部调用客户端，使用本地桩服务器"""
+
+    def setUp(self):
+        self.provider = StubProvider()
+        self.provider.__enter__()
+        self.addCleanup(self.provider.__exit__, None, None, None)
+
+    def patch_provider(self, **extra):
+        return mock.patch.multiple(
+            'authentication.views',
+            GOOGLE_TOKEN_URL=self.provider.token_url,
+            GOOGLE_USER_INFO_URL=self.provider.user_info_url,
+            **extra,
+        )
+
+    def test_google_callback_against_stub(self):
+        client = OAuthHTTPClient(connect_timeout=1, read_timeout=1, retries=0, pool_size=2)
+        with self.patch_provider(oauth_http=client):
+            response = self.client.get('/api/auth/google/callback/', {'code': 'jane'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(UserProfile.objects.get().user.email, 'jane@stub.usc.edu')
+        stats = client.snapshot()
+        self.assertEqual(stats['google_token']['count'], 1)
+        self.assertEqual(stats['google_userinfo']['errors'], 0)
+
+    def test_callback_redirect_query_is_encoded(self):
+        user_data = {'first_name': 'Tom & Jerry', 'last_name': '#1+2', 'profile': None}
+        url = frontend_callback_url(user_data, True)
+        query = parse_qs(urlsplit(url).query)
+        self.assertEqual(set(query), {'user', 'changed'})
+        self.assertEqual(json.loads(query['user'][0]), user_data)
+        self.assertEqual(query['changed'], ['true'])
+
+    def test_read_timeout_is_enforced(self):
+        self.provider.server.latency = 0.5
+        client = OAuthHTTPClient(connect_timeout=1, read_timeout=0.1, retries=0, pool_size=1)
+        started = time.perf_counter()
+        with self.assertRaises(requests.RequestException):
+            client.get(self.provider.user_info_url, name='slow')
+        self.assertLess(time.perf_counter() - started, 0.45)
+        self.assertEqual(client.snapshot()['slow']['errors'], 1)
+
+    async def test_async_google_callback_against_stub(self):
+        view = AsyncGoogleCallbackView.as_view()
+        with self.patch_provider():
+            responses = await asyncio.gather(*(
+                view(AsyncRequestFactory().get('/api/auth/google/callback/', {'code': f'user{i}'}))
+                for i in range(3)
+            ))
+        self.assertEqual([response.status_code for response in responses], [302] * 3)
+        self.assertEqual(await UserProfile.objects.acount(), 3)
+
+    async def test_async_client_is_closed_on_lifespan_shutdown(self):
+        from usccoursemate.asgi import application
+
+        client = get_async_oauth_http()
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await application({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(client.client.is_closed)
+
+    @jwt_test_settings()
+    async def test_async_sync_user(self):
+        factory = AsyncRequestFactory()
+        request = factory.post('/api/auth/sync-user/', {'email': 'jane@usc.edu'}, content_type='application/json')
+        response = await AsyncSyncUserView.as_view()(request)
+        self.assertEqual(response.status_code, 401)
+
+        request = factory.post(
+            '/api/auth/sync-user/',
+            {'email': 'jane@usc.edu'},
+            content_type='application/json',
+            headers={'Authorization': f'Bearer {supabase_token()}'},
+        )
+        response = await AsyncSyncUserView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)['changed'])
+        self.assertEqual((await UserProfile.objects.aget()).google_id, 'supabase-user-1')
+
+    @jwt_test_settings()
+    async def test_async_views_reject_non_object_json(self):
+        factory = AsyncRequestFactory()
+        headers = {'Authorization': f'Bearer {supabase_token()}'}
+        for body in ('[]', '"x"', '1'):
+            request = factory.post('/api/auth/sync-user/', body, content_type='application/json', headers=headers)
+            self.assertEqual((await AsyncSyncUserView.as_view()(request)).status_code, 400)
+            request = factory.post('/api/auth/google/callback/', body, content_type='application/json')
+            self.assertEqual((await AsyncGoogleCallbackView.as_view()(request)).status_code, 400)
+
+
+def sample_jpeg(width=400, height=300):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class AvatarTests(TestCase):
+    """头像下载、缩放和缓存，下载函数被替换为返回本地生成的图片"""
+
+    URL = 'https://lh3.googleusercontent.com/a/jane'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = override_settings(MEDIA_ROOT=directory.name, AVATARS={**settings.AVATARS, 'WORKERS': 0})
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        fetch = mock.patch('authentication.avatars.fetch_image', return_value=sample_jpeg())
+        self.fetch = fetch.start()
+        self.addCleanup(fetch.stop)
+        pipeline._failed.clear()
+
+    def login(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            user, _ = sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', url)
+        return user
+
+    def test_fetches_once_and_serves_cached_sizes(self):
+        user = self.login(self.URL)
+        self.login(self.URL)
+        self.assertEqual(self.fetch.call_count, 1)
+        for size in settings.AVATARS['SIZES']:
+            self.assertTrue(avatar_path(source_key(self.URL), size).exists())
+
+        path = UserSerializer(user).data['profile']['avatar_url']
+        self.assertEqual(path, f'/api/auth/avatars/{user.pk}/?v={source_key(self.URL)}')
+        response = self.client.get(path + '&size=50', HTTP_ACCEPT='image/webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('max-age', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (64, 64))
+
+        response = self.client.get(path + '&size=50', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # 地址变化后重新下载并删除旧文件；资料中的地址随之变化，旧地址不再长期缓存
+        self.login(self.URL + '2')
+        self.assertEqual(self.fetch.call_count, 2)
+        self.assertFalse(any(avatar_path(source_key(self.URL), size).exists() for size in settings.AVATARS['SIZES']))
+        user.profile.refresh_from_db()
+        self.assertNotEqual(UserSerializer(user).data['profile']['avatar_url'], path)
+        response = self.client.get(path + '&size=50', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+    def test_redirects_are_checked_against_allowed_hosts(self):
+        self.fetch.stop()
+        redirect = mock.MagicMock(is_redirect=True, headers={'Location': 'https://internal.example.com/a.png'})
+        redirect.__enter__.return_value = redirect
+        with mock.patch('authentication.avatars.avatar_http') as client:
+            client.get.return_value = redirect
+            with self.assertRaisesRegex(ValueError, 'internal.example.com'):
+                fetch_image(self.URL)
+        client.get.assert_called_once()
+        self.assertFalse(client.get.call_args.kwargs['allow_redirects'])
+
+    def test_unprocessed_avatar_redirects_to_source_and_schedules(self):
+        user = sync_identity('google-1', 'jane@usc.edu', 'Jane', 'Doe', self.URL)[0]
+        self.fetch.side_effect = [OSError('offline'), sample_jpeg()]
+        with self.assertLogs('authentication.avatars', 'WARNING'):
+            response = self.client.get(f'/api/auth/avatars/{user.pk}/')
+        self.assertRedirects(response, self.URL, fetch_redirect_response=False)
+        # 失败后RETRY_AFTER秒内不再重试
+        self.client.get(f'/api/auth/avatars/{user.pk}/')
+        self.assertEqual(self.fetch.call_count, 1)
+
+        pipeline._failed.clear()
+        self.client.get(f'/api/auth/avatars/{user.pk}/')
+        self.assertEqual(self.client.get(f'/api/auth/avatars/{user.pk}/').status_code, 200)
+
+    def test_other_hosts_are_not_fetched(self):
+        user = self.login('https://internal.example.com/a.png')
+        self.assertEqual(self.client.get(f'/api/auth/avatars/{user.pk}/').status_code, 404)
+        self.fetch.assert_not_called()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+@jwt_test_settings()
+class SyncUserRateLimitTests(TestCase):
+    """用户同步接口的限流，同步和异步视图共用同一组令牌桶"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        rates = override_settings(RATE_LIMITS={**settings.RATE_LIMITS, 'FILE': f'{directory.name}/ratelimit.bin', 'RATES': {
+            'sync_user.ip': '10/min',
+            'sync_user.email': '1/min',
+        }})
+        rates.enable()
+        self.addCleanup(rates.disable)
+
+    def test_sync_and_async_views_share_buckets(self):
+        data = {'email': 'jane@usc.edu'}
+        headers = {'Authorization': f'Bearer {supabase_token()}'}
+        response = self.client.post('/api/auth/sync-user/', data, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/auth/sync-user/', data, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+        request = AsyncRequestFactory().post('/api/auth/sync-user/', data, content_type='application/json', headers=headers)
+        response = asyncio.run(AsyncSyncUserView.as_view()(request))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+
+    def test_email_bucket_follows_verified_token(self):
+        headers = {'Authorization': f'Bearer {supabase_token()}'}
+        for index, status_code in enumerate((200, 429)):
+            # 每次更换请求体中的邮箱也不能绕过按令牌邮箱的限制
+            data = {'email': f'other{index}@usc.edu'}
+            response = self.client.post('/api/auth/sync-user/', data, content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, status_code)
+
+        request = AsyncRequestFactory().post(
+            '/api/auth/sync-user/', {'email': 'other2@usc.edu'}, content_type='application/json', headers=headers,
+        )
+        self.assertEqual(asyncio.run(AsyncSyncUserView.as_view()(request)).status_code, 429)
+
+        # 另一个令牌（另一位用户）有自己的桶
+        headers = {'Authorization': f'Bearer {supabase_token(sub="supabase-user-2", email="john@usc.edu")}'}
+        response = self.client.post('/api/auth/sync-user/', {}, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+
+class StartupTimeTests(TestCase):
+    """worker启动耗时检查"""
+
+    def test_supabase_is_not_imported_at_startup(self):
+        out = StringIO()
+        call_command('check_startup', '--budget', '60', '--runs', '1', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['lazy_modules_loaded'], [])
+
+    def test_fails_over_budget(self):
+        with self.assertRaisesMessage(CommandError, '超出预算'):
+            call_command('check_startup', '--budget', '0', '--runs', '1', stdout=StringIO())
@@ -0,0 +1,139 @@
+import hashlib
+import logging
+import threading
+import time
+
+import jwt
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from jwt.algorithms import has_crypto
+
+from usccoursemate.cache import LRUCache
+
+from .http import oauth_http
+
+logger = logging.getLogger(__name__)
+
+# Supabase使用项目JWT密钥签名的令牌为HS256，启用非对称签名密钥的项目通过JWKS发布公钥
+HMAC_ALGORITHMS = ['HS256']
+ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256']
+
+
+class InvalidToken(Exception):
+    """令牌签名、格式或声明校验失败"""
+
+
+class SupabaseKeySet:
+    """
+    本地缓存的Supabase验签密钥：HS256使用SUPABASE_JWT_SECRET，
+    非对称算法从JWKS地址获取公钥，按TTL刷新，遇到未知kid时立即刷新（有最小间隔）。
+    """
+
+    def __init__(self, secret, jwks_url, ttl, min_refresh_interval=30):
+        self.secret = secret
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = None
+        self._lock = threading.Lock()
+
+    def get_key(self, header):
+        algorithm = header.get('alg')
+        if algorithm in HMAC_ALGORITHMS:
+            if not self.secret:
+                raise InvalidToken('未配置SUPABASE_JWT_SECRET，无法验证HS256令牌')
+            return self.secret
+        if algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise InvalidToken(f'不支持的签名算法: {algorithm}')
+        if not has_crypto:
+            raise InvalidToken('验证非对称签名需要安装cryptography')
+
+        kid = header.get('kid')
+        now = time.monotonic()
+        if self._fetched_at is None or now - self._fetched_at > self.ttl:
+            self.refresh()
+        elif kid not in self._keys and now - self._fetched_at > self.min_refresh_interval:
+            # 未知kid通常意味着密钥已轮换
+            self.refresh()
+        try:
+            return self._keys[kid]
+        except KeyError:
+            raise InvalidToken(f'未知的密钥ID: {kid}')
+
+    def refresh(self):
+        if not self.jwks_url:
+            raise InvalidToken('未配置SUPABASE_URL，无法获取JWKS')
+        with self._lock:
+            response = oauth_http.get(self.jwks_url, name='supabase_jwks')
+            response.raise_for_status()
+            keys = {}
+            for jwk in response.json().get('keys', []):
+                try:
+                    keys[jwk.get('kid')] = jwt.PyJWK(jwk).key
+                except jwt.PyJWKError as e:
+                    logger.warning('跳过无法解析的JWK %s: %s', jwk.get('kid'), e)
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            logger.info('已刷新Supabase JWKS，共%d个密钥', len(keys))
+
+
+class TokenVerifier:
+    """验证Supabase访问令牌，验证通过的声明按令牌哈希缓存到过期为止"""
+
+    def __init__(self, key_set, audience, cache_size):
+        self.key_set = key_set
+        self.audience = audience
+        self.cache = LRUCache(maxsize=cache_size)
+
+    def verify(self, token):
+        cache_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        cached = self.cache.get(cache_key)
+        if cached is not None and cached['exp'] > time.time():
+            return cached
+
+        try:
+            header = jwt.get_unverified_header(token)
+            claims = jwt.decode(
+                token,
+                self.key_set.get_key(header),
+                # get_key已确认算法在允许列表内，这里只接受头部声明的那一种
+                algorithms=[header.get('alg')],
+                audience=self.audience,
+                options={'require': ['exp', 'sub']},
+            )
+        except (jwt.PyJWTError, requests.RequestException, ValueError) as e:
+            raise InvalidToken(str(e)) from e
+
+        self.cache.set(cache_key, claims)
+        return claims
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                config = settings.SUPABASE_JWT
+                key_set = SupabaseKeySet(config['SECRET'], config['JWKS_URL'], config['JWKS_TTL'])
+                _verifier = TokenVerifier(key_set, config['AUDIENCE'], config['CACHE_SIZE'])
+    return _verifier
+
+
+@receiver(setting_changed)
+def _reset_verifier(setting, **kwargs):
+    """SUPABASE_JWT变化（如测试中override_settings）后按新配置重新创建验证器"""
+    global _verifier
+    if setting == 'SUPABASE_JWT':
+        _verifier = None
+
+
+def verify_supabase_token(token):
+    """验证令牌并返回声明，失败时抛出InvalidToken"""
+    return get_verifier().verify(token)
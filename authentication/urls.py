@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.urls import path
-from .views import GoogleLoginView, GoogleCallbackView, SyncUserView
+from .async_views import AsyncGoogleCallbackView, AsyncSyncUserView
+from .views import AvatarView, GoogleLoginView, GoogleCallbackView, SyncUserView
+
+# 在ASGI下运行时使用异步版本的回调和同步视图
+if settings.ASYNC_AUTH_VIEWS:
+    callback_view, sync_user_view = AsyncGoogleCallbackView, AsyncSyncUserView
+else:
+    callback_view, sync_user_view = GoogleCallbackView, SyncUserView
 
 urlpatterns = [
     path('google/login/', GoogleLoginView.as_view(), name='google-login'),
-    path('google/callback/', GoogleCallbackView.as_view(), name='google-callback'),
-    path('sync-user/', SyncUserView.as_view(), name='sync-user'),
-]
\ No newline at end of file
+    path('google/callback/', callback_view.as_view(), name='google-callback'),
+    path('sync-user/', sync_user_view.as_view(), name='sync-user'),
+    path('avatars/<int:user_id>/', AvatarView.as_view(), name='avatar'),
+]
@@ -0,0 +1,92 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+
+from .models import UserProfile
+
+# 并发注册撞上同一个用户名时的重试次数
+MAX_USERNAME_ATTEMPTS = 5
+
+# 用户名后缀只能是数字
+DIGITS_RE = re.compile(r'[0-9]*')
+
+
+def next_free_username(base):
+    """
+    用一次查询找出base、base1、base2……中第一个未被占用的用户名，
+    与逐个exists()探测的结果相同，但查询次数不随冲突数量增长。
+    按前缀查询可以使用username上的索引（PostgreSQL上Django为唯一的CharField另建了varchar_pattern_ops索引），
+    是否为“base+数字”在Python中判断。
+    """
+    max_length = User._meta.get_field('username').max_length
+    base = base[:max_length - 6] or 'user'
+    taken = {
+        username for username in User.objects.filter(username__startswith=base).values_list('username', flat=True)
+        # SQLite的LIKE不区分大小写，前缀需要再精确比较一次
+        if username.startswith(base) and DIGITS_RE.fullmatch(username[len(base):])
+    }
+    if base not in taken:
+        return base
+    counter = 1
+    while f"{base}{counter}" in taken:
+        counter += 1
+    return f"{base}{counter}"
+
+
+def create_user(email, **fields):
+    """以邮箱前缀为基础分配唯一用户名并创建用户，遇到并发冲突时重新分配"""
+    base = (email or '').split('@')[0]
+    for attempt in range(MAX_USERNAME_ATTEMPTS):
+        username = next_free_username(base)
+        try:
+            with transaction.atomic():
+                return User.objects.create(username=username, email=email, **fields)
+        except IntegrityError:
+            if attempt == MAX_USERNAME_ATTEMPTS - 1:
+                raise
+
+
+def _assign_changed(instance, values):
+    """只为与当前值不同的字段赋值，返回发生变化的字段名列表"""
+    changed = []
+    for field, value in values.items():
+        if getattr(instance, field) != value:
+            setattr(instance, field, value)
+            changed.append(field)
+    return changed
+
+
+def sync_identity(google_id, email, first_name, last_name, profile_image):
+    """
+    按第三方身份ID查找或创建用户及其资料，返回(user, changed)，user.profile已加载。
+
+    已有用户通过一次JOIN查询同时取出资料和用户，只写入发生变化的列，信息未变时不产生任何写入；
+    首次登录时在同一个保存点内创建用户和资料，若并发请求已抢先创建了同一身份（google_id唯一约束冲突），
+    则回滚本次插入并读取对方创建的记录。
+    """
+    profiles = UserProfile.objects.select_related('user')
+    try:
+        profile = profiles.get(google_id=google_id)
+    except UserProfile.DoesNotExist:
+        try:
+            with transaction.atomic():
+                user = create_user(email, first_name=first_name, last_name=last_name)
+                UserProfile.objects.create(user=user, google_id=google_id, profile_image=profile_image)
+            return user, True
+        except IntegrityError:
+            # 不是google_id冲突（例如用户名重试次数用尽）时抛出原来的错误
+            profile = profiles.filter(google_id=google_id).first()
+            if profile is None:
+                raise
+
+    # 更新用户信息
+    user = profile.user
+    user_fields = _assign_changed(user, {'first_name': first_name, 'last_name': last_name, 'email': email})
+    if user_fields:
+        user.save(update_fields=user_fields)
+    # 更新用户资料
+    profile_fields = _assign_changed(profile, {'profile_image': profile_image})
+    if profile_fields:
+        profile.save(update_fields=profile_fields)
+    return user, bool(user_fields or profile_fields)
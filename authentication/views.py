@@ -1,18 +1,27 @@
 from django.conf import settings
 from django.shortcuts import redirect
-from django.http import JsonResponse
+from django.http import FileResponse, HttpResponseNotModified, HttpResponseRedirect, JsonResponse
+from django.utils.http import parse_etags
+from django.views import View
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
 import requests
 import json
+import logging
 import os
-from django.contrib.auth.models import User
+from urllib.parse import urlencode
+from usccoursemate.throttling import EmailRateThrottle, IPRateThrottle, request_email
+from .avatars import avatar_path, is_allowed_source, pick_size, pipeline, source_key
+from .http import oauth_http
 from .models import UserProfile
 from .serializers import UserSerializer
-from .supabase import supabase, supabase_admin
-import jwt
+from .supabase import get_supabase_admin
+from .tokens import InvalidToken, verify_supabase_token
+from .users import sync_identity
+
+logger = logging.getLogger(__name__)
 
 # 从环境变量获取Google OAuth配置
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
@@ -22,8 +31,128 @@ SUPABASE_URL = os.environ.get('SUPABASE_URL')
 
 # Google OAuth2 URLs
 GOOGLE_AUTH_URL = 'https://accounts.google.com/o/oauth2/auth'
-GOOGLE_TOKEN_URL = 'https://oauth2.googleapis.com/token'
-GOOGLE_USER_INFO_URL = 'https://www.googleapis.com/oauth2/v3/userinfo'
+GOOGLE_TOKEN_URL = os.environ.get('GOOGLE_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+GOOGLE_USER_INFO_URL = os.environ.get('GOOGLE_USER_INFO_URL', 'https://www.googleapis.com/oauth2/v3/userinfo')
+
+def split_name(full_name):
+    """把全名拆分为(名, 姓)"""
+    parts = full_name.split() if full_name else []
+    return (parts[0] if parts else ''), ' '.join(parts[1:])
+
+
+def _get(data, key, default=None):
+    """兼容字典和对象两种形式的Supabase返回数据"""
+    if isinstance(data, dict):
+        return data.get(key, default)
+    return getattr(data, key, default)
+
+
+def as_json(value):
+    """Supabase客户端返回pydantic模型，转换为可JSON序列化的数据"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json')
+    return value
+
+
+def google_identity(user_info):
+    """从Google用户信息中提取sync_identity所需的字段"""
+    first_name, last_name = split_name(user_info.get('name'))
+    return {
+        'google_id': user_info.get('sub'),
+        'email': user_info.get('email'),
+        'first_name': first_name,
+        'last_name': last_name,
+        'profile_image': user_info.get('picture'),
+    }
+
+
+def supabase_identity(user_data):
+    """从Supabase用户数据中提取sync_identity所需的字段，身份信息缺失时抛出ValueError"""
+    identities = _get(user_data, 'identities') or []
+    if not identities:
+        raise ValueError('用户身份信息缺失')
+    identity_data = _get(identities[0], 'identity_data') or {}
+    first_name, last_name = split_name(identity_data.get('full_name', ''))
+    return {
+        'google_id': _get(identities[0], 'provider_id'),  # Google ID
+        'email': _get(user_data, 'email'),
+        'first_name': first_name,
+        'last_name': last_name,
+        'profile_image': identity_data.get('avatar_url', ''),
+    }
+
+
+class SyncRequestError(Exception):
+    """用户同步请求无效，带有应返回的HTTP状态码"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sync_request_identity(auth_header, data):
+    """
+    解析用户同步请求，返回sync_identity所需的字段。
+    必须带有Supabase令牌；只有DEBUG下显式开启SUPABASE_JWT['ALLOW_UNVERIFIED']时，
+    才允许不带令牌、直接使用请求体中的supabase_id和email（仅用于本地开发）。
+    """
+    if not isinstance(data, dict):
+        raise SyncRequestError('请求体必须是JSON对象', status.HTTP_400_BAD_REQUEST)
+    if not auth_header or not auth_header.startswith('Bearer '):
+        if not settings.SUPABASE_JWT['ALLOW_UNVERIFIED']:
+            raise SyncRequestError('未提供认证令牌', status.HTTP_401_UNAUTHORIZED)
+        supabase_id = data.get('supabase_id')
+        email = data.get('email')
+        # 如果至少有这些基本信息，允许请求通过（开发环境）
+        if not (supabase_id and email):
+            raise SyncRequestError('未提供有效的认证令牌或用户数据不完整', status.HTTP_400_BAD_REQUEST)
+    else:
+        token = auth_header.split(' ')[1]
+        try:
+            # 使用本地缓存的密钥验证签名，同一会话的重复请求直接命中已验证声明的缓存
+            payload = verify_supabase_token(token)
+        except InvalidToken as e:
+            logger.warning('Supabase令牌验证失败: %s', e)
+            raise SyncRequestError(f'令牌验证失败: {e}', status.HTTP_401_UNAUTHORIZED)
+        supabase_id = payload['sub']
+        logger.debug('已验证Supabase令牌，用户: %s', supabase_id)
+        email = payload.get('email') or data.get('email')
+        if not email:
+            raise SyncRequestError('缺少必要的用户信息', status.HTTP_400_BAD_REQUEST)
+
+    return {
+        'google_id': supabase_id,
+        'email': email,
+        'first_name': data.get('first_name', ''),
+        'last_name': data.get('last_name', ''),
+        'profile_image': data.get('profile_image'),
+    }
+
+
+def frontend_callback_url(user_data, changed):
+    """前端OAuth回调页的地址；整个查询串经过编码，JSON或姓名中的&、#、+不会破坏参数"""
+    return f"{FRONTEND_URL}/oauth2callback?" + urlencode({
+        'user': json.dumps(user_data),
+        'changed': json.dumps(changed),
+    })
+
+
+def sync_throttle_email(auth_header, data):
+    """
+    用户同步按邮箱限流的键。带令牌时取已验证令牌中的邮箱（没有时取sub），请求体中的邮箱可以随意更换，不能作为键；
+    只有不带令牌的本地开发路径才使用请求体中的邮箱。令牌无效时返回None，只受按IP的限制，视图随后返回401
+    """
+    if auth_header and auth_header.startswith('Bearer '):
+        try:
+            payload = verify_supabase_token(auth_header.split(' ')[1])
+        except InvalidToken:
+            return None
+        email = payload.get('email')
+        if isinstance(email, str) and email.strip():
+            return email.strip().lower()
+        return f"sub:{payload['sub']}"
+    return request_email(data) if settings.SUPABASE_JWT['ALLOW_UNVERIFIED'] else None
+
 
 class GoogleLoginView(APIView):
     """
@@ -85,7 +214,11 @@ class GoogleCallbackView(APIView):
             'grant_type': 'authorization_code'
         }
         
-        token_response = requests.post(GOOGLE_TOKEN_URL, data=token_data)
+        try:
+            token_response = oauth_http.post(GOOGLE_TOKEN_URL, name='google_token', data=token_data)
+        except requests.RequestException:
+            logger.warning('请求Google令牌接口失败', exc_info=True)
+            return Response({'error': 'Failed to obtain access token'}, status=status.HTTP_502_BAD_GATEWAY)
         
         if token_response.status_code != 200:
             return Response({'error': 'Failed to obtain access token'}, status=status.HTTP_400_BAD_REQUEST)
@@ -94,138 +227,54 @@ class GoogleCallbackView(APIView):
         access_token = token_json.get('access_token')
         
         # 使用访问令牌获取用户信息
-        user_info_response = requests.get(
-            GOOGLE_USER_INFO_URL,
-            headers={'Authorization': f'Bearer {access_token}'}
-        )
+        try:
+            user_info_response = oauth_http.get(
+                GOOGLE_USER_INFO_URL,
+                name='google_userinfo',
+                headers={'Authorization': f'Bearer {access_token}'}
+            )
+        except requests.RequestException:
+            logger.warning('请求Google用户信息接口失败', exc_info=True)
+            return Response({'error': 'Failed to get user info'}, status=status.HTTP_502_BAD_GATEWAY)
         
         if user_info_response.status_code != 200:
             return Response({'error': 'Failed to get user info'}, status=status.HTTP_400_BAD_REQUEST)
         
         user_info = user_info_response.json()
         
-        # 从Google用户信息中提取相关数据
-        google_id = user_info.get('sub')
-        email = user_info.get('email')
-        name = user_info.get('name')
-        picture = user_info.get('picture')
-        
-        # 查找或创建用户
-        try:
-            # 尝试通过Google ID查找用户资料
-            profile = UserProfile.objects.get(google_id=google_id)
-            user = profile.user
-            # 更新用户信息
-            user.first_name = name.split()[0] if name else ''
-            user.last_name = ' '.join(name.split()[1:]) if name and len(name.split()) > 1 else ''
-            user.email = email
-            user.save()
-            # 更新用户资料
-            profile.profile_image = picture
-            profile.save()
-        except UserProfile.DoesNotExist:
-            # 创建新用户和资料
-            username = email.split('@')[0]
-            # 确保用户名唯一
-            base_username = username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-                
-            user = User.objects.create(
-                username=username,
-                email=email,
-                first_name=name.split()[0] if name else '',
-                last_name=' '.join(name.split()[1:]) if name and len(name.split()) > 1 else ''
-            )
-            
-            # 创建用户资料
-            UserProfile.objects.create(
-                user=user,
-                google_id=google_id,
-                profile_image=picture
-            )
+        # 从Google用户信息中提取相关数据，查找或创建用户
+        user, changed = sync_identity(**google_identity(user_info))
         
         # 序列化用户数据
         serializer = UserSerializer(user)
         
         # 重定向到前端，带上用户数据
-        redirect_to = f"{FRONTEND_URL}/oauth2callback?user={json.dumps(serializer.data)}"
-        return redirect(redirect_to)
+        return redirect(frontend_callback_url(serializer.data, changed))
     
     def post(self, request):
         """处理Supabase OAuth回调"""
-        code = request.data.get('code')
+        code = request.data.get('code') if isinstance(request.data, dict) else None
         
         if not code:
             return Response({'error': '授权码未提供'}, status=status.HTTP_400_BAD_REQUEST)
             
         try:
             # 使用Supabase Admin客户端交换授权码获取会话
-            auth_response = supabase_admin.auth.admin.exchange_code_for_session({"code": code})
+            auth_response = get_supabase_admin().auth.exchange_code_for_session({"code": code})
             
             # 获取Supabase用户数据
             user_data = auth_response.user
             
             if not user_data:
                 return Response({'error': '无法获取用户数据'}, status=status.HTTP_400_BAD_REQUEST)
-                
-            # 提取关键用户信息
-            email = user_data.get('email')
-            identities = user_data.get('identities', [])
-            
-            if not identities:
-                return Response({'error': '用户身份信息缺失'}, status=status.HTTP_400_BAD_REQUEST)
-                
-            provider_id = identities[0].get('provider_id')  # Google ID
-            identity_data = identities[0].get('identity_data', {})
-            
-            full_name = identity_data.get('full_name', '')
-            avatar_url = identity_data.get('avatar_url', '')
             
-            # 从全名中分割姓和名
-            name_parts = full_name.split() if full_name else ['', '']
-            first_name = name_parts[0] if name_parts else ''
-            last_name = ' '.join(name_parts[1:]) if len(name_parts) > 1 else ''
+            try:
+                identity = supabase_identity(user_data)
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             
             # 在Django中同步用户数据
-            # 查找或创建用户
-            try:
-                # 尝试通过Google ID查找用户资料
-                profile = UserProfile.objects.get(google_id=provider_id)
-                user = profile.user
-                # 更新用户信息
-                user.first_name = first_name
-                user.last_name = last_name
-                user.email = email
-                user.save()
-                # 更新用户资料
-                profile.profile_image = avatar_url
-                profile.save()
-            except UserProfile.DoesNotExist:
-                # 创建新用户和资料
-                username = email.split('@')[0]
-                # 确保用户名唯一
-                base_username = username
-                counter = 1
-                while User.objects.filter(username=username).exists():
-                    username = f"{base_username}{counter}"
-                    counter += 1
-                    
-                user = User.objects.create(
-                    username=username,
-                    email=email,
-                    first_name=first_name,
-                    last_name=last_name
-                )
-                
-                # 创建用户资料
-                UserProfile.objects.create(
-                    user=user,
-                    google_id=provider_id,
-                    profile_image=avatar_url
-                )
+            user, changed = sync_identity(**identity)
             
             # 序列化用户数据
             serializer = UserSerializer(user)
@@ -233,7 +282,8 @@ class GoogleCallbackView(APIView):
             # 返回用户数据和Supabase会话
             return Response({
                 'user': serializer.data,
-                'session': auth_response.session,
+                'session': as_json(auth_response.session),
+                'changed': changed,
             })
             
         except Exception as e:
@@ -244,108 +294,74 @@ class SyncUserView(APIView):
     同步Supabase用户数据到Django后端
     """
     permission_classes = [AllowAny]  # 或使用适当的权限类
+    # Supabase令牌由视图自行验证，不能交给SimpleJWT认证类解析（签名密钥不同，会直接返回401）
+    authentication_classes = []
+    # 按IP和邮箱限流
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+    throttle_scope = 'sync_user'
+
+    def get_throttle_email(self, request):
+        return sync_throttle_email(request.headers.get('Authorization'), request.data)
     
     def post(self, request):
         try:
-            # 获取并验证Supabase JWT令牌
-            auth_header = request.headers.get('Authorization')
-            if not auth_header or not auth_header.startswith('Bearer '):
-                # 如果没有Authorization头，尝试从请求数据中获取令牌
-                data = request.data
-                supabase_id = data.get('supabase_id')
-                email = data.get('email')
-                
-                # 如果至少有这些基本信息，允许请求通过（开发环境）
-                if supabase_id and email:
-                    # 从请求体获取用户数据
-                    first_name = data.get('first_name', '')
-                    last_name = data.get('last_name', '')
-                    profile_image = data.get('profile_image')
-                    
-                    # 直接处理用户数据，跳过令牌验证（仅用于开发/测试）
-                    return self._process_user_data(supabase_id, email, first_name, last_name, profile_image)
-                else:
-                    return Response({'error': '未提供有效的认证令牌或用户数据不完整'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 如果有Authorization头，进行正常的令牌验证流程
-            token = auth_header.split(' ')[1]
-            
-            try:
-                # 解码JWT但不验证签名（用于开发测试）
-                # 打印令牌内容以便调试
-                print("JWT令牌:", token[:20] + "..." if len(token) > 20 else token)
-                
-                payload = jwt.decode(token, options={"verify_signature": False})
-                print("JWT payload:", payload)
-                
-                supabase_user_id = payload.get('sub')
-                
-                if not supabase_user_id:
-                    return Response({'error': '无效的用户令牌'}, status=status.HTTP_401_UNAUTHORIZED)
-            except Exception as e:
-                print("JWT解码错误:", str(e))
-                # 尝试更宽松的处理方式 - 直接从请求数据中获取用户ID
-                data = request.data
-                supabase_id = data.get('supabase_id')
-                if not supabase_id:
-                    return Response({'error': f'令牌解析失败: {str(e)}'}, status=status.HTTP_401_UNAUTHORIZED)
-                supabase_user_id = supabase_id
-            
-            # 从请求体获取用户数据
-            data = request.data
-            email = data.get('email')
-            first_name = data.get('first_name', '')
-            last_name = data.get('last_name', '')
-            profile_image = data.get('profile_image')
-            
-            if not email:
-                return Response({'error': '缺少必要的用户信息'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            return self._process_user_data(supabase_user_id, email, first_name, last_name, profile_image)
-            
+            identity = sync_request_identity(request.headers.get('Authorization'), request.data)
+        except SyncRequestError as e:
+            return Response({'error': str(e)}, status=e.status_code)
+        
+        try:
+            return self._process_user_data(**identity)
         except Exception as e:
-            print("处理请求时出错:", str(e))
+            logger.exception('同步用户数据时出错')
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    def _process_user_data(self, supabase_id, email, first_name, last_name, profile_image):
+    def _process_user_data(self, **identity):
         """处理用户数据的辅助方法"""
+        return Response(sync_user_payload(identity))
+
+
+class AvatarView(View):
+    """
+    返回缩放后的用户头像，可带?size=参数（取不小于它的最小预设尺寸）。
+    ?v=与当前头像一致时带公共缓存头长期缓存，否则（缺少或是旧头像的v）每次用ETag重新验证；
+    尚未处理完成时安排后台下载，并暂时重定向到原图。
+    <img>标签不会带Authorization头，头像公开访问；不经过DRF，避免按Accept头协商内容类型。
+    """
+
+    def get(self, request, user_id):
+        url = UserProfile.objects.filter(user_id=user_id).values_list('profile_image', flat=True).first()
+        if not url or not is_allowed_source(url):
+            return JsonResponse({'error': '头像不存在'}, status=status.HTTP_404_NOT_FOUND)
         try:
-            # 尝试通过Supabase ID查找用户资料
-            profile = UserProfile.objects.get(google_id=supabase_id)
-            user = profile.user
-            # 更新用户信息
-            user.first_name = first_name
-            user.last_name = last_name
-            user.email = email
-            user.save()
-            # 更新用户资料
-            profile.profile_image = profile_image
-            profile.save()
-        except UserProfile.DoesNotExist:
-            # 创建新用户和资料
-            username = email.split('@')[0]
-            # 确保用户名唯一
-            base_username = username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
-                
-            user = User.objects.create(
-                username=username,
-                email=email,
-                first_name=first_name,
-                last_name=last_name
-            )
-            
-            # 创建用户资料
-            UserProfile.objects.create(
-                user=user,
-                google_id=supabase_id,
-                profile_image=profile_image
-            )
-        
-        # 序列化用户数据
-        serializer = UserSerializer(user)
-        
-        return Response(serializer.data)
\ No newline at end of file
+            size = pick_size(int(request.GET.get('size', settings.AVATARS['DEFAULT_SIZE'])))
+        except ValueError:
+            size = settings.AVATARS['DEFAULT_SIZE']
+
+        key = source_key(url)
+        path = avatar_path(key, size)
+        if not path.exists():
+            pipeline.schedule(url)
+            response = HttpResponseRedirect(url)
+            response['Cache-Control'] = 'no-cache'
+            return response
+
+        # 文件名由原图URL决定，同一URL的同一尺寸内容不变，ETag无需读取文件
+        etag = f'"{key}-{size}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(path.open('rb'), content_type='image/webp')
+        response['ETag'] = etag
+        if request.GET.get('v') == key:
+            response['Cache-Control'] = f"public, max-age={settings.AVATARS['MAX_AGE']}"
+        else:
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+
+def sync_user_payload(identity):
+    """同步用户并返回序列化后的数据，附带本次同步是否修改了任何信息"""
+    user, changed = sync_identity(**identity)
+    data = UserSerializer(user).data
+    data['changed'] = changed
+    return data
\ No newline at end of file
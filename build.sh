@@ -8,4 +8,10 @@ pip install -r requirements.txt
 python manage.py collectstatic --noinput
 
 # 运行数据库迁移
-python manage.py migrate 
\ No newline at end of file
+python manage.py migrate 
+
+# 为使用占位图的群组渲染二维码（内容未变化时跳过）；会更新qr_code，需要在生成快照之前
+python manage.py render_qr_codes
+
+# 生成群组目录快照（需要在迁移之后）
+python manage.py build_catalog_snapshot
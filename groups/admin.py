@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Community, JoinRequest
+from .demand import bulk_update_status
+from .models import Community, CourseDemand, JoinRequest
 
 @admin.register(Community)
 class CommunityAdmin(admin.ModelAdmin):
@@ -12,3 +13,20 @@ class JoinRequestAdmin(admin.ModelAdmin):
     list_display = ['id', 'department_name', 'course_number', 'status', 'created_at']
     list_filter = ['status']
     search_fields = ['department_name', 'course_number']
+    actions = ['approve_requests', 'reject_requests']
+    
+    @admin.action(description='批准所选申请')
+    def approve_requests(self, request, queryset):
+        updated = bulk_update_status(queryset, 'approved')
+        self.message_user(request, f'已批准 {updated} 条申请')
+    
+    @admin.action(description='拒绝所选申请')
+    def reject_requests(self, request, queryset):
+        updated = bulk_update_status(queryset, 'rejected')
+        self.message_user(request, f'已拒绝 {updated} 条申请')
+
+@admin.register(CourseDemand)
+class CourseDemandAdmin(admin.ModelAdmin):
+    list_display = ['department_name', 'course_number', 'pending_count', 'total_count', 'updated_at']
+    search_fields = ['department_name', 'course_number']
+    readonly_fields = ['department_name', 'course_number', 'pending_count', 'total_count', 'updated_at']
@@ -0,0 +1,208 @@
+import random
+import time
+
+import jwt
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication.models import UserProfile
+from usccoursemate.benchmark import summarize
+
+from .cache import bump_catalog_version
+from .demand import rebuild_course_demand
+from .models import Community, JoinRequest
+
+DEPARTMENTS = ('CSCI', 'MATH', 'EE', 'BUSN', 'ECON', 'PSYC', 'WRIT', 'PHYS', 'CHEM', 'BISC')
+STATUS_WEIGHTS = (('pending', 6), ('approved', 3), ('rejected', 1))
+
+# 基准测试中限流照常执行，但速率足够高，所有请求都能通过
+UNLIMITED_RATE = '1000000000/s'
+
+# 基准测试中签发和验证Supabase访问令牌使用的HS256密钥
+BENCH_JWT_SECRET = 'bench-supabase-jwt-secret'
+
+
+def seed_dataset(communities=1000, join_requests=5000, users=500, seed=0, batch_size=1000):
+    """
+    生成合成数据：communities个群组（按COMMUNITY_TYPES轮流分配类型）、users个带资料的用户，
+    以及join_requests条指向课群的申请。返回场景所需的上下文。
+    """
+    rng = random.Random(seed)
+    types = [code for code, _ in Community.COMMUNITY_TYPES]
+
+    community_objects, courses = [], []
+    for i in range(communities):
+        community_type = types[i % len(types)]
+        department = DEPARTMENTS[i % len(DEPARTMENTS)]
+        if community_type == 'course':
+            course_number = str(100 + i)
+            code, name = f'{department}{course_number}', f'{department} Course {course_number}'
+            courses.append((department, course_number))
+        else:
+            code, name = f'{community_type.upper()}{i}', f'{department} {community_type.title()} Group {i}'
+        community_objects.append(Community(code=code, name=name, number=str(rng.randrange(10 ** 8)), type=community_type))
+    Community.objects.bulk_create(community_objects, batch_size=batch_size)
+
+    User.objects.bulk_create(
+        (User(username=f'bench{i}', email=f'bench{i}@usc.edu') for i in range(users)),
+        batch_size=batch_size,
+    )
+    user_objects = list(User.objects.filter(username__startswith='bench').order_by('id'))
+    UserProfile.objects.bulk_create(
+        (UserProfile(user=user, google_id=f'bench-{user.pk}') for user in user_objects),
+        batch_size=batch_size,
+    )
+
+    courses = courses or [('CSCI', '104')]
+    statuses, weights = zip(*STATUS_WEIGHTS)
+    requests = []
+    for _ in range(join_requests):
+        department_name, course_number = rng.choice(courses)
+        user = rng.choice(user_objects) if user_objects else None
+        requests.append(JoinRequest(
+            department_name=department_name,
+            course_number=course_number,
+            status=rng.choices(statuses, weights)[0],
+            user=user,
+            user_email=user.email if user else None,
+        ))
+    JoinRequest.objects.bulk_create(requests, batch_size=batch_size)
+
+    # bulk_create不触发信号，手动重建计数并使目录缓存失效
+    rebuild_course_demand()
+    bump_catalog_version()
+
+    return {'types': types, 'courses': courses, 'users': user_objects}
+
+
+def _auth_header(user):
+    return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+
+def _list_communities(client, rng, dataset):
+    return client.get('/api/communities/', {'type': rng.choice(dataset['types'])}, secure=True)
+
+
+def _list_join_requests(client, rng, dataset):
+    return client.get(
+        '/api/join-requests/',
+        {'status': rng.choice(STATUS_WEIGHTS)[0], 'page_size': 50},
+        secure=True,
+        **dataset['auth'],
+    )
+
+
+def _create_join_request(client, rng, dataset):
+    department_name, course_number = rng.choice(dataset['courses'])
+    user = rng.choice(dataset['users'])
+    return client.post(
+        '/api/join-requests/',
+        {'department_name': department_name, 'course_number': course_number,
+         'user_id': user.pk, 'user_email': user.email},
+        content_type='application/json',
+        secure=True,
+    )
+
+
+def _supabase_token(supabase_id, email):
+    payload = {
+        'sub': supabase_id,
+        'email': email,
+        'aud': settings.SUPABASE_JWT['AUDIENCE'],
+        'exp': int(time.time()) + 3600,
+    }
+    return jwt.encode(payload, BENCH_JWT_SECRET, algorithm='HS256')
+
+
+def _sync_user(client, rng, dataset):
+    # 大部分为已有用户的重复登录（同一会话复用令牌，命中已验证声明的缓存），少部分为新用户
+    tokens = dataset.setdefault('sync_tokens', {})
+    if rng.random() < 0.9:
+        user = rng.choice(dataset['users'])
+        supabase_id, email = f'bench-{user.pk}', user.email
+        if supabase_id not in tokens:
+            tokens[supabase_id] = _supabase_token(supabase_id, email)
+        token = tokens[supabase_id]
+    else:
+        supabase_id = f'bench-new-{rng.randrange(10 ** 9)}'
+        email = f'{supabase_id}@usc.edu'
+        token = _supabase_token(supabase_id, email)
+    return client.post(
+        '/api/auth/sync-user/',
+        {'email': email, 'first_name': 'Bench', 'last_name': 'User'},
+        content_type='application/json',
+        secure=True,
+        HTTP_AUTHORIZATION=f'Bearer {token}',
+    )
+
+
+# 场景名 -> 发出一次请求的函数
+SCENARIOS = {
+    'communities': _list_communities,
+    'join_requests': _list_join_requests,
+    'join_request_create': _create_join_request,
+    'sync_user': _sync_user,
+}
+
+
+class QueryCounter:
+    """只计数的execute_wrapper，开销远小于记录SQL和耗时的CaptureQueriesContext，不影响延迟测量"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run_scenario(name, client, rng, dataset, requests, warmup):
+    """先预热warmup次，再逐个发出requests次请求，记录每次的延迟和SQL查询数"""
+    send = SCENARIOS[name]
+    for _ in range(warmup):
+        _check(name, send(client, rng, dataset))
+
+    latencies, query_counts = [], []
+    counter = QueryCounter()
+    started = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for _ in range(requests):
+            before = counter.count
+            request_started = time.perf_counter()
+            response = send(client, rng, dataset)
+            latencies.append(time.perf_counter() - request_started)
+            query_counts.append(counter.count - before)
+            _check(name, response)
+    return summarize(latencies, time.perf_counter() - started, query_counts)
+
+
+def unlimited_rates():
+    """把所有限流速率调到足够高的override_settings"""
+    config = settings.RATE_LIMITS
+    return override_settings(RATE_LIMITS={**config, 'RATES': {name: UNLIMITED_RATE for name in config['RATES']}})
+
+
+def bench_jwt_secret():
+    """让用户同步接口用BENCH_JWT_SECRET验证基准测试签发的令牌"""
+    return override_settings(SUPABASE_JWT={**settings.SUPABASE_JWT, 'SECRET': BENCH_JWT_SECRET})
+
+
+def run_benchmark(dataset, requests=200, warmup=10, scenarios=None, seed=0):
+    """在当前数据库上依次运行各场景，返回{场景名: 统计结果}"""
+    rng = random.Random(seed)
+    dataset = dict(dataset, auth=_auth_header(dataset['users'][0]))
+    client = Client()
+    with unlimited_rates(), bench_jwt_secret():
+        return {
+            name: run_scenario(name, client, rng, dataset, requests, warmup)
+            for name in (scenarios or SCENARIOS)
+        }
+
+
+def _check(name, response):
+    if response.status_code >= 300:
+        raise RuntimeError(f'场景{name}请求失败: HTTP {response.status_code} {response.content[:200]!r}')
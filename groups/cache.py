@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from usccoursemate.cache import LRUCache
+
+from .models import CatalogVersion
+
+# 群组目录版本号在共享缓存中的键；数据库中的CatalogVersion为准，共享缓存只是副本，省去每个请求的查询
+CATALOG_VERSION_KEY = 'groups:catalog:version'
+# 群组目录最近一次变化的时间戳
+CATALOG_CHANGED_KEY = 'groups:catalog:changed_at'
+
+
+def _version_cache():
+    return caches[settings.CATALOG_CACHE['ALIAS']]
+
+
+# 本进程内的响应缓存，键中包含目录版本号，旧版本的条目会被自然淘汰
+catalog_cache = LRUCache(maxsize=settings.CATALOG_CACHE['MAX_ENTRIES'])
+# 搜索每次按键都产生新键，单独缓存，避免挤掉列表和详情的热门条目
+search_cache = LRUCache(maxsize=settings.CATALOG_CACHE['SEARCH_MAX_ENTRIES'])
+
+
+def _load_version():
+    """
+    从数据库读取版本号和变化时间并放入共享缓存。只用add：读取期间若有并发递增已写入更新的版本号，不会被覆盖。
+    副本可能落后，始终读主库。
+    """
+    row = (
+        CatalogVersion.objects.using(DEFAULT_DB_ALIAS)
+        .filter(pk=CatalogVersion.SINGLETON_PK)
+        .values_list('version', 'changed_at')
+        .first()
+    )
+    version, changed_at = row or (1, None)
+    # 从未变化过时记为0
+    changed_at = changed_at.timestamp() if changed_at is not None else 0
+    timeout = settings.CATALOG_CACHE['VERSION_TTL']
+    cache = _version_cache()
+    cache.add(CATALOG_CHANGED_KEY, changed_at, timeout=timeout)
+    cache.add(CATALOG_VERSION_KEY, version, timeout=timeout)
+    return version, changed_at
+
+
+def get_catalog_version():
+    """
+    获取当前群组目录版本号。通常直接读共享缓存；缓存条目过期、被淘汰或缓存目录被清空时从数据库重新读取，
+    版本号不会回到旧值。其他主机上的递增最多VERSION_TTL秒后可见。
+    """
+    version = _version_cache().get(CATALOG_VERSION_KEY)
+    if version is None:
+        version, _ = _load_version()
+    return version
+
+
+def bump_catalog_version():
+    """
+    群组目录发生变化时在数据库中原子递增版本号，使所有进程中的旧缓存失效；应在事务提交后调用。
+    写共享缓存时仍持有版本行的行锁，并发递增按顺序写入，缓存中的版本号不会被较小的值覆盖。
+    """
+    cache = _version_cache()
+    # 不小于共享缓存中的版本号：即使数据库中的递增曾被回滚，也不会重复使用某个进程已经见过的版本号
+    seen = cache.get(CATALOG_VERSION_KEY) or 0
+    now = timezone.now()
+    versions = CatalogVersion.objects.using(DEFAULT_DB_ALIAS).filter(pk=CatalogVersion.SINGLETON_PK)
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        updated = versions.update(version=Greatest(F('version') + 1, Value(seen + 1)), changed_at=now)
+        if not updated:
+            # 迁移会创建版本行，只有表被清空（如TransactionTestCase）时才需要补建
+            CatalogVersion.objects.using(DEFAULT_DB_ALIAS).get_or_create(pk=CatalogVersion.SINGLETON_PK)
+            versions.update(version=Greatest(F('version') + 1, Value(seen + 1)), changed_at=now)
+        version = versions.values_list('version', flat=True).get()
+        # 先写变化时间再写版本号，读到新版本号的进程一定能读到这次变化的时间
+        timeout = settings.CATALOG_CACHE['VERSION_TTL']
+        cache.set(CATALOG_CHANGED_KEY, now.timestamp(), timeout=timeout)
+        cache.set(CATALOG_VERSION_KEY, version, timeout=timeout)
+    return version
+
+
+def catalog_changed_within(seconds):
+    """群组目录是否在最近seconds秒内发生过变化"""
+    changed_at = _version_cache().get(CATALOG_CHANGED_KEY)
+    if changed_at is None:
+        _, changed_at = _load_version()
+    return timezone.now().timestamp() - changed_at < seconds
+
+
+def build_cache_key(request, action, **kwargs):
+    """
+    由动作、URL参数、查询参数和目录版本号组成缓存键。
+    分页响应中的next/previous是按请求的协议和域名生成的完整地址，两者也计入键中
+    """
+    params = tuple(sorted(
+        (key, tuple(request.query_params.getlist(key)))
+        for key in request.query_params
+    ))
+    origin = (request.scheme, request.get_host())
+    return (get_catalog_version(), origin, action, tuple(sorted(kwargs.items())), params)
@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import CourseDemand, JoinRequest
+
+
+def _contribution(key):
+    """一条申请对所在课程计数的贡献：(课程, 待处理数, 总数)"""
+    department_name, course_number, status = key
+    return (department_name, course_number), (1 if status == 'pending' else 0), 1
+
+
+def demand_deltas(added=(), removed=()):
+    """根据新增和移除的(院系, 课程, 状态)计算各课程计数的增量"""
+    deltas = defaultdict(lambda: [0, 0])
+    for keys, sign in ((added, 1), (removed, -1)):
+        for key in keys:
+            course, pending, total = _contribution(key)
+            deltas[course][0] += sign * pending
+            deltas[course][1] += sign * total
+    return {course: tuple(delta) for course, delta in deltas.items() if any(delta)}
+
+
+def apply_demand_deltas(deltas):
+    """
+    按课程原子递增计数，计数行不存在时创建。
+    计数已出现偏差时递减到0为止，不违反非负约束而让申请的写入失败，偏差由rebuild_course_demand修复。
+    """
+    now = timezone.now()
+    for (department_name, course_number), (pending, total) in deltas.items():
+        counters = CourseDemand.objects.filter(department_name=department_name, course_number=course_number)
+        increment = {
+            'pending_count': Greatest(F('pending_count') + pending, Value(0)),
+            'total_count': Greatest(F('total_count') + total, Value(0)),
+            'updated_at': now,
+        }
+        if counters.update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                CourseDemand.objects.create(
+                    department_name=department_name,
+                    course_number=course_number,
+                    pending_count=max(pending, 0),
+                    total_count=max(total, 0),
+                )
+        except IntegrityError:
+            # 其他请求已并发创建了该课程的计数行
+            counters.update(**increment)
+
+
+def record_created(join_requests):
+    """bulk_create不发送post_save信号，批量创建后需要显式调用"""
+    apply_demand_deltas(demand_deltas(added=[join_request.demand_key() for join_request in join_requests]))
+
+
+def rebuild_course_demand():
+    """从JoinRequest表重新汇总全部课程计数，用于计数出现偏差时修复"""
+    rows = (
+        JoinRequest.objects.order_by()
+        .values('department_name', 'course_number')
+        .annotate(total_count=Count('id'), pending_count=Count('id', filter=Q(status='pending')))
+    )
+    with transaction.atomic():
+        CourseDemand.objects.all().delete()
+        CourseDemand.objects.bulk_create(
+            (CourseDemand(**row) for row in rows.iterator()),
+            batch_size=1000,
+        )
+    return CourseDemand.objects.count()
+
+
+def bulk_update_status(queryset, status):
+    """
+    以一条UPDATE ... WHERE批量修改申请状态并维护updated_at，返回受影响的行数。
+    状态已是目标值的行不会被更新；先锁定选中的行，课程需求计数按锁定的行汇总后一并调整，
+    避免并发的状态修改在汇总和UPDATE之间改变这些行。
+    """
+    queryset = queryset.exclude(status=status)
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update()
+            .order_by('pk')
+            .values_list('pk', 'department_name', 'course_number', 'status')
+        )
+        if not rows:
+            return 0
+        updated = JoinRequest.objects.filter(pk__in=[row[0] for row in rows]).update(
+            status=status, updated_at=timezone.now()
+        )
+        deltas = defaultdict(lambda: [0, 0])
+        for _, department_name, course_number, previous in rows:
+            course = (department_name, course_number)
+            if previous == 'pending':
+                deltas[course][0] -= 1
+            if status == 'pending':
+                deltas[course][0] += 1
+        apply_demand_deltas({course: tuple(delta) for course, delta in deltas.items() if any(delta)})
+    return updated
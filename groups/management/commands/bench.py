@@ -0,0 +1,49 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from groups.benchmark import SCENARIOS, run_benchmark, seed_dataset
+from usccoursemate.benchmark import temporary_test_database
+
+
+class Command(BaseCommand):
+    help = '在临时测试数据库中生成合成数据，用测试客户端压测主要接口，以JSON输出延迟百分位、每秒请求数和每请求SQL查询数'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--communities', type=int, default=1000, help='群组数量')
+        parser.add_argument('--join-requests', type=int, default=5000, help='加群申请数量')
+        parser.add_argument('--users', type=int, default=500, help='用户数量（至少1个）')
+        parser.add_argument('--requests', type=int, default=200, help='每个场景计入统计的请求数')
+        parser.add_argument('--warmup', type=int, default=10, help='每个场景的预热请求数')
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help='只运行指定场景，可重复；默认运行全部')
+        parser.add_argument('--seed', type=int, default=0, help='随机种子，相同种子生成相同的数据和请求序列')
+        parser.add_argument('--output', help='同时把结果写入该文件，便于在不同提交间比较')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users至少为1')
+
+        with temporary_test_database():
+            dataset = seed_dataset(
+                communities=options['communities'],
+                join_requests=options['join_requests'],
+                users=options['users'],
+                seed=options['seed'],
+            )
+            scenarios = run_benchmark(
+                dataset,
+                requests=options['requests'],
+                warmup=options['warmup'],
+                scenarios=options['scenario'],
+                seed=options['seed'],
+            )
+
+        result = json.dumps({
+            'dataset': {key: options[key] for key in ('communities', 'join_requests', 'users', 'seed')},
+            'scenarios': scenarios,
+        }, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(result + '\n', encoding='utf-8')
+        self.stdout.write(result)
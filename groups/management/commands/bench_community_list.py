@@ -0,0 +1,51 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from groups.benchmark import seed_dataset
+from groups.models import Community
+from groups.serializers import COMMUNITY_COLUMNS, CommunitySerializer, serialize_community_rows
+from usccoursemate.benchmark import temporary_test_database
+
+
+def drf_list():
+    return CommunitySerializer(Community.objects.all(), many=True).data
+
+
+def fast_list():
+    return serialize_community_rows(Community.objects.values_list(*COMMUNITY_COLUMNS))
+
+
+class Command(BaseCommand):
+    help = '比较群组列表的DRF序列化器与values_list快速路径（查询+序列化+JSON渲染），并校验输出逐字节一致'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--communities', type=int, default=3000, help='群组数量')
+        parser.add_argument('--repeat', type=int, default=20, help='每种实现的重复次数，取中位数')
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        with temporary_test_database():
+            seed_dataset(communities=options['communities'], join_requests=0, users=1)
+            timings = {}
+            outputs = {}
+            for name, build in (('serializer', drf_list), ('values_list', fast_list)):
+                samples = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    outputs[name] = renderer.render(build())
+                    samples.append(time.perf_counter() - started)
+                timings[name] = statistics.median(samples)
+
+        if outputs['serializer'] != outputs['values_list']:
+            raise CommandError('快速路径的输出与CommunitySerializer不一致')
+        self.stdout.write(json.dumps({
+            'communities': options['communities'],
+            'serializer_ms': round(timings['serializer'] * 1000, 2),
+            'values_list_ms': round(timings['values_list'] * 1000, 2),
+            'speedup': round(timings['serializer'] / timings['values_list'], 1),
+            'identical_bytes': True,
+        }, indent=2))
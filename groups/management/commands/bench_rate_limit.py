@@ -0,0 +1,127 @@
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+
+from groups.benchmark import UNLIMITED_RATE, bench_jwt_secret, run_scenario, seed_dataset, unlimited_rates
+from usccoursemate.benchmark import temporary_test_database
+from usccoursemate import throttling
+from usccoursemate.throttling import SharedTokenBuckets, parse_rate
+
+# 走限流路径的场景
+SCENARIOS = ('join_request_create', 'sync_user')
+WARMUP = 20
+
+
+def _consume_loop(path, groups, keys, operations, start):
+    """在子进程中对共享文件执行operations次consume，等待start后同时开始"""
+    buckets = SharedTokenBuckets(path, groups)
+    capacity, refill_rate = parse_rate(UNLIMITED_RATE)
+    rng = random.Random(os.getpid())
+    names = [f'bench:{index}' for index in range(keys)]
+    start.wait()
+    for _ in range(operations):
+        buckets.consume(rng.choice(names), capacity, refill_rate)
+
+
+class Command(BaseCommand):
+    help = (
+        '测量令牌桶限流的开销：单进程每次consume的耗时、多进程共享同一文件时的吞吐，'
+        '以及开启/关闭限流时创建申请和同步用户接口的延迟差'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=100000, help='每个进程的consume次数')
+        parser.add_argument('--processes', type=int, default=4, help='并发进程数')
+        parser.add_argument('--keys', type=int, default=1000, help='不同键的数量')
+        parser.add_argument('--requests', type=int, default=300, help='每个接口场景的请求数')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratelimit.bin')
+            groups = settings.RATE_LIMITS['GROUPS']
+            results = {
+                'consume_us': self.single_process(path, groups, options),
+                'multi_process': self.multi_process(path, groups, options),
+            }
+            with override_settings(RATE_LIMITS={**settings.RATE_LIMITS, 'FILE': path}):
+                results['endpoints'] = self.endpoints(options['requests'])
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def single_process(self, path, groups, options):
+        buckets = SharedTokenBuckets(path, groups)
+        capacity, refill_rate = parse_rate(UNLIMITED_RATE)
+        names = [f'bench:{index}' for index in range(options['keys'])]
+        rng = random.Random(0)
+        sequence = [rng.choice(names) for _ in range(options['operations'])]
+        started = time.perf_counter()
+        for name in sequence:
+            buckets.consume(name, capacity, refill_rate)
+        return round((time.perf_counter() - started) / len(sequence) * 1e6, 2)
+
+    def multi_process(self, path, groups, options):
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        start = context.Event()
+        workers = [
+            context.Process(target=_consume_loop, args=(path, groups, options['keys'], options['operations'], start))
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        started = time.perf_counter()
+        start.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        total = options['processes'] * options['operations']
+        return {'processes': options['processes'], 'ops_per_second': round(total / elapsed)}
+
+    def endpoints(self, requests):
+        """
+        比较限流开启（速率足够高、全部放行）和关闭时接口的延迟。两者之差小于测量噪声，
+        因此另外直接统计开启时每个请求花在限流检查上的时间。
+        """
+        results = {}
+        with temporary_test_database():
+            dataset = seed_dataset(communities=100, join_requests=0, users=200)
+            client = Client()
+            with unlimited_rates(), bench_jwt_secret():
+                config = settings.RATE_LIMITS
+                for name in SCENARIOS:
+                    with override_settings(RATE_LIMITS={**config, 'ENABLED': False}):
+                        disabled = run_scenario(name, client, random.Random(0), dataset, requests, WARMUP)
+                    timer = CheckTimer(throttling.rate_limit_wait)
+                    with override_settings(RATE_LIMITS={**config, 'ENABLED': True}), \
+                            mock.patch.object(throttling, 'rate_limit_wait', timer):
+                        enabled = run_scenario(name, client, random.Random(0), dataset, requests, WARMUP)
+                    per_request_us = timer.seconds / (requests + WARMUP) * 1e6
+                    results[name] = {
+                        'disabled_p50_ms': disabled['p50_ms'],
+                        'enabled_p50_ms': enabled['p50_ms'],
+                        'limiter_us_per_request': round(per_request_us, 1),
+                        'limiter_share_of_p50': f"{per_request_us / 1000 / enabled['p50_ms']:.2%}",
+                    }
+        return results
+
+
+class CheckTimer:
+    """包装rate_limit_wait，累计限流检查的耗时"""
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - started
@@ -0,0 +1,13 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from groups.snapshot import write_catalog_snapshot
+
+
+class Command(BaseCommand):
+    help = '生成预渲染、预压缩的群组目录快照（完整目录及各类型目录）到STATIC_ROOT，并更新清单'
+
+    def handle(self, *args, **options):
+        manifest = write_catalog_snapshot(force=True)
+        self.stdout.write(json.dumps(manifest, indent=2))
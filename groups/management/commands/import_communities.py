@@ -0,0 +1,119 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from groups.cache import bump_catalog_version
+from groups.models import Community
+from groups.serializers import CommunitySerializer
+
+# 冲突时需要更新的字段；文件中未提供二维码的行不覆盖已有的qr_code
+UPDATE_FIELDS = ['name', 'number', 'updated_at']
+
+
+class CommunityRowSerializer(CommunitySerializer):
+    """导入时按(type, code)更新已有群组，不做唯一性校验，也不逐行查询数据库"""
+
+    class Meta(CommunitySerializer.Meta):
+        validators = []
+
+
+class Command(BaseCommand):
+    help = '从CSV或JSONL文件流式批量导入群组，按(type, code)进行upsert'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV或JSONL文件路径')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='文件格式，默认根据扩展名判断')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的行数')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'文件不存在: {path}')
+        file_format = options['format'] or ('jsonl' if path.suffix in ('.jsonl', '.ndjson') else 'csv')
+        batch_size = max(1, options['batch_size'])
+        self.verbosity = options['verbosity']
+
+        started = time.perf_counter()
+        total = upserted = invalid = 0
+        batch = {}
+
+        with path.open(newline='', encoding='utf-8') as source:
+            for line_number, row in self.read_rows(source, file_format):
+                total += 1
+                instance = self.validate_row(line_number, row)
+                if instance is None:
+                    invalid += 1
+                    continue
+                # 同一批次内重复的(type, code)以最后一行为准
+                batch[(instance.type, instance.code)] = (instance, 'qr_code' in row or 'qrCode' in row)
+                if len(batch) >= batch_size:
+                    upserted += self.flush(batch)
+                    self.report(total, upserted, invalid, started)
+
+        if batch:
+            upserted += self.flush(batch)
+        if upserted:
+            bump_catalog_version()
+
+        self.report(total, upserted, invalid, started, final=True)
+
+    def read_rows(self, source, file_format):
+        """逐行读取，内存占用与文件大小无关"""
+        if file_format == 'csv':
+            for index, row in enumerate(csv.DictReader(source), start=2):
+                yield index, row
+            return
+        for index, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                self.stderr.write(f'第{index}行: JSON解析失败: {e}')
+                row = {}
+            if not isinstance(row, dict):
+                self.stderr.write(f'第{index}行: 不是JSON对象')
+                row = {}
+            yield index, row
+
+    def validate_row(self, line_number, row):
+        """复用CommunitySerializer的字段规则校验一行数据"""
+        data = dict(row)
+        if 'qr_code' in data:
+            data['qrCode'] = data.pop('qr_code')
+        data.setdefault('qrCode', Community._meta.get_field('qr_code').default)
+        serializer = CommunityRowSerializer(data=data)
+        if not serializer.is_valid():
+            self.stderr.write(f'第{line_number}行: {json.dumps(serializer.errors, ensure_ascii=False)}')
+            return None
+        return Community(**serializer.validated_data)
+
+    def flush(self, batch):
+        with_qr = [instance for instance, has_qr in batch.values() if has_qr]
+        without_qr = [instance for instance, has_qr in batch.values() if not has_qr]
+        with transaction.atomic():
+            for instances, update_fields in ((with_qr, UPDATE_FIELDS + ['qr_code']), (without_qr, UPDATE_FIELDS)):
+                if instances:
+                    Community.objects.bulk_create(
+                        instances,
+                        update_conflicts=True,
+                        unique_fields=['type', 'code'],
+                        update_fields=update_fields,
+                    )
+        count = len(batch)
+        batch.clear()
+        return count
+
+    def report(self, total, upserted, invalid, started, final=False):
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed > 0 else 0.0
+        message = f'已处理 {total} 行，写入 {upserted} 行，无效 {invalid} 行，耗时 {elapsed:.2f}s（{rate:.0f} 行/秒）'
+        if final:
+            self.stdout.write(self.style.SUCCESS(message))
+        elif self.verbosity > 1:
+            self.stdout.write(message)
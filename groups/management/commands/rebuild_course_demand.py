@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from groups.demand import rebuild_course_demand
+
+
+class Command(BaseCommand):
+    help = '从加群申请表重新汇总课程需求计数'
+
+    def handle(self, *args, **options):
+        count = rebuild_course_demand()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 门课程的需求计数'))
@@ -0,0 +1,100 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from groups.cache import bump_catalog_version
+from groups.models import Community
+from groups.qr import (
+    default_url,
+    generated_url_re,
+    is_rendered,
+    qr_digest,
+    qr_dir,
+    qr_formats,
+    qr_payload,
+    render_qr_files,
+)
+
+# 生成的文件名：{哈希}-{尺寸}.{格式}；临时文件以.开头，不会匹配
+GENERATED_NAME_RE = re.compile(r'^([0-9a-f]{12})-\d+\.\w+$')
+
+
+class Command(BaseCommand):
+    help = (
+        '为使用占位图或自动生成二维码的群组渲染各尺寸的PNG/WebP二维码，'
+        '内容未变化的群组跳过，多个二维码在进程池中并行渲染'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='渲染进程数，1表示在当前进程中渲染')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批更新的群组数')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        directory = qr_dir()
+        sizes, formats = settings.QR_CODES['SIZES'], qr_formats()
+        placeholder = Community._meta.get_field('qr_code').default
+        generated = generated_url_re()
+
+        # 手动上传的二维码保持不变
+        targets, pending = {}, {}
+        for pk, community_type, code, qr_code in Community.objects.values_list('id', 'type', 'code', 'qr_code'):
+            if qr_code != placeholder and not generated.search(qr_code):
+                continue
+            payload = qr_payload(community_type, code)
+            digest = qr_digest(payload)
+            targets[pk] = (qr_code, digest)
+            if digest not in pending and not is_rendered(directory, digest, sizes, formats):
+                pending[digest] = payload
+
+        written = self.render(pending, directory, sizes, formats, options['workers'])
+
+        if settings.QR_CODES['BASE_URL']:
+            changed = [
+                Community(pk=pk, qr_code=default_url(digest))
+                for pk, (qr_code, digest) in targets.items()
+                if qr_code != default_url(digest)
+            ]
+        else:
+            # 没有后端的公开地址时无法生成前端可用的完整地址，只渲染文件，不修改群组
+            self.stderr.write('未设置BACKEND_URL（或RENDER_EXTERNAL_URL），不更新群组的qr_code')
+            changed = []
+        if changed:
+            with transaction.atomic():
+                Community.objects.bulk_update(changed, ['qr_code'], batch_size=max(1, options['batch_size']))
+            # bulk_update不触发信号，手动使目录缓存失效
+            bump_catalog_version()
+
+        removed = self.prune(directory, {digest for _, digest in targets.values()})
+        self.stdout.write(
+            f'共{len(targets)}个群组使用生成的二维码：渲染{len(pending)}个（{written}个文件），'
+            f'更新{len(changed)}个群组，删除{removed}个旧文件，耗时{time.perf_counter() - started:.2f}秒'
+        )
+
+    def render(self, pending, directory, sizes, formats, workers):
+        if not pending:
+            return 0
+        jobs = [(payload, digest, str(directory), sizes, formats) for digest, payload in pending.items()]
+        if workers <= 1 or len(jobs) == 1:
+            return sum(render_qr_files(*job) for job in jobs)
+        # 子进程不使用数据库，fork前关闭连接避免子进程继承套接字
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(render_qr_files, *zip(*jobs), chunksize=max(1, len(jobs) // (workers * 4))))
+
+    def prune(self, directory, digests):
+        """删除不再被任何群组引用的生成文件"""
+        if not directory.exists():
+            return 0
+        removed = 0
+        for path in directory.iterdir():
+            match = GENERATED_NAME_RE.match(path.name)
+            if match and match.group(1) not in digests:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
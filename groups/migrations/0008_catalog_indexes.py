@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:21
+
+from django.db import migrations, models
+
+from usccoursemate.operations import AddIndexConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL的CREATE INDEX CONCURRENTLY不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('groups', '0007_remove_joinrequest_user_name'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='community',
+            index=models.Index(fields=['type', 'code', 'id'], name='community_type_code_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='community',
+            index=models.Index(fields=['updated_at'], name='community_updated_at_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='joinrequest',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='joinreq_status_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='joinrequest',
+            index=models.Index(fields=['-created_at', '-id'], name='joinreq_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='joinrequest',
+            index=models.Index(fields=['updated_at'], name='joinreq_updated_at_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """仅在PostgreSQL上创建pg_trgm的GIN索引，其他数据库使用进程内前缀索引"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Community = apps.get_model('groups', 'Community')
+    table = schema_editor.quote_name(Community._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in ('code', 'name'):
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS community_{column}_trgm_idx '
+            f'ON {table} USING gin ({schema_editor.quote_name(column)} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in ('code', 'name'):
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS community_{column}_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('groups', '0008_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
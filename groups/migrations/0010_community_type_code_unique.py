@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+from usccoursemate.operations import AddUniqueConstraintConcurrentlyIfSupported
+
+
+class Migration(migrations.Migration):
+
+    # PostgreSQL的CREATE UNIQUE INDEX CONCURRENTLY不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('groups', '0009_community_trigram_indexes'),
+    ]
+
+    operations = [
+        AddUniqueConstraintConcurrentlyIfSupported(
+            model_name='community',
+            constraint=models.UniqueConstraint(fields=('type', 'code'), name='community_type_code_uniq'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:25
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_course_demand(apps, schema_editor):
+    """根据已有的加群申请初始化课程需求计数"""
+    JoinRequest = apps.get_model('groups', 'JoinRequest')
+    CourseDemand = apps.get_model('groups', 'CourseDemand')
+    rows = (
+        JoinRequest.objects.order_by()
+        .values('department_name', 'course_number')
+        .annotate(total_count=Count('id'), pending_count=Count('id', filter=Q(status='pending')))
+    )
+    CourseDemand.objects.bulk_create((CourseDemand(**row) for row in rows.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0010_community_type_code_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseDemand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department_name', models.CharField(max_length=100, verbose_name='院系名称')),
+                ('course_number', models.CharField(max_length=50, verbose_name='课程编号')),
+                ('pending_count', models.PositiveIntegerField(default=0, verbose_name='待处理申请数')),
+                ('total_count', models.PositiveIntegerField(default=0, verbose_name='申请总数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '课程需求',
+                'verbose_name_plural': '课程需求',
+                'ordering': ['-pending_count', '-total_count'],
+                'indexes': [models.Index(fields=['-pending_count', '-total_count'], name='coursedemand_pending_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='coursedemand',
+            constraint=models.UniqueConstraint(fields=('department_name', 'course_number'), name='coursedemand_course_uniq'),
+        ),
+        migrations.RunPython(populate_course_demand, migrations.RunPython.noop),
+    ]
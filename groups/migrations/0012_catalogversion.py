@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:17
+
+from django.db import migrations, models
+
+
+def create_catalog_version(apps, schema_editor):
+    apps.get_model('groups', 'CatalogVersion').objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('groups', '0011_coursedemand'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=1, verbose_name='版本号')),
+                ('changed_at', models.DateTimeField(blank=True, null=True, verbose_name='最近变化时间')),
+            ],
+            options={
+                'verbose_name': '群组目录版本',
+                'verbose_name_plural': '群组目录版本',
+            },
+        ),
+        migrations.RunPython(create_catalog_version, migrations.RunPython.noop),
+    ]
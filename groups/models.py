@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
 
 class Community(models.Model):
@@ -24,6 +24,15 @@ class Community(models.Model):
         verbose_name = "群组"
         verbose_name_plural = "群组"
         ordering = ['type', 'code']
+        indexes = [
+            # 按类型过滤并按(type, code)排序，id为游标分页的决胜字段
+            models.Index(fields=['type', 'code', 'id'], name='community_type_code_idx'),
+            models.Index(fields=['updated_at'], name='community_updated_at_idx'),
+        ]
+        constraints = [
+            # 批量导入按(type, code)进行upsert
+            models.UniqueConstraint(fields=['type', 'code'], name='community_type_code_uniq'),
+        ]
 
 class JoinRequest(models.Model):
     """用户申请加入群组的请求"""
@@ -46,7 +55,72 @@ class JoinRequest(models.Model):
             return f"{self.department_name} - {self.course_number} (by {self.user.username})"
         return f"{self.department_name} - {self.course_number}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录读取时的课程和状态，保存时据此维护课程需求计数
+        instance._loaded_demand_key = instance.demand_key()
+        return instance
+    
+    def demand_key(self):
+        """(院系, 课程, 状态)；延迟加载的字段不触发查询，返回None"""
+        fields = ('department_name', 'course_number', 'status')
+        if any(name not in self.__dict__ for name in fields):
+            return None
+        return tuple(self.__dict__[name] for name in fields)
+
+    def save(self, *args, **kwargs):
+        # 课程需求计数在post_save信号中更新，与申请的写入放在同一事务中
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(type(self), instance=self)):
+            return super().delete(*args, **kwargs)
+    
     class Meta:
         verbose_name = "加群申请"
         verbose_name_plural = "加群申请"
         ordering = ['-created_at']
+        indexes = [
+            # 按状态过滤并按创建时间倒序排列
+            models.Index(fields=['status', '-created_at', '-id'], name='joinreq_status_created_idx'),
+            models.Index(fields=['-created_at', '-id'], name='joinreq_created_idx'),
+            models.Index(fields=['updated_at'], name='joinreq_updated_at_idx'),
+        ]
+
+class CourseDemand(models.Model):
+    """按课程汇总的加群申请数量，随申请的创建、状态变化和删除实时维护"""
+    department_name = models.CharField(max_length=100, verbose_name="院系名称")
+    course_number = models.CharField(max_length=50, verbose_name="课程编号")
+    pending_count = models.PositiveIntegerField(default=0, verbose_name="待处理申请数")
+    total_count = models.PositiveIntegerField(default=0, verbose_name="申请总数")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新时间")
+    
+    def __str__(self):
+        return f"{self.department_name} - {self.course_number}: {self.pending_count}"
+    
+    class Meta:
+        verbose_name = "课程需求"
+        verbose_name_plural = "课程需求"
+        ordering = ['-pending_count', '-total_count']
+        constraints = [
+            models.UniqueConstraint(fields=['department_name', 'course_number'], name='coursedemand_course_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['-pending_count', '-total_count'], name='coursedemand_pending_idx'),
+        ]
+
+class CatalogVersion(models.Model):
+    """群组目录版本号，只有一行。每次目录变化时原子递增，只增不减，进程内的目录缓存以它为键"""
+    SINGLETON_PK = 1
+
+    version = models.BigIntegerField(default=1, verbose_name="版本号")
+    changed_at = models.DateTimeField(null=True, blank=True, verbose_name="最近变化时间")
+    
+    def __str__(self):
+        return f"v{self.version}"
+    
+    class Meta:
+        verbose_name = "群组目录版本"
+        verbose_name_plural = "群组目录版本"
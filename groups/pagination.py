@@ -0,0 +1,108 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    基于键集（游标）的分页，按模型Meta.ordering加主键排序，
+    通过WHERE条件定位下一页，因此任意一页的代价都与第一页相同。
+
+    仅当请求带有page_size或cursor参数时才分页，旧客户端仍获得完整列表。
+    """
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    default_page_size = 50
+    max_page_size = 200
+    invalid_cursor_message = '无效的游标'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if self.page_size is None:
+            return None
+
+        self.request = request
+        self.ordering = self.get_ordering(queryset.model)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = self.decode_cursor(request, queryset.model)
+        if cursor is not None:
+            queryset = queryset.filter(self.build_keyset_filter(cursor))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        params = request.query_params
+        if self.page_size_query_param not in params and self.cursor_query_param not in params:
+            return None
+        try:
+            page_size = int(params.get(self.page_size_query_param, self.default_page_size))
+        except (TypeError, ValueError):
+            page_size = self.default_page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, model):
+        """沿用模型的默认排序，并以主键作为唯一的决胜字段"""
+        ordering = list(model._meta.ordering)
+        pk_name = model._meta.pk.name
+        if not any(field.lstrip('-') in (pk_name, 'pk') for field in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f"-{pk_name}" if descending else pk_name)
+        return ordering
+
+    def build_keyset_filter(self, values):
+        """展开为 (a > x) OR (a = x AND b > y) OR ... 形式的条件"""
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f"{name}__{lookup}": values[index]})
+            for previous, value in zip(self.ordering[:index], values[:index]):
+                clause &= Q(**{previous.lstrip('-'): value})
+            condition |= clause
+        return condition
+
+    def encode_cursor(self, instance):
+        model = type(instance)
+        values = [
+            model._meta.get_field(field.lstrip('-')).value_to_string(instance)
+            for field in self.ordering
+        ]
+        raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
@@ -0,0 +1,119 @@
+"""
+群组二维码渲染。本模块不导入模型，可以直接在进程池的子进程中使用。
+文件名为{内容哈希}-{尺寸}.{格式}，哈希由二维码内容和渲染参数决定，内容不变时不会重新渲染。
+文件写入STATIC_ROOT下的子目录，与群组目录快照一样由WhiteNoise以长缓存头提供。
+"""
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from urllib.parse import quote, urljoin
+
+import qrcode
+from django.conf import settings
+from PIL import Image, features
+
+# 渲染方式（纠错级别、边距、编码参数）变化时递增，使所有图片重新生成
+RENDER_VERSION = 1
+
+# 二维码四周的空白模块数，扫码要求至少4个
+BORDER = 4
+
+
+def qr_dir():
+    return Path(settings.STATIC_ROOT) / settings.QR_CODES['SUBDIR']
+
+
+def qr_url(name):
+    """完整地址：前端页面与后端不同源，相对路径会按前端的域名解析"""
+    path = urljoin(urljoin('/', settings.STATIC_URL), f"{settings.QR_CODES['SUBDIR']}/{name}")
+    return settings.QR_CODES['BASE_URL'].rstrip('/') + path
+
+
+def generated_url_re():
+    """匹配此前生成的地址，不论域名和静态/媒体前缀，用于区分手动上传的二维码"""
+    return re.compile('/' + re.escape(settings.QR_CODES['SUBDIR']) + r'/[0-9a-f]{12}-\d+\.png$')
+
+
+def qr_formats():
+    # WebP需要Pillow编译时带libwebp
+    return [fmt for fmt in settings.QR_CODES['FORMATS'] if fmt != 'webp' or features.check('webp')]
+
+
+def qr_payload(community_type, code):
+    """二维码内容：前端的群组页面地址"""
+    return settings.QR_CODES['URL_TEMPLATE'].format(type=quote(community_type, safe=''), code=quote(code, safe=''))
+
+
+def qr_digest(payload):
+    return hashlib.sha256(f'{RENDER_VERSION}:{payload}'.encode('utf-8')).hexdigest()[:12]
+
+
+def file_name(digest, size, fmt):
+    return f'{digest}-{size}.{fmt}'
+
+
+def default_url(digest):
+    """写入Community.qr_code的地址：默认尺寸的PNG，其他尺寸和格式替换文件名中的尺寸和扩展名即可"""
+    return qr_url(file_name(digest, settings.QR_CODES['DEFAULT_SIZE'], 'png'))
+
+
+def is_rendered(directory, digest, sizes, formats):
+    return all((directory / file_name(digest, size, fmt)).exists() for size in sizes for fmt in formats)
+
+
+def render_matrix(payload):
+    """返回每个模块一个像素的灰度图（含边距），0为黑、255为白"""
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=1, border=BORDER)
+    code.add_data(payload)
+    code.make(fit=True)
+    matrix = code.get_matrix()
+    image = Image.new('L', (len(matrix), len(matrix)), 255)
+    image.putdata([0 if dark else 255 for row in matrix for dark in row])
+    return image
+
+
+def _scaled(matrix_image, size):
+    """按整数倍放大保证模块边缘清晰，再居中放到size×size的白底上"""
+    modules = matrix_image.width
+    scale = max(1, size // modules)
+    scaled = matrix_image.resize((modules * scale, modules * scale), Image.NEAREST)
+    if scaled.width >= size:
+        return scaled
+    canvas = Image.new('L', (size, size), 255)
+    offset = (size - scaled.width) // 2
+    canvas.paste(scaled, (offset, offset))
+    return canvas
+
+
+def _encode(image, fmt, path):
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix='.', suffix='.tmp', delete=False) as temp:
+        if fmt == 'png':
+            # 黑白两色，1位PNG体积最小
+            image.convert('1', dither=Image.NONE).save(temp, 'PNG', optimize=True)
+        else:
+            # 无损压缩；method=6比4慢两个数量级，对二维码几乎不减小体积
+            image.save(temp, 'WEBP', lossless=True, quality=100, method=4)
+    os.replace(temp.name, path)
+
+
+def render_qr_files(payload, digest, directory, sizes, formats):
+    """
+    渲染一个二维码的所有尺寸和格式，返回写入的文件数。
+    参数均为普通值，供进程池调用；文件已存在（内容相同）时跳过。
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    matrix_image = None
+    written = 0
+    for size in sizes:
+        for fmt in formats:
+            path = directory / file_name(digest, size, fmt)
+            if path.exists():
+                continue
+            if matrix_image is None:
+                matrix_image = render_matrix(payload)
+            _encode(_scaled(matrix_image, size), fmt, path)
+            written += 1
+    return written
@@ -0,0 +1,192 @@
+import bisect
+import re
+import threading
+from collections import Counter
+from typing import NamedTuple
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, Lookup, Q, Value, When
+from django.db.models.functions import Greatest
+
+from .cache import get_catalog_version
+from .models import Community
+from .serializers import COMMUNITY_COLUMNS, serialize_community_rows
+
+# 与pg_trgm默认的相似度阈值保持一致
+SIMILARITY_THRESHOLD = 0.3
+
+_WORD_RE = re.compile(r'[^\W_]+')
+_SEPARATOR_RE = re.compile(r'[\s\-_]+')
+
+
+def normalize(text):
+    """统一大小写并去掉空格和连字符，使"CSCI 5"能匹配"CSCI570" """
+    return _SEPARATOR_RE.sub('', text or '').lower()
+
+
+def trigrams(text):
+    """按pg_trgm的规则生成三元组：按词切分，词首补两个空格、词尾补一个空格"""
+    result = set()
+    for word in _WORD_RE.findall((text or '').lower()):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class IndexData(NamedTuple):
+    """某个目录版本的完整索引，构建完成后整体替换，搜索中途不会混用新旧两份数据"""
+    version: int
+    entries: list
+    code_keys: list
+    name_keys: list
+    trigram_indexes: list
+
+
+class PrefixIndex:
+    """
+    进程内的群组搜索索引，用于不支持pg_trgm的数据库（如SQLite）。
+
+    code和name各维护一份有序键列表用于二分查找前缀，另有三元组倒排表用于模糊匹配。
+    索引绑定目录版本号，群组变化后下次搜索时自动重建。
+    """
+
+    def __init__(self):
+        self.data = None
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.data.version if self.data is not None else None
+
+    def ensure_current(self):
+        """返回当前版本的索引数据；读取方只持有返回值，不再访问self.data"""
+        version = get_catalog_version()
+        data = self.data
+        if data is None or data.version != version:
+            with self._lock:
+                data = self.data
+                if data is None or data.version != version:
+                    data = self.data = self.build(version)
+        return data
+
+    def build(self, version):
+        entries = serialize_community_rows(Community.objects.values_list(*COMMUNITY_COLUMNS))
+        return IndexData(
+            version=version,
+            entries=entries,
+            code_keys=sorted((normalize(entry['code']), i) for i, entry in enumerate(entries)),
+            name_keys=sorted((normalize(entry['name']), i) for i, entry in enumerate(entries)),
+            # code和name分别建立三元组倒排表，相似度取两者中的较大值，与PostgreSQL路径一致
+            trigram_indexes=[self._build_postings(entry['code'] for entry in entries),
+                             self._build_postings(entry['name'] for entry in entries)],
+        )
+
+    def _build_postings(self, values):
+        sizes, postings = [], {}
+        for i, value in enumerate(values):
+            grams = trigrams(value)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        return sizes, postings
+
+    def _prefix_matches(self, keys, prefix):
+        start = bisect.bisect_left(keys, (prefix,))
+        for key, i in keys[start:]:
+            if not key.startswith(prefix):
+                break
+            yield i
+
+    def search(self, query, limit, community_type=None):
+        data = self.ensure_current()
+        scores = {}
+
+        prefix = normalize(query)
+        if prefix:
+            # code前缀匹配排在最前，其次是name前缀匹配，最后是按相似度排序的模糊匹配
+            for i in self._prefix_matches(data.code_keys, prefix):
+                scores[i] = 3.0
+            for i in self._prefix_matches(data.name_keys, prefix):
+                scores.setdefault(i, 2.0)
+
+        query_grams = trigrams(query)
+        for sizes, postings in data.trigram_indexes:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(postings.get(gram, ()))
+            for i, count in shared.items():
+                similarity = count / (len(query_grams) + sizes[i] - count)
+                if similarity >= SIMILARITY_THRESHOLD and similarity > scores.get(i, 0.0):
+                    scores[i] = similarity
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], data.entries[item[0]]['code']))
+        results = []
+        for i, _ in ranked:
+            entry = data.entries[i]
+            if community_type and entry['type'] != community_type:
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+
+prefix_index = PrefixIndex()
+
+
+class ILikePrefix(Lookup):
+    """
+    col ILIKE 'x%'。istartswith在PostgreSQL上生成UPPER(col::text) LIKE UPPER(...)，
+    列上的gin_trgm_ops索引无法用于这个表达式；ILIKE可以直接使用三元组GIN索引。
+    """
+    lookup_name = 'ilike_prefix'
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [connection.ops.prep_for_like_query(value) + '%']
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', [*lhs_params, *rhs_params]
+
+
+def postgres_search_queryset(query, community_type=None):
+    """PostgreSQL上使用pg_trgm的GIN索引完成前缀和相似度匹配，前缀和相似度条件都能由索引提供"""
+    from django.contrib.postgres.lookups import TrigramSimilar
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    compact = _SEPARATOR_RE.sub('', query)
+    code_prefix = ILikePrefix(F('code'), compact)
+    name_prefix = ILikePrefix(F('name'), query)
+    queryset = Community.objects.filter(
+        Q(code_prefix)
+        | Q(name_prefix)
+        | Q(TrigramSimilar(F('code'), Value(query)))
+        | Q(TrigramSimilar(F('name'), Value(query)))
+    )
+    if community_type:
+        queryset = queryset.filter(type=community_type)
+    return queryset.annotate(
+        rank=Case(
+            When(code_prefix, then=Value(3.0)),
+            When(name_prefix, then=Value(2.0)),
+            default=Greatest(TrigramSimilarity('code', query), TrigramSimilarity('name', query)),
+            output_field=FloatField(),
+        ),
+    ).order_by('-rank', 'code')
+
+
+def search_postgres(query, limit, community_type=None):
+    queryset = postgres_search_queryset(query, community_type)
+    return serialize_community_rows(queryset.values_list(*COMMUNITY_COLUMNS)[:limit])
+
+
+def search_communities(query, limit=10, community_type=None):
+    """按code/name前缀及模糊相似度搜索群组，返回排序后的前limit条"""
+    query = (query or '').strip()
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        return search_postgres(query, limit, community_type)
+    return prefix_index.search(query, limit, community_type)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Community, JoinRequest
+from rest_framework.validators import UniqueTogetherValidator
+from .models import Community, CourseDemand, JoinRequest
 
 class CommunitySerializer(serializers.ModelSerializer):
     """群组序列化器，将字段名称与前端保持一致"""
@@ -10,6 +11,8 @@ class CommunitySerializer(serializers.ModelSerializer):
     class Meta:
         model = Community
         fields = ['id', 'code', 'name', 'number', 'qrCode', 'type']
+        # DRF不会根据Meta.constraints生成校验，重复的(type, code)在这里返回400而不是保存时出错
+        validators = [UniqueTogetherValidator(queryset=Community.objects.all(), fields=('type', 'code'))]
         
     def to_representation(self, instance):
         """确保id也作为字符串被输出"""
@@ -18,10 +21,26 @@ class CommunitySerializer(serializers.ModelSerializer):
         ret['id'] = str(instance.id)
         return ret
 
+
+# 只读快速路径读取的列，顺序与CommunitySerializer.Meta.fields一致
+COMMUNITY_COLUMNS = ('id', 'code', 'name', 'number', 'qr_code', 'type')
+
+
+def serialize_community_rows(rows):
+    """
+    把按COMMUNITY_COLUMNS排列的元组（values_list的结果）直接构造成与CommunitySerializer输出相同的字典，
+    跳过DRF逐行逐字段的处理，用于只读的列表和搜索响应
+    """
+    return [
+        {'id': str(pk), 'code': code, 'name': name, 'number': number, 'qrCode': qr_code, 'type': community_type}
+        for pk, code, name, number, qr_code, community_type in rows
+    ]
+
 class JoinRequestSerializer(serializers.ModelSerializer):
     """加群申请序列化器"""
     
-    user_id = serializers.IntegerField(source='user.id', required=False, allow_null=True)
+    # 直接读取外键列，列表序列化时不会逐行加载User
+    user_id = serializers.IntegerField(required=False, allow_null=True)
     user_email = serializers.EmailField(required=False, allow_null=True)
     
     class Meta:
@@ -30,10 +49,22 @@ class JoinRequestSerializer(serializers.ModelSerializer):
         read_only_fields = ['status', 'created_at', 'updated_at']
         
     def create(self, validated_data):
-        # 处理嵌套数据
-        user_data = validated_data.pop('user', None)
+        # 用户由视图校验存在后通过save(user=...)传入，忽略未经校验的user_id
+        validated_data.pop('user_id', None)
         
         # 创建申请
         join_request = JoinRequest.objects.create(**validated_data)
         
-        return join_request 
\ No newline at end of file
+        return join_request
+    
+    def update(self, instance, validated_data):
+        # 不允许通过更新接口改变申请所属用户
+        validated_data.pop('user_id', None)
+        return super().update(instance, validated_data)
+
+class CourseDemandSerializer(serializers.ModelSerializer):
+    """课程需求计数序列化器"""
+    
+    class Meta:
+        model = CourseDemand
+        fields = ['department_name', 'course_number', 'pending_count', 'total_count', 'updated_at']
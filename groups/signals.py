@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version
+from .demand import apply_demand_deltas, demand_deltas
+from .models import Community, JoinRequest
+
+
+@receiver([post_save, post_delete], sender=Community)
+def invalidate_catalog(sender, **kwargs):
+    """群组变化时在事务提交后递增目录版本号，避免提交前读到旧数据并写入新版本缓存"""
+    transaction.on_commit(bump_catalog_version)
+
+
+def uses_generated_qr(qr_code):
+    """占位图或此前自动生成的二维码，手动上传的不处理"""
+    # qrcode和Pillow延迟到用到时才导入，不拖慢启动
+    from .qr import generated_url_re
+
+    return qr_code == Community._meta.get_field('qr_code').default or bool(generated_url_re().search(qr_code))
+
+
+def render_community_qr(pk):
+    """
+    为单个群组渲染二维码并写入qr_code，与render_qr_codes的规则相同；文件已存在时不重复渲染。
+    旧文件由render_qr_codes统一清理
+    """
+    from .qr import default_url, qr_digest, qr_dir, qr_formats, qr_payload, render_qr_files
+
+    row = Community.objects.filter(pk=pk).values_list('type', 'code', 'qr_code').first()
+    if row is None or not uses_generated_qr(row[2]):
+        return
+    community_type, code, qr_code = row
+    payload = qr_payload(community_type, code)
+    digest = qr_digest(payload)
+    render_qr_files(payload, digest, qr_dir(), settings.QR_CODES['SIZES'], qr_formats())
+    url = default_url(digest)
+    # update()不触发信号；只在qr_code未被并发修改时写入
+    if url != qr_code and Community.objects.filter(pk=pk, qr_code=qr_code).update(qr_code=url):
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=Community)
+def render_qr_on_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """新建群组或代码、类型变化时在事务提交后生成二维码，不必等下次部署执行render_qr_codes"""
+    if raw or not settings.QR_CODES['BASE_URL'] or not uses_generated_qr(instance.qr_code):
+        return
+    if update_fields is not None and not {'type', 'code', 'qr_code'} & set(update_fields):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: render_community_qr(pk))
+
+
+@receiver(post_save, sender=JoinRequest)
+def update_demand_on_save(sender, instance, created, raw=False, **kwargs):
+    """新建申请或申请的课程、状态发生变化时更新课程需求计数"""
+    if raw:
+        return
+    current = instance.demand_key()
+    previous = None if created else getattr(instance, '_loaded_demand_key', None)
+    if not created and (previous is None or previous == current):
+        return
+    apply_demand_deltas(demand_deltas(added=[current], removed=[previous] if previous else []))
+    instance._loaded_demand_key = current
+
+
+@receiver(post_delete, sender=JoinRequest)
+def update_demand_on_delete(sender, instance, **kwargs):
+    key = getattr(instance, '_loaded_demand_key', None) or instance.demand_key()
+    if key:
+        apply_demand_deltas(demand_deltas(removed=[key]))
@@ -0,0 +1,143 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urljoin
+
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from .cache import get_catalog_version
+from .models import Community
+from .serializers import COMMUNITY_COLUMNS, serialize_community_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows开发环境没有fcntl，退化为不加锁
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # 未安装Brotli时只生成gzip版本
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def snapshot_dir():
+    return Path(settings.STATIC_ROOT) / settings.CATALOG_SNAPSHOT['SUBDIR']
+
+
+def snapshot_url(name):
+    """清单文件中保存的路径，不含域名，返回给客户端时由absolute_manifest补全"""
+    return urljoin(urljoin('/', settings.STATIC_URL), f"{settings.CATALOG_SNAPSHOT['SUBDIR']}/{name}")
+
+
+def absolute_manifest(manifest, request):
+    """
+    把清单中的路径换成完整地址：前端页面与后端不同源，相对路径会按前端的域名解析。
+    优先使用CATALOG_SNAPSHOT['BASE_URL']，未设置时按请求的域名和协议生成
+    """
+    base_url = settings.CATALOG_SNAPSHOT['BASE_URL'].rstrip('/')
+
+    def absolute(entry):
+        url = base_url + entry['url'] if base_url else request.build_absolute_uri(entry['url'])
+        return {**entry, 'url': url}
+
+    return {
+        **absolute(manifest),
+        'types': {key: absolute(entry) for key, entry in manifest['types'].items()},
+    }
+
+
+def render_catalog():
+    """生成(键, JSON字节)：'all'为完整目录，其余为各类型的目录，与/api/communities/[?type=]的响应逐字节一致"""
+    renderer = JSONRenderer()
+    entries = serialize_community_rows(Community.objects.values_list(*COMMUNITY_COLUMNS))
+    yield 'all', renderer.render(entries)
+    for community_type, _ in Community.COMMUNITY_TYPES:
+        yield community_type, renderer.render([entry for entry in entries if entry['type'] == community_type])
+
+
+def _atomic_write(path, content):
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, prefix='.', suffix='.tmp', delete=False) as temp:
+        temp.write(content)
+    os.replace(temp.name, path)
+
+
+def _write_once(path, content):
+    """文件名带内容哈希，已存在即内容相同；先写压缩版本，WhiteNoise发现主文件时压缩版本已就绪"""
+    if path.exists():
+        return
+    _atomic_write(path.with_name(path.name + '.gz'), gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _atomic_write(path.with_name(path.name + '.br'), brotli.compress(content))
+    _atomic_write(path, content)
+
+
+def read_manifest():
+    try:
+        return json.loads((snapshot_dir() / MANIFEST_NAME).read_bytes())
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def _snapshot_lock(directory):
+    """多个worker同时发现快照过期时只由一个生成"""
+    with open(directory / '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _referenced_names(manifest):
+    if not manifest:
+        return set()
+    return {entry['url'].rsplit('/', 1)[-1] for entry in [manifest, *manifest['types'].values()]}
+
+
+def write_catalog_snapshot(force=False):
+    """
+    按当前目录版本生成快照并更新清单，返回清单。
+    保留上一版清单引用的文件，供刚取到旧清单的客户端下载，更早的文件被删除。
+    """
+    directory = snapshot_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with _snapshot_lock(directory):
+        # 版本号在查询前读取：查询期间有新的变更时，清单版本落后，下次请求会再次生成
+        version = get_catalog_version()
+        previous = read_manifest()
+        if not force and previous and previous['version'] == version:
+            return previous
+
+        files = {}
+        for key, content in render_catalog():
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            name = f'catalog.{digest}.json' if key == 'all' else f'catalog-{key}.{digest}.json'
+            _write_once(directory / name, content)
+            files[key] = {'hash': digest, 'url': snapshot_url(name), 'size': len(content)}
+
+        manifest = {'version': version, **files.pop('all'), 'types': files}
+        _atomic_write(directory / MANIFEST_NAME, json.dumps(manifest).encode('utf-8'))
+
+        keep = _referenced_names(manifest) | _referenced_names(previous)
+        for path in directory.glob('catalog*.json*'):
+            if path.name.split('.json')[0] + '.json' not in keep:
+                path.unlink(missing_ok=True)
+    logger.info('已生成群组目录快照 %s（版本%s）', manifest['hash'], version)
+    return manifest
+
+
+def get_catalog_manifest():
+    """返回与当前目录版本一致的清单，群组变化后的首次调用会重新生成快照"""
+    manifest = read_manifest()
+    if manifest is None or manifest['version'] != get_catalog_version():
+        manifest = write_catalog_snapshot()
+    return manifest
@@ -1,3 +1,940 @@
-from django.test import TestCase
+import gzip
+import json
+import multiprocessing
+import tempfile
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from authentication.http import CallStatsRegistry
+from usccoursemate.db_router import PrimaryReplicaRouter, ReplicaHealth, health, primary_reads, replica_reads
+from usccoursemate.metrics import collector
+from usccoursemate.throttling import SharedTokenBuckets
+
+from .benchmark import SCENARIOS, run_benchmark, seed_dataset
+from .cache import bump_catalog_version, catalog_cache, get_catalog_version, search_cache
+from .models import CatalogVersion, Community, CourseDemand, JoinRequest
+from .qr import qr_digest, qr_dir, qr_formats, qr_payload, render_matrix
+from .search import postgres_search_queryset, prefix_index
+from .serializers import COMMUNITY_COLUMNS, CommunitySerializer, serialize_community_rows
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CommunityCacheTests(TestCase):
+    """群组目录缓存"""
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+            Community.objects.create(code='CS', name='Computer Science', type='major')
+
+    def test_repeated_list_is_served_without_queries(self):
+        first = self.client.get('/api/communities/', {'type': 'course'})
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/communities/', {'type': 'course'})
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(len(second.json()), 1)
+
+    def test_change_bumps_version_and_invalidates(self):
+        self.client.get('/api/communities/')
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI170', name='Discrete Methods', type='course')
+        self.assertEqual(get_catalog_version(), version + 1)
+        self.assertEqual(len(self.client.get('/api/communities/').json()), 3)
+
+    def test_version_survives_shared_cache_loss(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI170', name='Discrete Methods', type='course')
+        version = get_catalog_version()
+        self.assertEqual(CatalogVersion.objects.get().version, version)
+
+        # 共享缓存被清空（淘汰、临时目录被清理或重启）后从数据库读回，而不是回到1
+        caches[settings.CATALOG_CACHE['ALIAS']].clear()
+        self.assertEqual(get_catalog_version(), version)
+        caches[settings.CATALOG_CACHE['ALIAS']].clear()
+        self.assertEqual(bump_catalog_version(), version + 1)
+
+    def test_concurrent_bumps_are_not_lost(self):
+        version = get_catalog_version()
+        # 每次递增都在数据库中原子完成，不依赖共享缓存中读到的旧值
+        with mock.patch('groups.cache._version_cache') as shared:
+            shared.return_value.get.return_value = None
+            bump_catalog_version()
+            bump_catalog_version()
+        caches[settings.CATALOG_CACHE['ALIAS']].clear()
+        self.assertEqual(get_catalog_version(), version + 2)
+
+    def test_paginated_links_follow_request_host(self):
+        internal = self.client.get('/api/communities/', {'page_size': 1}).json()
+        self.assertTrue(internal['next'].startswith('http://testserver/'))
+        public = self.client.get('/api/communities/', {'page_size': 1}, HTTP_HOST='localhost', secure=True).json()
+        self.assertTrue(public['next'].startswith('https://localhost/'))
+
+    def test_duplicate_type_and_code_is_rejected(self):
+        self.client.force_authenticate(User.objects.create(username='moderator'))
+        payload = {'code': 'CSCI104', 'name': 'Duplicate', 'qrCode': '/qr/104.png', 'type': 'course'}
+        response = self.client.post('/api/communities/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+        # 同一代码在不同类型下可以共存
+        response = self.client.post('/api/communities/', {**payload, 'type': 'major'}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CommunityListFastPathTests(TestCase):
+    """群组列表快速路径的输出与CommunitySerializer逐字节一致"""
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.client = APIClient()
+        Community.objects.create(code='CSCI104', name='Data Structures', number='12345', type='course')
+        Community.objects.create(code='生活', name='留学生"互助"群 \\ 🎓', type='life', qr_code='/media/qr/a.png')
+        Community.objects.create(code='CS', name='Computer Science', type='major')
+
+    def test_rows_match_serializer(self):
+        renderer = JSONRenderer()
+        expected = renderer.render(CommunitySerializer(Community.objects.all(), many=True).data)
+        rows = Community.objects.values_list(*COMMUNITY_COLUMNS)
+        self.assertEqual(renderer.render(serialize_community_rows(rows)), expected)
+        self.assertEqual(self.client.get('/api/communities/').content, expected)
+
+    def test_paginated_page_matches_serializer(self):
+        response = self.client.get('/api/communities/', {'page_size': 2, 'type': 'course'})
+        expected = CommunitySerializer(Community.objects.filter(type='course'), many=True).data
+        self.assertEqual(response.json()['results'], expected)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CatalogSnapshotTests(TestCase):
+    """预渲染的群组目录快照"""
+
+    def setUp(self):
+        catalog_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        static_root = override_settings(STATIC_ROOT=directory.name)
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+            Community.objects.create(code='CS', name='Computer Science', type='major')
+
+    def test_snapshot_matches_api_and_is_served_immutable(self):
+        manifest = self.client.get('/api/communities/snapshot/').json()
+        self.assertEqual(manifest['version'], get_catalog_version())
+
+        response = self.client.get(manifest['url'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+        body = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(body, self.client.get('/api/communities/').content)
+
+        course = b''.join(self.client.get(manifest['types']['course']['url']).streaming_content)
+        self.assertEqual(course, self.client.get('/api/communities/', {'type': 'course'}).content)
+
+    def test_change_regenerates_and_prunes_old_files(self):
+        hashes = [self.client.get('/api/communities/snapshot/').json()['hash']]
+        for code in ('CSCI170', 'CSCI201'):
+            with self.captureOnCommitCallbacks(execute=True):
+                Community.objects.create(code=code, name=code, type='course')
+            hashes.append(self.client.get('/api/communities/snapshot/').json()['hash'])
+        self.assertEqual(len(set(hashes)), 3)
+
+        names = {path.name for path in (Path(settings.STATIC_ROOT) / 'catalog').glob('catalog.*.json')}
+        # 当前和上一版保留，更早的被删除
+        self.assertEqual(names, {f'catalog.{digest}.json' for digest in hashes[1:]})
+
+    def test_manifest_urls_are_absolute(self):
+        manifest = self.client.get('/api/communities/snapshot/').json()
+        self.assertTrue(manifest['url'].startswith('http://testserver/static/catalog/catalog.'))
+        with override_settings(CATALOG_SNAPSHOT={**settings.CATALOG_SNAPSHOT, 'BASE_URL': 'https://api.usccourse.com/'}):
+            manifest = self.client.get('/api/communities/snapshot/').json()
+        self.assertEqual(manifest['url'], f"https://api.usccourse.com/static/catalog/catalog.{manifest['hash']}.json")
+        self.assertTrue(manifest['types']['course']['url'].startswith('https://api.usccourse.com/static/catalog/'))
+
+    def test_pruned_file_returns_404(self):
+        url = self.client.get('/api/communities/snapshot/').json()['url']
+        self.assertEqual(self.client.get(url).status_code, 200)
+        for code in ('CSCI170', 'CSCI201'):
+            with self.captureOnCommitCallbacks(execute=True):
+                Community.objects.create(code=code, name=code, type='course')
+            self.client.get('/api/communities/snapshot/')
+        # 文件已登记在WhiteNoise的文件表中，删除后返回404而不是打开文件时出错
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class QRCodeTests(TestCase):
+    """群组二维码渲染"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        static_root = override_settings(
+            STATIC_ROOT=directory.name,
+            QR_CODES={**settings.QR_CODES, 'BASE_URL': 'https://api.usccourse.com'},
+        )
+        static_root.enable()
+        self.addCleanup(static_root.disable)
+        self.course = Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+        self.uploaded = Community.objects.create(code='CS', name='Computer Science', type='major', qr_code='/media/qr/cs.png')
+
+    def render(self):
+        out = StringIO()
+        call_command('render_qr_codes', workers=1, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_renders_all_sizes_and_keeps_uploaded_codes(self):
+        self.render()
+        digest = qr_digest(qr_payload('course', 'CSCI104'))
+        self.course.refresh_from_db()
+        self.assertEqual(self.course.qr_code, f'https://api.usccourse.com/static/qrcodes/{digest}-300.png')
+        self.assertEqual(Community.objects.get(pk=self.uploaded.pk).qr_code, '/media/qr/cs.png')
+
+        for size in settings.QR_CODES['SIZES']:
+            for fmt in qr_formats():
+                with Image.open(qr_dir() / f'{digest}-{size}.{fmt}') as image:
+                    self.assertEqual(image.size, (size, size))
+
+        # 每个模块中心的像素与二维码矩阵一致
+        matrix = render_matrix(qr_payload('course', 'CSCI104'))
+        with Image.open(qr_dir() / f'{digest}-300.png') as image:
+            image = image.convert('L')
+            scale = 300 // matrix.width
+            offset = (300 - matrix.width * scale) // 2
+            for y in range(matrix.height):
+                for x in range(matrix.width):
+                    center = (offset + x * scale + scale // 2, offset + y * scale + scale // 2)
+                    self.assertEqual(image.getpixel(center), matrix.getpixel((x, y)))
+
+    def test_new_and_changed_communities_are_rendered_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            community = Community.objects.create(code='CSCI170', name='Discrete Methods', type='course')
+        digest = qr_digest(qr_payload('course', 'CSCI170'))
+        community.refresh_from_db()
+        self.assertEqual(community.qr_code, f'https://api.usccourse.com/static/qrcodes/{digest}-300.png')
+        self.assertTrue((qr_dir() / f'{digest}-300.png').exists())
+
+        community.code = 'CSCI270'
+        with self.captureOnCommitCallbacks(execute=True):
+            community.save()
+        community.refresh_from_db()
+        self.assertIn(qr_digest(qr_payload('course', 'CSCI270')), community.qr_code)
+
+        # 手动上传的二维码保持不变
+        with self.captureOnCommitCallbacks(execute=True):
+            self.uploaded.save()
+        self.assertEqual(Community.objects.get(pk=self.uploaded.pk).qr_code, '/media/qr/cs.png')
+
+    def test_rerenders_only_when_source_changes(self):
+        self.render()
+        self.assertIn('渲染0个', self.render())
+
+        old_files = set(qr_dir().iterdir())
+        Community.objects.filter(pk=self.course.pk).update(code='CSCI170')
+        self.assertIn('渲染1个', self.render())
+        self.course.refresh_from_db()
+        self.assertIn(qr_digest(qr_payload('course', 'CSCI170')), self.course.qr_code)
+        self.assertFalse(old_files & set(qr_dir().iterdir()))
+
+    @override_settings(SECURE_SSL_REDIRECT=False)
+    def test_generated_files_are_served_with_long_cache(self):
+        self.render()
+        self.course.refresh_from_db()
+        response = self.client.get(urlsplit(self.course.qr_code).path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_relative_urls_are_replaced_and_missing_base_url_keeps_qr_code(self):
+        # 旧版本写入的相对地址会被替换为完整地址
+        digest = qr_digest(qr_payload('course', 'CSCI104'))
+        Community.objects.filter(pk=self.course.pk).update(qr_code=f'/media/qrcodes/{digest}-300.png')
+        self.render()
+        self.course.refresh_from_db()
+        self.assertTrue(self.course.qr_code.startswith('https://api.usccourse.com/'))
+
+        placeholder = Community.objects.create(code='CSCI170', name='Discrete Methods', type='course')
+        with override_settings(QR_CODES={**settings.QR_CODES, 'BASE_URL': ''}):
+            self.render()
+        placeholder.refresh_from_db()
+        self.assertEqual(placeholder.qr_code, Community._meta.get_field('qr_code').default)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class KeysetPaginationTests(TestCase):
+    """群组与加群申请的游标分页"""
+
+    def setUp(self):
+        catalog_cache.clear()
+        self.client = APIClient()
+        for index in range(5):
+            Community.objects.create(code=f"CSCI{100 + index}", name=f"Course {index}", type='course')
+            Community.objects.create(code=f"M{index}", name=f"Major {index}", type='major')
+
+    def collect_pages(self, url, params, key='code'):
+        codes, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            body = response.json()
+            codes.extend(item[key] for item in body['results'])
+            pages += 1
+            if not body['next']:
+                return codes, pages
+            response = self.client.get(body['next'])
+
+    def test_pages_follow_model_ordering(self):
+        codes, pages = self.collect_pages('/api/communities/', {'page_size': 3})
+        expected = list(Community.objects.values_list('code', flat=True))
+        self.assertEqual(codes, expected)
+        self.assertEqual(pages, 4)
+
+    def test_join_requests_paginate_newest_first(self):
+        for index in range(4):
+            JoinRequest.objects.create(department_name='CSCI', course_number=str(500 + index))
+        self.client.force_authenticate(User.objects.create(username='moderator'))
+        codes, pages = self.collect_pages('/api/join-requests/', {'page_size': 3}, key='course_number')
+        expected = list(JoinRequest.objects.order_by('-created_at', '-id').values_list('course_number', flat=True))
+        self.assertEqual(codes, expected)
+        self.assertEqual(pages, 2)
+
+    def test_unpaginated_without_params(self):
+        self.assertEqual(len(self.client.get('/api/communities/').json()), 10)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/communities/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN输出格式依赖SQLite')
+class QueryPlanTests(TestCase):
+    """列表查询应命中复合索引，不再需要额外排序"""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('TEMP B-TREE', plan.upper())
+
+    def test_community_type_filter_and_ordering(self):
+        # 对照组：没有索引的排序需要临时B树
+        self.assertIn('TEMP B-TREE', Community.objects.order_by('name').explain().upper())
+        self.assertUsesIndex(Community.objects.all(), 'community_type_code_idx')
+        self.assertUsesIndex(Community.objects.filter(type='course'), 'community_type_code_idx')
+
+    def test_join_request_status_filter_and_ordering(self):
+        self.assertUsesIndex(JoinRequest.objects.filter(status='pending'), 'joinreq_status_created_idx')
+        self.assertUsesIndex(JoinRequest.objects.order_by('-created_at', '-id'), 'joinreq_created_idx')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CommunitySearchTests(TestCase):
+    """群组搜索"""
+
+    def setUp(self):
+        catalog_cache.clear()
+        search_cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI570', name='Analysis of Algorithms', type='course')
+            Community.objects.create(code='CSCI571', name='Web Technologies', type='course')
+            Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+            Community.objects.create(code='MATH225', name='Linear Algebra', type='course')
+
+    def search(self, **params):
+        return [item['code'] for item in self.client.get('/api/communities/search/', params).json()]
+
+    def test_search_does_not_evict_list_cache(self):
+        self.client.get('/api/communities/')
+        for index in range(settings.CATALOG_CACHE['MAX_ENTRIES'] + 1):
+            self.search(q=f'x{index}')
+        with self.assertNumQueries(0):
+            self.client.get('/api/communities/')
+
+    def test_prefix_ignores_spaces_and_case(self):
+        self.assertEqual(self.search(q='csci 5')[:2], ['CSCI570', 'CSCI571'])
+
+    def test_name_prefix_and_fuzzy_match(self):
+        self.assertEqual(self.search(q='Web'), ['CSCI571'])
+        self.assertEqual(self.search(q='algorithm'), ['CSCI570'])
+
+    def test_limit_and_rebuild_on_change(self):
+        self.assertEqual(len(self.search(q='CSCI', limit=1)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI585', name='Database Systems', type='course')
+        self.assertIn('CSCI585', self.search(q='CSCI 58'))
+
+    @skipIf(connection.vendor == 'postgresql', '只有非PostgreSQL数据库使用进程内索引')
+    def test_rebuild_swaps_index_as_a_whole(self):
+        old = prefix_index.ensure_current()
+        with self.captureOnCommitCallbacks(execute=True):
+            Community.objects.create(code='CSCI585', name='Database Systems', type='course')
+        new = prefix_index.ensure_current()
+        # 重建前取得索引的搜索继续使用完整的旧数据，各部分的长度一致
+        self.assertEqual((len(old.entries), len(old.code_keys)), (4, 4))
+        self.assertEqual((len(new.entries), len(new.code_keys)), (5, 5))
+
+    @skipUnless(connection.vendor == 'postgresql', '需要PostgreSQL和pg_trgm')
+    def test_postgres_query_uses_trigram_indexes(self):
+        with connection.cursor() as cursor:
+            # 表很小时规划器总会选择顺序扫描，禁用后仍出现Seq Scan说明条件无法使用索引
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = postgres_search_queryset('csci 5').explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertIn('community_code_trgm_idx', plan)
+        self.assertIn('community_name_trgm_idx', plan)
+
+
+class ImportCommunitiesTests(TestCase):
+    """群组批量导入命令"""
+
+    def write_file(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / name
+        path.write_text(content, encoding='utf-8')
+        return str(path)
+
+    def test_csv_upserts_on_type_and_code(self):
+        Community.objects.create(code='CSCI104', name='Old name', type='course', qr_code='/qr/104.png')
+        path = self.write_file('communities.csv', (
+            'code,name,number,type\n'
+            'CSCI104,Data Structures,C1001,course\n'
+            'CSCI170,Discrete Methods,C1002,course\n'
+            'BAD,Missing type,,\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('import_communities', path, batch_size=1, stdout=out, stderr=err)
+
+        self.assertEqual(Community.objects.count(), 2)
+        updated = Community.objects.get(code='CSCI104')
+        self.assertEqual(updated.name, 'Data Structures')
+        self.assertEqual(updated.qr_code, '/qr/104.png')
+        self.assertIn('第4行', err.getvalue())
+        self.assertIn('行/秒', out.getvalue())
+
+    def test_jsonl(self):
+        path = self.write_file('communities.jsonl', (
+            '{"code": "CS", "name": "Computer Science", "type": "major", "qrCode": "/qr/cs.png"}\n'
+            '{"code": "CS", "name": "Computer Science (BS)", "type": "major"}\n'
+            '["CSCI104", "Data Structures"]\n'
+        ))
+        err = StringIO()
+        call_command('import_communities', path, stdout=StringIO(), stderr=err)
+        community = Community.objects.get()
+        self.assertEqual(community.name, 'Computer Science (BS)')
+        self.assertIn('第3行: 不是JSON对象', err.getvalue())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BulkJoinRequestTests(TestCase):
+    """批量提交加群申请"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='student', email='student@usc.edu')
+
+    def test_partial_failure_reports_per_item_results(self):
+        payload = {
+            'user_id': self.user.id,
+            'user_email': 'student@usc.edu',
+            'requests': [
+                {'department_name': 'CSCI', 'course_number': '570'},
+                {'department_name': 'CSCI'},
+                {'department_name': 'MATH', 'course_number': '225'},
+            ],
+        }
+        # 查询用户 + 一次INSERT + 两门新课程的计数各一次UPDATE和INSERT（另有事务的SAVEPOINT/RELEASE）
+        with self.assertNumQueries(12):
+            response = self.client.post('/api/join-requests/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (2, 1))
+        self.assertIn('course_number', body['results'][1]['errors'])
+        self.assertEqual(body['results'][2]['data']['user_id'], self.user.id)
+        self.assertEqual(JoinRequest.objects.filter(user=self.user, user_email='student@usc.edu').count(), 2)
+
+    def test_all_invalid(self):
+        response = self.client.post('/api/join-requests/bulk/', {'requests': [{}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(JoinRequest.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CourseDemandTests(TestCase):
+    """课程需求计数"""
+
+    def counts(self, course_number):
+        demand = CourseDemand.objects.get(department_name='CSCI', course_number=course_number)
+        return demand.pending_count, demand.total_count
+
+    def test_counters_follow_create_status_change_and_delete(self):
+        first = JoinRequest.objects.create(department_name='CSCI', course_number='570')
+        JoinRequest.objects.create(department_name='CSCI', course_number='570')
+        self.assertEqual(self.counts('570'), (2, 2))
+
+        first = JoinRequest.objects.get(pk=first.pk)
+        first.status = 'approved'
+        first.save()
+        self.assertEqual(self.counts('570'), (1, 2))
+
+        first.delete()
+        self.assertEqual(self.counts('570'), (1, 1))
+
+    def test_drifted_counter_does_not_block_writes(self):
+        join_request = JoinRequest.objects.create(department_name='CSCI', course_number='570')
+        CourseDemand.objects.update(pending_count=0, total_count=0)
+        JoinRequest.objects.get(pk=join_request.pk).delete()
+        self.assertEqual(self.counts('570'), (0, 0))
+
+    def test_counter_failure_rolls_back_the_write(self):
+        with mock.patch('groups.signals.apply_demand_deltas', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                JoinRequest.objects.create(department_name='CSCI', course_number='570')
+        self.assertFalse(JoinRequest.objects.exists())
+
+    def test_bulk_create_and_rebuild(self):
+        self.client.post('/api/join-requests/bulk/', {'requests': [
+            {'department_name': 'CSCI', 'course_number': '570'},
+            {'department_name': 'CSCI', 'course_number': '570'},
+            {'department_name': 'CSCI', 'course_number': '104'},
+        ]}, content_type='application/json')
+        self.assertEqual(self.counts('570'), (2, 2))
+
+        CourseDemand.objects.update(pending_count=99)
+        call_command('rebuild_course_demand', stdout=StringIO())
+        self.assertEqual(self.counts('570'), (2, 2))
+        self.assertEqual(self.counts('104'), (1, 1))
+
+    def test_demand_endpoint_ranks_by_pending(self):
+        for course_number, count in (('104', 1), ('570', 3)):
+            for _ in range(count):
+                JoinRequest.objects.create(department_name='CSCI', course_number=course_number)
+        client = APIClient()
+        client.force_authenticate(User.objects.create(username='moderator'))
+        with self.assertNumQueries(1):
+            response = client.get('/api/join-requests/demand/', {'limit': 1})
+        self.assertEqual([row['course_number'] for row in response.json()], ['570'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class BulkStatusTests(TestCase):
+    """批量批准/拒绝申请"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='moderator'))
+        self.requests = [
+            JoinRequest.objects.create(department_name='CSCI', course_number=course_number)
+            for course_number in ('570', '570', '104')
+        ]
+
+    def test_approve_by_filter_in_single_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/join-requests/bulk-status/', {
+                'status': 'approved',
+                'filter': {'status': 'pending', 'course_number': '570'},
+            }, format='json')
+        self.assertEqual(response.json(), {'updated': 2})
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "groups_joinrequest"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(JoinRequest.objects.filter(status='approved').count(), 2)
+        demand = CourseDemand.objects.get(course_number='570')
+        self.assertEqual((demand.pending_count, demand.total_count), (0, 2))
+
+    def test_reject_by_ids(self):
+        ids = [self.requests[0].id, self.requests[2].id]
+        response = self.client.post('/api/join-requests/bulk-status/', {'status': 'rejected', 'ids': ids}, format='json')
+        self.assertEqual(response.json(), {'updated': 2})
+        response = self.client.post('/api/join-requests/bulk-status/', {'status': 'rejected', 'ids': ids}, format='json')
+        self.assertEqual(response.json(), {'updated': 0})
+
+    def test_requires_selection(self):
+        response = self.client.post('/api/join-requests/bulk-status/', {'status': 'approved', 'filter': {}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/join-requests/bulk-status/', {
+            'status': 'approved', 'filter': {'course_number': {'in': ['570']}},
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(JoinRequest.objects.filter(status='approved').exists())
+
+    def test_locks_selected_rows_before_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/api/join-requests/bulk-status/', {
+                'status': 'approved', 'filter': {'course_number': '570'},
+            }, format='json')
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT "groups_joinrequest"."id"')]
+        self.assertEqual(len(selects), 1)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', selects[0])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class JoinRequestQueryCountTests(TestCase):
+    """加群申请列表和创建的查询次数不随数据量增长"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='student')
+        self.client.force_authenticate(self.user)
+
+    def create_requests(self, count):
+        for index in range(count):
+            user = User.objects.create(username=f'user{JoinRequest.objects.count()}')
+            JoinRequest.objects.create(department_name='CSCI', course_number=str(index), user=user)
+
+    def test_list_query_count_is_constant(self):
+        self.create_requests(2)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get('/api/join-requests/')
+        self.create_requests(10)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get('/api/join-requests/')
+        self.assertEqual(len(response.json()), 12)
+        self.assertEqual(len(small), len(large))
+        self.assertFalse([q for q in large if 'FROM "auth_user"' in q['sql']])
+
+    def test_create_is_a_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/join-requests/', {
+                'department_name': 'CSCI',
+                'course_number': '570',
+                'user_id': self.user.id,
+                'user_email': 'student@usc.edu',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user_id'], self.user.id)
+        writes = [q['sql'] for q in queries if 'groups_joinrequest' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+        join_request = JoinRequest.objects.get()
+        self.assertEqual((join_request.user_id, join_request.user_email), (self.user.id, 'student@usc.edu'))
+
+    def test_unknown_user_is_ignored(self):
+        response = self.client.post('/api/join-requests/', {
+            'department_name': 'CSCI', 'course_number': '570', 'user_id': 999999,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.json()['user_id'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RequestTimingTests(TestCase):
+    """请求计时中间件"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='student'))
+        JoinRequest.objects.create(department_name='CSCI', course_number='104')
+
+    def timing_settings(self, **overrides):
+        return override_settings(REQUEST_TIMING={**settings.REQUEST_TIMING, **overrides})
+
+    def test_server_timing_header(self):
+        with self.timing_settings(SLOW_THRESHOLD_MS=10 ** 6):
+            response = self.client.get('/api/join-requests/')
+        phases = dict(entry.strip().split(';', 1) for entry in response['Server-Timing'].split(','))
+        self.assertEqual(set(phases), {'total', 'db', 'view', 'render'})
+        self.assertRegex(phases['db'], r'dur=[\d.]+;desc="\d+ queries"')
+
+    def test_slow_request_log_includes_top_sql(self):
+        with self.timing_settings(SLOW_THRESHOLD_MS=0, SAMPLE_RATE=1.0):
+            with self.assertLogs('usccoursemate.middleware', 'WARNING') as logs:
+                self.client.get('/api/join-requests/')
+        entry = json.loads(logs.records[0].getMessage().split(' ', 1)[1])
+        self.assertEqual((entry['path'], entry['status'], entry['sampled']), ('/api/join-requests/', 200, True))
+        self.assertEqual(sum(statement['count'] for statement in entry['top_sql']), entry['queries'])
+        self.assertTrue(any('groups_joinrequest' in statement['sql'] for statement in entry['top_sql']))
+
+    def test_unsampled_requests_skip_statement_details(self):
+        with self.timing_settings(SLOW_THRESHOLD_MS=0, SAMPLE_RATE=0):
+            with self.assertLogs('usccoursemate.middleware', 'WARNING') as logs:
+                self.client.get('/api/join-requests/')
+        entry = json.loads(logs.records[0].getMessage().split(' ', 1)[1])
+        self.assertGreater(entry['queries'], 0)
+        self.assertEqual(entry['top_sql'], [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MetricsTests(TestCase):
+    """/metrics汇总多个worker的指标"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        metrics_settings = override_settings(METRICS={'DIR': directory.name, 'FLUSH_INTERVAL': 0, 'TOKEN': 'secret'})
+        metrics_settings.enable()
+        self.addCleanup(metrics_settings.disable)
+        collector.reset()
+        self.addCleanup(collector.reset)
+        Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        return dict(line.rsplit(' ', 1) for line in response.content.decode().splitlines() if not line.startswith('#'))
+
+    def test_aggregates_worker_files(self):
+        self.client.get('/api/communities/')
+        self.client.get('/api/communities/')
+        # 另一个worker写入的文件
+        (self.directory / '99999-other.json').write_text(json.dumps({
+            'counters': [['http_requests_total', {'route': 'community-list', 'method': 'GET', 'status': '200'}, 5]],
+            'histograms': [],
+        }))
+        CallStatsRegistry().record('google_token', 0.02, failed=True)
+
+        samples = self.scrape()
+        self.assertEqual(samples['http_requests_total{method="GET",route="community-list",status="200"}'], '7')
+        self.assertEqual(samples['http_request_duration_seconds_count{method="GET",route="community-list"}'], '2')
+        self.assertEqual(samples['http_request_duration_seconds_bucket{method="GET",route="community-list",le="+Inf"}'], '2')
+        self.assertEqual(samples['oauth_call_duration_seconds_bucket{name="google_token",le="0.025"}'], '1')
+        self.assertEqual(samples['oauth_call_errors_total{name="google_token"}'], '1')
+        self.assertIn('db_connection_reuses_total{alias="default"}', samples)
+        # 非groups/authentication的视图不记录路由指标
+        self.assertFalse([key for key in samples if 'route="metrics"' in key])
+
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        # 未配置令牌时只在DEBUG下公开
+        with override_settings(METRICS={**settings.METRICS, 'TOKEN': None}):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_exited_worker_files_are_merged_once(self):
+        counter = [['http_requests_total', {'route': 'community-list', 'method': 'GET', 'status': '200'}, 5]]
+        for name in ('99998-aaaa.json', '99999-bbbb.json'):
+            (self.directory / name).write_text(json.dumps({'counters': counter, 'histograms': []}))
+        key = 'http_requests_total{method="GET",route="community-list",status="200"}'
+        with mock.patch('usccoursemate.metrics._pid_alive', side_effect=lambda pid: pid == 99999):
+            self.assertEqual(self.scrape()[key], '10')
+            self.assertEqual(self.scrape()[key], '10')
+        self.assertFalse((self.directory / '99998-aaaa.json').exists())
+        self.assertTrue((self.directory / '99999-bbbb.json').exists())
+
+        with mock.patch('usccoursemate.metrics._pid_alive', return_value=False):
+            self.assertEqual(self.scrape()[key], '10')
+        self.assertEqual(sorted(path.name for path in self.directory.glob('*.json')), ['aggregate.json'])
+
+
+class BenchmarkTests(TestCase):
+    """合成数据生成和基准测试场景"""
+
+    def test_seed_and_run_all_scenarios(self):
+        dataset = seed_dataset(communities=30, join_requests=60, users=5)
+        self.assertEqual(Community.objects.filter(type='course').count(), 10)
+        self.assertEqual(JoinRequest.objects.count(), 60)
+        self.assertEqual(User.objects.filter(profile__isnull=False).count(), 5)
+        self.assertEqual(sum(CourseDemand.objects.values_list('total_count', flat=True)), 60)
+
+        results = run_benchmark(dataset, requests=5, warmup=1)
+        self.assertEqual(set(results), set(SCENARIOS))
+        for summary in results.values():
+            self.assertEqual(summary['requests'], 5)
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+        self.assertGreater(results['join_request_create']['queries_per_request'], 0)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """读写分离路由"""
+    databases = {'default'}
+
+    def setUp(self):
+        alias = mock.patch('usccoursemate.db_router.replica_alias', return_value='replica')
+        alias.start()
+        self.addCleanup(alias.stop)
+        is_healthy = mock.patch.object(health, 'is_healthy', return_value=True)
+        self.is_healthy = is_healthy.start()
+        self.addCleanup(is_healthy.stop)
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_use_replica_only_inside_scope(self):
+        self.assertEqual(self.router.db_for_read(Community), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Community), 'replica')
+            with primary_reads():
+                self.assertEqual(self.router.db_for_read(Community), 'default')
+            self.assertEqual(self.router.db_for_read(Community), 'replica')
+        self.assertEqual(self.router.db_for_read(Community), 'default')
+
+    def test_write_keeps_rest_of_scope_on_primary(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(JoinRequest), 'default')
+            self.assertEqual(self.router.db_for_read(JoinRequest), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(JoinRequest), 'replica')
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        self.is_healthy.return_value = False
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Community), 'default')
+
+    def test_no_migrations_on_replica(self):
+        self.assertIs(self.router.allow_migrate('replica', 'groups'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'groups'))
+
+    def test_health_check_result_is_cached(self):
+        checker = ReplicaHealth()
+        with mock.patch.object(connections['default'], 'cursor', side_effect=OperationalError('down')), \
+                self.assertLogs('usccoursemate.db_router', 'WARNING'):
+            self.assertFalse(checker.is_healthy('default'))
+        # 检查间隔内沿用上次的结果
+        self.assertFalse(checker.is_healthy('default'))
+        checker.checked_at -= settings.REPLICA_DATABASE['HEALTH_CHECK_INTERVAL']
+        self.assertTrue(checker.is_healthy('default'))
+
+
+@skipUnless('replica' in settings.DATABASES, '需要设置DATABASE_REPLICA_URL')
+@override_settings(SECURE_SSL_REDIRECT=False, REPLICA_DATABASE={**settings.REPLICA_DATABASE, 'MAX_LAG_SECONDS': 0})
+class ReplicaReadTests(TransactionTestCase):
+    """
+    使用真实的副本连接：测试时副本是测试主库的镜像（另一个连接），
+    数据需要提交后才对副本可见，因此使用TransactionTestCase。
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        catalog_cache.clear()
+        health.healthy, health.checked_at = True, None
+        self.community = Community.objects.create(code='CSCI104', name='Data Structures', type='course')
+        self.user = User.objects.create_user(username='reader', email='reader@usc.edu')
+        JoinRequest.objects.create(department_name='CSCI', course_number='104', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def queries(self, method, path, **kwargs):
+        """返回(响应, 主库查询数, 副本查询数)"""
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = getattr(self.client, method)(path, **kwargs)
+        return response, len(primary), len(replica)
+
+    def test_list_and_retrieve_read_from_replica(self):
+        for path in ('/api/communities/', f'/api/communities/{self.community.pk}/', '/api/join-requests/'):
+            response, primary, replica = self.queries('get', path)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(primary, 0, path)
+            self.assertGreater(replica, 0, path)
+
+    def test_writes_stay_on_primary(self):
+        response, primary, replica = self.queries('post', '/api/join-requests/', data={
+            'department_name': 'CSCI', 'course_number': '170', 'user_id': self.user.pk,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_failed_replica_query_retries_on_primary(self):
+        replica = connections['replica']
+        replica.close()
+        with mock.patch.object(health, 'check', return_value=True), \
+                mock.patch.object(replica, 'ensure_connection', side_effect=OperationalError('down')), \
+                self.assertLogs('usccoursemate.db_router', 'WARNING'):
+            with CaptureQueriesContext(connections['default']) as primary:
+                response = self.client.get('/api/join-requests/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 1)
+        self.assertTrue(primary.captured_queries)
+        self.assertFalse(health.healthy)
+
+
+def _drain_bucket(path, key):
+    """在另一个进程中取完key的令牌"""
+    buckets = SharedTokenBuckets(path, 16)
+    while buckets.consume(key, 5, 0.001)[0]:
+        pass
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class RateLimitTests(TestCase):
+    """匿名创建申请的令牌桶限流"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = str(Path(directory.name) / 'ratelimit.bin')
+        rates = override_settings(RATE_LIMITS={**settings.RATE_LIMITS, 'FILE': self.path, 'RATES': {
+            'join_request.ip': '3/min',
+            'join_request.email': '2/min',
+        }})
+        rates.enable()
+        self.addCleanup(rates.disable)
+        self.client = APIClient()
+
+    def create(self, email, **extra):
+        return self.client.post('/api/join-requests/', {
+            'department_name': 'CSCI', 'course_number': '104', 'user_email': email,
+        }, format='json', **extra)
+
+    def test_limits_per_email_and_per_ip_with_retry_after(self):
+        self.assertEqual(self.create('a@usc.edu').status_code, 201)
+        self.assertEqual(self.create('A@usc.edu ').status_code, 201)
+        response = self.create('a@usc.edu')
+        self.assertEqual(response.status_code, 429)
+        # 每分钟2个令牌，30秒后恢复一个
+        self.assertEqual(response['Retry-After'], '30')
+
+        # 被拒绝的请求同样消耗了IP的令牌
+        self.assertEqual(self.create('b@usc.edu').status_code, 429)
+        self.assertEqual(self.client.post('/api/join-requests/bulk/', {'requests': []}, format='json').status_code, 429)
+        self.assertEqual(JoinRequest.objects.count(), 2)
+
+        # 令牌随时间恢复
+        with mock.patch('usccoursemate.throttling.time.time', return_value=time.time() + 60):
+            self.assertEqual(self.create('b@usc.edu').status_code, 201)
+
+    def test_spoofed_forwarded_for_does_not_reset_ip_bucket(self):
+        # 代理把真实客户端地址9.9.9.9追加在最后，客户端伪造的前缀每次都不同
+        for index in range(3):
+            response = self.create(f'user{index}@usc.edu', HTTP_X_FORWARDED_FOR=f'1.1.1.{index}, 9.9.9.9')
+            self.assertEqual(response.status_code, 201)
+        response = self.create('user3@usc.edu', HTTP_X_FORWARDED_FOR='1.1.1.3, 9.9.9.9')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.create('user3@usc.edu', HTTP_X_FORWARDED_FOR='8.8.8.8').status_code, 201)
+
+    def test_bulk_costs_one_token_per_request(self):
+        items = [{'department_name': 'CSCI', 'course_number': str(number)} for number in (101, 102, 103)]
+        response = self.client.post('/api/join-requests/bulk/', {'requests': items, 'user_email': 'a@usc.edu'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        # 3条申请取空了每分钟3个令牌的IP桶（邮箱桶容量只有2，整桶取空）
+        self.assertEqual(self.create('b@usc.edu').status_code, 429)
+        self.assertEqual(self.create('a@usc.edu', HTTP_X_FORWARDED_FOR='8.8.8.8').status_code, 429)
+
+    @skipUnless('fork' in multiprocessing.get_all_start_methods(), '需要fork')
+    def test_buckets_are_shared_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        process = context.Process(target=_drain_bucket, args=(self.path, 'shared'))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        allowed, wait = SharedTokenBuckets(self.path, 16).consume('shared', 5, 0.001)
+        self.assertFalse(allowed)
+        self.assertGreater(wait, 0)
+
+    def test_full_group_evicts_least_recently_used_key(self):
+        buckets = SharedTokenBuckets(self.path, 1)
+        for index in range(4):
+            self.assertTrue(buckets.consume(f'key{index}', 1, 0.001)[0])
+        self.assertFalse(buckets.consume('key0', 1, 0.001)[0])
+        # 第5个键挤掉最久未更新的key1，key1之后以满桶重新开始
+        self.assertTrue(buckets.consume('key4', 1, 0.001)[0])
+        self.assertTrue(buckets.consume('key1', 1, 0.001)[0])
@@ -1,18 +1,46 @@
+import logging
+from contextlib import nullcontext
+from operator import attrgetter
+
 from django.shortcuts import render
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
 from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Community, JoinRequest
-from .serializers import CommunitySerializer, JoinRequestSerializer
+from usccoursemate.db_router import ReplicaReadMixin, primary_reads, replica_alias
+from usccoursemate.throttling import EmailRateThrottle, IPRateThrottle
+
+from .cache import build_cache_key, catalog_cache, catalog_changed_within, search_cache
+from .demand import bulk_update_status, record_created
+from .models import Community, CourseDemand, JoinRequest
+from .pagination import KeysetPagination
+from .search import search_communities
+from .snapshot import absolute_manifest, get_catalog_manifest
+from .serializers import (
+    COMMUNITY_COLUMNS,
+    CommunitySerializer,
+    CourseDemandSerializer,
+    JoinRequestSerializer,
+    serialize_community_rows,
+)
+
+logger = logging.getLogger(__name__)
 
-# Create your views here.
+# 单次批量提交的申请数量上限
+MAX_BULK_JOIN_REQUESTS = 50
 
-class CommunityViewSet(viewsets.ModelViewSet):
+# 批量修改状态时允许使用的过滤字段
+BULK_STATUS_FILTER_FIELDS = {'status', 'department_name', 'course_number'}
+
+class CommunityViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     群组视图集，处理所有群组的CRUD操作
     """
     queryset = Community.objects.all()
     serializer_class = CommunitySerializer
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
     def get_queryset(self):
@@ -23,56 +51,214 @@ class CommunityViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(type=community_type)
         return queryset
 
-class JoinRequestViewSet(viewsets.ModelViewSet):
+    def list(self, request, *args, **kwargs):
+        """群组列表，命中缓存时不访问数据库也不执行序列化"""
+        return self._cached_response('list', self._list, request, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        """只读取输出所需的列并直接构造字典，输出与CommunitySerializer完全一致"""
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.only(*COMMUNITY_COLUMNS))
+        if page is not None:
+            # 分页器需要模型实例来生成游标，每页最多max_page_size行
+            rows = map(attrgetter(*COMMUNITY_COLUMNS), page)
+            return self.get_paginated_response(serialize_community_rows(rows))
+        return Response(serialize_community_rows(queryset.values_list(*COMMUNITY_COLUMNS)))
+
+    def retrieve(self, request, *args, **kwargs):
+        """群组详情，同样使用目录缓存"""
+        return self._cached_response('retrieve', super().retrieve, request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """按code/name前缀和模糊相似度搜索群组，返回排序后的前limit条"""
+        return self._cached_response('search', self._search, request, cache=search_cache)
+
+    @action(detail=False, methods=['get'])
+    def snapshot(self, request):
+        """
+        返回预渲染目录快照的清单：当前内容哈希及完整目录、各类型目录的静态文件地址。
+        静态文件带内容哈希、可永久缓存，清单本身不缓存。
+        """
+        try:
+            manifest = get_catalog_manifest()
+        except OSError:
+            logger.exception('生成群组目录快照失败')
+            return Response({'error': '目录快照不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(absolute_manifest(manifest, request), headers={'Cache-Control': 'no-cache'})
+
+    def _search(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            limit = 10
+        results = search_communities(
+            request.query_params.get('q', ''),
+            limit=limit,
+            community_type=request.query_params.get('type'),
+        )
+        return Response(results)
+
+    def _cached_response(self, name, handler, request, *args, cache=catalog_cache, **kwargs):
+        key = build_cache_key(request, name, **kwargs)
+        data = cache.get(key)
+        if data is None:
+            with self._fresh_reads():
+                response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(key, data)
+        return Response(data)
+
+    def _fresh_reads(self):
+        """目录刚变化时副本可能尚未同步，读到的旧数据会以新版本号缓存下来，此时改从主库读取"""
+        if replica_alias() is not None and catalog_changed_within(settings.REPLICA_DATABASE['MAX_LAG_SECONDS']):
+            return primary_reads()
+        return nullcontext()
+
+class JoinRequestViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     加群申请视图集，处理所有加群申请的CRUD操作
     """
     queryset = JoinRequest.objects.all()
     serializer_class = JoinRequestSerializer
+    pagination_class = KeysetPagination
+    throttle_scope = 'join_request'
     
     def get_permissions(self):
         """
-        创建申请时允许匿名访问，其他操作需要认证
+        创建申请（含批量创建）时允许匿名访问，其他操作需要认证
         """
-        if self.action == 'create':
+        if self.action in ('create', 'bulk'):
             permission_classes = [permissions.AllowAny]
         else:
             permission_classes = [permissions.IsAuthenticated]
         return [permission() for permission in permission_classes]
+
+    def get_throttles(self):
+        """匿名可用的创建接口（含批量创建）按IP和申请人邮箱限流"""
+        if self.action in ('create', 'bulk'):
+            return [IPRateThrottle(), EmailRateThrottle()]
+        return []
+
+    def get_throttle_cost(self, request):
+        """批量创建按提交的申请条数消耗令牌，其他请求消耗1个"""
+        items = request.data.get('requests') if self.action == 'bulk' and hasattr(request.data, 'get') else None
+        if isinstance(items, list) and items:
+            return min(len(items), MAX_BULK_JOIN_REQUESTS)
+        return 1
     
     def create(self, request, *args, **kwargs):
         """
         创建申请，同时关联用户信息
         """
-        data = request.data.copy()
-        
-        # 检查是否有用户信息
-        user_id = data.get('user_id')
-        user_email = data.get('user_email')
-        
-        # 创建申请
-        serializer = self.get_serializer(data=data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        # 保存申请，关联用户
-        join_request = serializer.save()
-        
-        # 如果有用户ID，尝试关联用户
-        if user_id:
-            try:
-                user = User.objects.get(id=user_id)
-                join_request.user = user
-                join_request.save()
-            except User.DoesNotExist:
-                pass
-        
-        # 保存用户邮箱
-        if user_email and not join_request.user_email:
-            join_request.user_email = user_email
-            join_request.save()
+        # 先解析用户，再以一条INSERT保存申请（用户邮箱由序列化器一并写入）
+        user = self._resolve_user(serializer.validated_data.get('user_id'))
+        serializer.save(user=user)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        批量创建申请：共享user_id/user_email，requests为{department_name, course_number}列表。
+        逐条校验后在一个事务中一次bulk_create写入，返回每一条的结果。
+        """
+        items = request.data.get('requests')
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'requests必须是非空列表'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_BULK_JOIN_REQUESTS:
+            return Response({'error': f'一次最多提交{MAX_BULK_JOIN_REQUESTS}条申请'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = self._resolve_user(request.data.get('user_id'))
+        user_email = request.data.get('user_email')
+
+        results = [None] * len(items)
+        pending = []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[index] = {'index': index, 'errors': {'non_field_errors': ['无效的申请数据']}}
+                continue
+            serializer = self.get_serializer(data={
+                'department_name': item.get('department_name'),
+                'course_number': item.get('course_number'),
+                'user_email': user_email,
+            })
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'errors': serializer.errors}
+                continue
+            data = serializer.validated_data
+            pending.append((index, JoinRequest(
+                department_name=data['department_name'],
+                course_number=data['course_number'],
+                user=user,
+                user_email=data.get('user_email'),
+            )))
+
+        if pending:
+            with transaction.atomic():
+                created = JoinRequest.objects.bulk_create([join_request for _, join_request in pending])
+                record_created(created)
+            for index, join_request in pending:
+                results[index] = {'index': index, 'data': self.get_serializer(join_request).data}
+
+        return Response(
+            {'created': len(pending), 'failed': len(items) - len(pending), 'results': results},
+            status=status.HTTP_201_CREATED if pending else status.HTTP_400_BAD_REQUEST,
+        )
+
+    @action(detail=False, methods=['post'], url_path='bulk-status')
+    def bulk_status(self, request):
+        """
+        批量批准/拒绝申请：按ids列表或filter（status、department_name、course_number）选择，
+        以一条UPDATE完成，返回受影响的行数
+        """
+        new_status = request.data.get('status')
+        if new_status not in ('approved', 'rejected'):
+            return Response({'error': 'status必须是approved或rejected'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = request.data.get('ids')
+        filters = request.data.get('filter')
+        if ids is not None:
+            if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) for pk in ids):
+                return Response({'error': 'ids必须是非空的整数列表'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = JoinRequest.objects.filter(pk__in=ids)
+        elif (
+            isinstance(filters, dict) and filters and set(filters) <= BULK_STATUS_FILTER_FIELDS
+            and all(isinstance(value, str) for value in filters.values())
+        ):
+            queryset = JoinRequest.objects.filter(**filters)
+        else:
+            return Response(
+                {'error': f'需要提供ids或filter（值为字符串，可用字段: {", ".join(sorted(BULK_STATUS_FILTER_FIELDS))}）'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        return Response({'updated': bulk_update_status(queryset, new_status)})
+
+    @action(detail=False, methods=['get'])
+    def demand(self, request):
+        """按待处理申请数排序的热门课程，读取预先汇总的计数表"""
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 200)
+        except ValueError:
+            limit = 20
+        queryset = CourseDemand.objects.filter(pending_count__gt=0)[:limit]
+        return Response(CourseDemandSerializer(queryset, many=True).data)
+
+    def _resolve_user(self, user_id):
+        """根据user_id查找用户，不存在或格式错误时返回None"""
+        if not user_id:
+            return None
+        try:
+            return User.objects.get(id=user_id)
+        except (User.DoesNotExist, ValueError, TypeError):
+            return None
+
     def get_queryset(self):
         """默认只返回未处理的申请"""
         queryset = JoinRequest.objects.all()
@@ -4,4 +4,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'usccoursemate.settings')
 
-application = get_asgi_application()
\ No newline at end of file
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """Django本身不处理lifespan事件，这里在worker退出时关闭异步OAuth客户端的连接池"""
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    from authentication.http import close_async_oauth_http
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_oauth_http()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -0,0 +1,46 @@
+import math
+import statistics
+from contextlib import contextmanager
+
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def temporary_test_database():
+    """在临时测试数据库和测试环境中运行基准测试，结束后销毁，不影响开发数据库"""
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(sorted_values, fraction):
+    """最近秩法百分位数，sorted_values需已排序"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, elapsed, query_counts=None):
+    """汇总单个场景：延迟百分位（毫秒）、每秒请求数，以及平均每个请求的SQL查询数"""
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 2) if ordered else 0.0,
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+    }
+    if query_counts is not None:
+        summary['queries_per_request'] = round(statistics.fmean(query_counts), 2) if query_counts else 0.0
+    return summary
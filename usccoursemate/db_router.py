@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+
+logger = logging.getLogger(__name__)
+
+# 当前上下文中的读操作是否可以使用副本；发生写操作后置为False，本请求之后的读取留在主库
+_replica_reads = ContextVar('replica_reads', default=False)
+# 当前上下文中是否有查询实际发往了副本
+_replica_used = ContextVar('replica_used', default=False)
+
+# 副本复制延迟（秒）；WAL已全部重放时为0，不是备库时为NULL
+REPLICATION_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def replica_alias():
+    """返回只读副本的数据库别名，未配置DATABASE_REPLICA_URL时返回None"""
+    alias = settings.REPLICA_DATABASE['ALIAS']
+    return alias if alias in settings.DATABASES else None
+
+
+class ReplicaHealth:
+    """
+    副本健康状态，按HEALTH_CHECK_INTERVAL检查一次并在进程内缓存。
+    无法连接、查询出错或复制延迟超过MAX_LAG_SECONDS时视为不健康，期间读取回退到主库。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.healthy = True
+        self.checked_at = None
+
+    def is_healthy(self, alias):
+        interval = settings.REPLICA_DATABASE['HEALTH_CHECK_INTERVAL']
+        if self.checked_at is not None and time.monotonic() - self.checked_at < interval:
+            return self.healthy
+        # 只由一个线程执行检查，其余线程沿用上次的结果
+        if not self._lock.acquire(blocking=False):
+            return self.healthy
+        try:
+            self.healthy = self.check(alias)
+            self.checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(REPLICATION_LAG_SQL)
+                    lag = cursor.fetchone()[0]
+                else:
+                    cursor.execute('SELECT 1')
+                    lag = None
+        except DatabaseError:
+            logger.warning('只读副本%s不可用，读取回退到主库', alias, exc_info=True)
+            return False
+        max_lag = settings.REPLICA_DATABASE['MAX_LAG_SECONDS']
+        if lag is not None and lag > max_lag:
+            logger.warning('只读副本%s复制延迟%.1f秒，超过%s秒，读取回退到主库', alias, lag, max_lag)
+            return False
+        return True
+
+    def mark_unhealthy(self):
+        """副本上的查询失败时调用，在下一次检查之前不再使用副本"""
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+health = ReplicaHealth()
+
+
+class PrimaryReplicaRouter:
+    """
+    写操作总是使用主库。读操作默认也使用主库，只有在replica_reads()范围内、
+    本请求尚未写入、不在主库事务中且副本健康时才发往副本。
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        alias = replica_alias()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block or not health.is_healthy(alias):
+            return DEFAULT_DB_ALIAS
+        _replica_used.set(True)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # 写入之后的读取必须能读到本次写入，而副本可能尚未同步
+        _replica_reads.set(False)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # 副本的表结构由复制同步，不在副本上执行迁移
+        if db == settings.REPLICA_DATABASE['ALIAS']:
+            return False
+        return None
+
+
+@contextmanager
+def replica_reads():
+    """范围内的只读查询可以发往副本"""
+    reads_token = _replica_reads.set(replica_alias() is not None)
+    used_token = _replica_used.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(reads_token)
+        _replica_used.reset(used_token)
+
+
+@contextmanager
+def primary_reads():
+    """范围内的读取回到主库，用于需要读到最新数据的场合"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaReadMixin:
+    """
+    视图集混入类：replica_actions中的动作（只对应GET/HEAD）在replica_reads()中执行。
+    副本上的查询因连接问题失败时，将副本标记为不健康并在主库上重新处理本请求。
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        if action not in self.replica_actions or replica_alias() is None:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            try:
+                return super().dispatch(request, *args, **kwargs)
+            except (OperationalError, InterfaceError):
+                if not _replica_used.get():
+                    raise
+                health.mark_unhealthy()
+                logger.warning('只读副本查询失败，改由主库处理 %s', request.path, exc_info=True)
+        return super().dispatch(request, *args, **kwargs)
@@ -0,0 +1,285 @@
+import atexit
+import hmac
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows开发环境没有fcntl，退化为不加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标名 -> (类型, 说明)
+METRICS = {
+    'http_requests_total': ('counter', '按路由、方法和状态码统计的请求数'),
+    'http_request_duration_seconds': ('histogram', '按路由和方法统计的请求耗时'),
+    'db_connections_opened_total': ('counter', '新建的数据库连接数'),
+    'db_connection_reuses_total': ('counter', '请求开始时复用已有数据库连接的次数'),
+    'oauth_call_duration_seconds': ('histogram', 'OAuth外部调用耗时'),
+    'oauth_call_errors_total': ('counter', '失败的OAuth外部调用数'),
+}
+
+# 各worker的文件名为{pid}-{随机后缀}.json；已退出worker的数据合并进AGGREGATE_NAME后删除
+WORKER_FILE_RE = re.compile(r'^(\d+)-[0-9a-z]+\.json$')
+AGGREGATE_NAME = 'aggregate.json'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_payload(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _add_payload(counters, histograms, payload):
+    for name, labels, value in payload['counters']:
+        key = (name, tuple(sorted(labels.items())))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, values in payload['histograms']:
+        key = (name, tuple(sorted(labels.items())))
+        total = histograms.setdefault(key, [0] * len(values))
+        for index, value in enumerate(values):
+            total[index] += value
+
+
+def _as_payload(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+    }
+
+
+def _atomic_write_json(directory, name, payload):
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as temp:
+        json.dump(payload, temp)
+    os.replace(temp.name, directory / name)
+
+
+@contextmanager
+def _directory_lock(directory):
+    """合并已退出worker的文件时只允许一个进程进行，避免重复计入"""
+    with open(directory / '.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+class MetricsCollector:
+    """
+    进程内累积计数器和直方图，定期整体写入共享目录下本进程自己的文件；
+    /metrics读取目录中所有文件求和，因此gunicorn多个worker的数据可以正确汇总，无需外部服务。
+    只有计数器和直方图（单调递增）。已退出worker的文件在抓取时合并进一个汇总文件后删除，
+    计数不会丢失，目录中的文件数也不会随worker重启无限增长。目录只能由同一主机上的进程共享。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.serving = False
+        self.flusher = None
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # 文件名带随机后缀，pid被复用时不会覆盖已退出worker的数据
+        self.file_name = f'{self.pid}-{uuid.uuid4().hex[:8]}.json'
+        self.counters = {}
+        self.histograms = {}
+        self.dirty = False
+
+    def start(self):
+        """由MetricsMiddleware在处理请求的进程中调用；manage.py命令等进程不写指标文件"""
+        with self._lock:
+            self.serving = True
+            self._check_fork()
+
+    def _check_fork(self):
+        # gunicorn预加载应用时在fork前导入，子进程不能沿用父进程的计数和文件，后台线程也不会被继承
+        if os.getpid() != self.pid:
+            self.reset()
+            self.flusher = None
+        if self.serving and self.flusher is None:
+            self.flusher = threading.Thread(target=self._flush_periodically, name='metrics-flusher', daemon=True)
+            self.flusher.start()
+
+    def _flush_periodically(self):
+        # 空闲的worker也要及时写出最后几个请求的数据
+        while True:
+            time.sleep(max(settings.METRICS['FLUSH_INTERVAL'], 0.1))
+            if self.dirty:
+                self.flush()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.dirty = True
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.dirty = True
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # 各桶计数（非累积）、+Inf桶、总和、次数
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0]
+            histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def directory(self):
+        return Path(settings.METRICS['DIR'])
+
+    def flush(self):
+        """把本进程的全部数据原子写入自己的文件"""
+        with self._lock:
+            self._check_fork()
+            payload = _as_payload(self.counters, self.histograms)
+            self.dirty = False
+            file_name = self.file_name
+        directory = self.directory()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            _atomic_write_json(directory, file_name, payload)
+        except OSError:
+            logger.warning('写入指标文件失败', exc_info=True)
+
+    def collect(self):
+        """先写入本进程的最新数据，合并已退出worker的文件，再汇总汇总文件和仍在运行的worker的文件"""
+        self.flush()
+        directory = self.directory()
+        counters, histograms = {}, {}
+        with _directory_lock(directory):
+            aggregate = self._compact(directory)
+            _add_payload(counters, histograms, aggregate)
+            merged = set(aggregate['merged'])
+            for path in directory.glob('*.json'):
+                if not WORKER_FILE_RE.match(path.name) or path.name in merged:
+                    continue
+                payload = _read_payload(path)
+                if payload is not None:
+                    _add_payload(counters, histograms, payload)
+        return counters, histograms
+
+    def _compact(self, directory):
+        """
+        把已退出worker的文件合并进汇总文件并删除，返回汇总数据。
+        汇总文件记录已合并的文件名：合并后删除前中断时，下次不会重复计入，只补做删除。
+        """
+        aggregate = _read_payload(directory / AGGREGATE_NAME) or {'counters': [], 'histograms': [], 'merged': []}
+        merged = set(aggregate['merged'])
+        dead = []
+        for path in directory.glob('*.json'):
+            match = WORKER_FILE_RE.match(path.name)
+            if match and path.name not in merged and not _pid_alive(int(match.group(1))):
+                dead.append(path)
+        if dead:
+            counters, histograms = {}, {}
+            _add_payload(counters, histograms, aggregate)
+            for path in dead:
+                payload = _read_payload(path)
+                if payload is not None:
+                    _add_payload(counters, histograms, payload)
+            # 已删除的文件不再需要记录
+            still_present = {name for name in merged if (directory / name).exists()}
+            aggregate = {
+                **_as_payload(counters, histograms),
+                'merged': sorted(still_present | {path.name for path in dead}),
+            }
+            try:
+                _atomic_write_json(directory, AGGREGATE_NAME, aggregate)
+            except OSError:
+                logger.warning('写入指标汇总文件失败', exc_info=True)
+                return _read_payload(directory / AGGREGATE_NAME) or {'counters': [], 'histograms': [], 'merged': []}
+        for name in aggregate['merged']:
+            (directory / name).unlink(missing_ok=True)
+        return aggregate
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in items
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def render_prometheus(counters, histograms):
+    """输出Prometheus文本格式"""
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+            continue
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+collector = MetricsCollector()
+
+
+def metrics_view(request):
+    """Prometheus抓取接口，汇总所有worker的数据；DEBUG为False时必须配置METRICS_TOKEN"""
+    token = settings.METRICS['TOKEN']
+    if not token and not settings.DEBUG:
+        return HttpResponse(status=404)
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_prometheus(*collector.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@atexit.register
+def _flush_at_exit():
+    # 处理请求的进程退出前补写最后的数据
+    if collector.serving and collector.dirty:
+        collector.flush()
+
+
+def _connection_created(sender, connection, **kwargs):
+    collector.inc('db_connections_opened_total', {'alias': connection.alias})
+
+
+connection_created.connect(_connection_created, dispatch_uid='usccoursemate.metrics')
@@ -0,0 +1,206 @@
+import heapq
+import json
+import logging
+import os
+import random
+import re
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .metrics import collector
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTiming:
+    """单个请求的计时数据：SQL次数和耗时、视图和渲染耗时；抽样请求额外按语句汇总SQL"""
+
+    def __init__(self, sampled):
+        self.started = time.perf_counter()
+        self.sampled = sampled
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.view_finished = None
+        self.render_finished = None
+        self.statements = {} if sampled else None
+
+    def __call__(self, execute, sql, params, many, context):
+        """数据库execute包装器，由connection.execute_wrapper调用"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            seconds = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += seconds
+            if self.statements is not None:
+                # 同一语句（参数不同）合并统计，N+1查询会表现为次数很多的一条
+                entry = self.statements.setdefault(sql, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+
+    def top_statements(self, limit):
+        if not self.statements:
+            return []
+        top = heapq.nlargest(limit, self.statements.items(), key=lambda item: item[1][1])
+        return [{'sql': sql, 'count': count, 'ms': round(seconds * 1000, 2)} for sql, (count, seconds) in top]
+
+    def phases(self, finished):
+        """返回各阶段耗时（毫秒）；渲染发生在视图返回之后，没有渲染的响应只有total和db"""
+        phases = {'total': finished - self.started, 'db': self.db_seconds}
+        if self.view_finished is not None:
+            phases['view'] = self.view_finished - self.started
+            phases['render'] = (self.render_finished or finished) - self.view_finished
+        return {name: round(seconds * 1000, 2) for name, seconds in phases.items()}
+
+
+class RequestTimingMiddleware:
+    """
+    统计每个请求的SQL次数和耗时，以Server-Timing响应头返回各阶段耗时，
+    超过阈值的请求记录一条JSON格式的慢请求日志。
+    计数和计时对所有请求生效，开销很小；按语句汇总SQL只对抽样的请求进行，慢日志中的top_sql来自抽样请求。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.REQUEST_TIMING
+        self.enabled = config['ENABLED']
+        self.sample_rate = config['SAMPLE_RATE']
+        self.slow_threshold_ms = config['SLOW_THRESHOLD_MS']
+        self.top_queries = config['TOP_QUERIES']
+        self.server_timing = config['SERVER_TIMING']
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        timing = request.timing = RequestTiming(sampled=random.random() < self.sample_rate)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timing))
+            response = self.get_response(request)
+        phases = timing.phases(time.perf_counter())
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={ms}' + (f';desc="{timing.queries} queries"' if name == 'db' else '')
+                for name, ms in phases.items()
+            )
+        if phases['total'] >= self.slow_threshold_ms:
+            self.log_slow_request(request, response, timing, phases)
+        return response
+
+    def process_template_response(self, request, response):
+        """DRF的Response在视图返回后才渲染，借此区分视图（含序列化）和渲染耗时"""
+        timing = getattr(request, 'timing', None)
+        if timing is not None:
+            timing.view_finished = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self._render_finished(timing))
+        return response
+
+    @staticmethod
+    def _render_finished(timing):
+        timing.render_finished = time.perf_counter()
+
+    def log_slow_request(self, request, response, timing, phases):
+        logger.warning('慢请求 %s', json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': timing.queries,
+            'timings_ms': phases,
+            'sampled': timing.sampled,
+            'top_sql': timing.top_statements(self.top_queries),
+        }, ensure_ascii=False))
+
+
+# 只为这些应用的视图记录路由级指标，路由名取URL名称，基数可控
+METRICS_APPS = {'groups', 'authentication'}
+
+
+def _route(request):
+    """返回请求命中的URL名称，不属于METRICS_APPS的视图返回None"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    module = view_class.__module__ if view_class else match.func.__module__
+    if module.split('.')[0] not in METRICS_APPS:
+        return None
+    return match.view_name
+
+
+class MetricsMiddleware:
+    """为/metrics记录各路由的请求数、状态码和耗时，以及数据库连接复用次数"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        collector.start()
+
+    def __call__(self, request):
+        # request_started信号已关闭过期连接，此时仍打开的连接会被本请求复用
+        for connection in connections.all():
+            if connection.connection is not None:
+                collector.inc('db_connection_reuses_total', {'alias': connection.alias})
+
+        started = time.perf_counter()
+        response = self.get_response(request)
+        seconds = time.perf_counter() - started
+
+        route = _route(request)
+        if route is not None:
+            collector.inc('http_requests_total', {
+                'route': route, 'method': request.method, 'status': str(response.status_code),
+            })
+            collector.observe('http_request_duration_seconds', {'route': route, 'method': request.method}, seconds)
+        return response
+
+
+# 运行时生成的、文件名带12位内容哈希的静态文件：群组目录快照和群组二维码
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.json$')
+QR_NAME_RE = re.compile(r'/[0-9a-f]{12}-\d+\.(?:png|webp)$')
+
+
+class RuntimeStaticWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise在非调试模式下只在启动时扫描STATIC_ROOT。群组目录快照和二维码在运行时生成，
+    首次请求时从磁盘加入文件表；文件名带内容哈希、内容不会改变，因此以immutable长缓存头返回。
+    """
+
+    def __init__(self, get_response=None, settings=settings):
+        # 父类初始化时扫描STATIC_ROOT会调用immutable_file_test，需要先确定运行时文件所在的子目录
+        self.runtime_subdirs = [
+            (settings.CATALOG_SNAPSHOT['SUBDIR'], HASHED_NAME_RE),
+            (settings.QR_CODES['SUBDIR'], QR_NAME_RE),
+        ]
+        super().__init__(get_response, settings)
+
+    def __call__(self, request):
+        url = request.path_info
+        if self.autorefresh or not self.is_runtime_file(url):
+            return super().__call__(request)
+        path = os.path.join(self.static_root, url[len(self.static_prefix):])
+        if not os.path.isfile(path):
+            # 生成新版本时旧文件可能已被其他进程删除，从文件表中移除，交给后续处理返回404
+            self.files.pop(url, None)
+        elif url not in self.files and self.url_is_canonical(url):
+            self.files[url] = self.get_static_file(path, url)
+        try:
+            return super().__call__(request)
+        except FileNotFoundError:
+            # 检查之后、打开之前被删除
+            self.files.pop(url, None)
+            return self.get_response(request)
+
+    def is_runtime_file(self, url):
+        return any(
+            url.startswith(f'{self.static_prefix}{subdir}/') and pattern.search(url) is not None
+            for subdir, pattern in self.runtime_subdirs
+        )
+
+    def immutable_file_test(self, path, url):
+        return self.is_runtime_file(url) or super().immutable_file_test(path, url)
@@ -0,0 +1,48 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import NotSupportedError
+from django.db.migrations import AddConstraint
+
+
+class AddIndexConcurrentlyIfSupported(AddIndexConcurrently):
+    """
+    在PostgreSQL上使用CREATE INDEX CONCURRENTLY建索引，不锁表，可在线上直接执行；
+    其他数据库（如本地SQLite）退化为普通的AddIndex。所在迁移需设置atomic = False。
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index)
+
+
+class AddUniqueConstraintConcurrentlyIfSupported(AddConstraint):
+    """
+    在PostgreSQL上先用CREATE UNIQUE INDEX CONCURRENTLY建唯一索引，再以ADD CONSTRAINT ... USING INDEX
+    挂为唯一约束，只在最后一步短暂锁表；其他数据库退化为普通的AddConstraint。所在迁移需设置atomic = False。
+    只支持按字段定义、不带条件的UniqueConstraint。
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        if schema_editor.connection.in_atomic_block:
+            raise NotSupportedError('CREATE UNIQUE INDEX CONCURRENTLY不能在事务中执行，迁移需设置atomic = False')
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        table = schema_editor.quote_name(model._meta.db_table)
+        name = schema_editor.quote_name(self.constraint.name)
+        columns = ', '.join(
+            schema_editor.quote_name(model._meta.get_field(field).column) for field in self.constraint.fields
+        )
+        schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({columns})')
+        schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}')
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -39,8 +40,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'usccoursemate.middleware.MetricsMiddleware',
+    'usccoursemate.middleware.RequestTimingMiddleware',  # 放在外层，耗时覆盖其余中间件
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # Whitenoise中间件，必须在SecurityMiddleware之后
+    'usccoursemate.middleware.RuntimeStaticWhiteNoiseMiddleware',  # Whitenoise中间件，必须在SecurityMiddleware之后
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS中间件
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +82,47 @@ DATABASES = {
     )
 }
 
+# 只读副本（可选）：设置DATABASE_REPLICA_URL后，群组和加群申请的list/retrieve查询发往副本
+REPLICA_DATABASE = {
+    'ALIAS': 'replica',
+    # 健康检查间隔（秒），检查结果在进程内缓存
+    'HEALTH_CHECK_INTERVAL': float(os.getenv('REPLICA_HEALTH_CHECK_INTERVAL', '5')),
+    # 复制延迟超过此值（秒）时读取回退到主库（仅PostgreSQL）
+    'MAX_LAG_SECONDS': float(os.getenv('REPLICA_MAX_LAG_SECONDS', '10')),
+}
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+if DATABASE_REPLICA_URL:
+    replica = dj_database_url.parse(DATABASE_REPLICA_URL, conn_max_age=600, conn_health_checks=True)
+    if replica['ENGINE'] == 'django.db.backends.postgresql':
+        # 副本不可达时尽快失败并回退到主库
+        replica.setdefault('OPTIONS', {}).setdefault('connect_timeout', 3)
+    # 测试时副本指向测试主库，不单独建库
+    replica['TEST'] = {'MIRROR': 'default'}
+    DATABASES[REPLICA_DATABASE['ALIAS']] = replica
+DATABASE_ROUTERS = ['usccoursemate.db_router.PrimaryReplicaRouter']
+
+# 缓存设置
+# default为进程内缓存；shared为同一主机上所有gunicorn worker共享的文件缓存
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'usccoursemate_cache')),
+    },
+}
+
+# 群组目录响应缓存：版本号保存在数据库中，共享缓存中保存它的副本，响应数据保存在进程内LRU中
+CATALOG_CACHE = {
+    'ALIAS': 'shared',
+    'MAX_ENTRIES': int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '256')),
+    # 搜索结果使用单独的LRU
+    'SEARCH_MAX_ENTRIES': int(os.getenv('CATALOG_SEARCH_CACHE_MAX_ENTRIES', '128')),
+    # 共享缓存中版本号副本的有效期（秒），到期后从数据库重新读取；也是其他主机上的目录变化最迟可见的时间
+    'VERSION_TTL': int(os.getenv('CATALOG_VERSION_TTL', '10')),
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -108,13 +152,52 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Whitenoise配置
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# 预渲染的群组目录快照，写入STATIC_ROOT下的子目录，由WhiteNoise以长缓存头提供
+CATALOG_SNAPSHOT = {
+    'SUBDIR': 'catalog',
+    # 后端的公开地址，清单中的文件地址以它开头；为空时按请求的域名生成
+    'BASE_URL': os.getenv('BACKEND_URL') or os.getenv('RENDER_EXTERNAL_URL', ''),
+}
+
 # Media files
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 群组二维码：由render_qr_codes命令渲染到STATIC_ROOT下的子目录，文件名带内容哈希，由WhiteNoise提供
+QR_CODES = {
+    'SUBDIR': 'qrcodes',
+    # 后端的公开地址，写入Community.qr_code的是以它开头的完整地址；为空时只渲染文件，不修改qr_code
+    'BASE_URL': os.getenv('BACKEND_URL') or os.getenv('RENDER_EXTERNAL_URL', ''),
+    'SIZES': (150, 300, 600),
+    # 写入Community.qr_code的尺寸
+    'DEFAULT_SIZE': 300,
+    'FORMATS': ('png', 'webp'),
+    # 二维码内容，{type}和{code}为URL编码后的群组类型和代码
+    'URL_TEMPLATE': os.getenv(
+        'COMMUNITY_QR_URL_TEMPLATE',
+        os.getenv('FRONTEND_URL', 'http://localhost:3000') + '/communities/{type}/{code}',
+    ),
+}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 用户头像：后台下载、缩放后保存到MEDIA_ROOT下的子目录，由/api/auth/avatars/<user_id>/返回
+AVATARS = {
+    'SUBDIR': 'avatars',
+    'SIZES': (32, 64, 128, 256),
+    'DEFAULT_SIZE': 64,
+    'MAX_BYTES': 5 * 1024 * 1024,
+    # 只下载这些域名（及其子域名）下的头像
+    'SOURCE_HOSTS': tuple(host.strip() for host in os.getenv('AVATAR_SOURCE_HOSTS', 'googleusercontent.com').split(',')),
+    # 后台下载线程数，0表示在当前线程中同步处理
+    'WORKERS': int(os.getenv('AVATAR_FETCH_WORKERS', '2')),
+    # 头像响应的缓存时间（秒）
+    'MAX_AGE': 86400,
+    # 下载或处理失败后多久（秒）才再次尝试
+    'RETRY_AFTER': 300,
+}
+
 # REST Framework设置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -123,8 +206,29 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # 应用前面的反向代理层数，限流按X-Forwarded-For中对应位置的地址识别客户端（Render为1）。
+    # 不能为None，否则DRF把整个（可由客户端伪造的）X-Forwarded-For作为标识；不经代理直接部署时设为0
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '1')),
 }
 
+# 匿名可用接口的令牌桶限流，桶状态保存在同一主机上所有worker共享的内存映射文件中
+# 速率为“容量/周期”：最多连续通过容量个请求，之后按容量/周期的速度恢复
+RATE_LIMITS = {
+    'ENABLED': os.getenv('RATE_LIMIT_ENABLED', 'True') == 'True',
+    'FILE': os.getenv('RATE_LIMIT_FILE', os.path.join(tempfile.gettempdir(), 'usccoursemate_ratelimit.bin')),
+    # 槽位组数，每组4个槽位，每个槽位24字节
+    'GROUPS': 16384,
+    'RATES': {
+        'join_request.ip': os.getenv('JOIN_REQUEST_RATE_PER_IP', '30/min'),
+        'join_request.email': os.getenv('JOIN_REQUEST_RATE_PER_EMAIL', '10/min'),
+        'sync_user.ip': os.getenv('SYNC_USER_RATE_PER_IP', '60/min'),
+        'sync_user.email': os.getenv('SYNC_USER_RATE_PER_EMAIL', '20/min'),
+    },
+}
+
+# 测试期间限流桶使用临时文件，多次运行测试互不影响
+TEST_RUNNER = 'usccoursemate.test_runner.TestRunner'
+
 # JWT设置
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -163,4 +267,79 @@ if not DEBUG:
 # Google OAuth设置
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
-GOOGLE_REDIRECT_URI = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/oauth2callback"
\ No newline at end of file
+GOOGLE_REDIRECT_URI = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/oauth2callback"
+
+# OAuth外部HTTP调用设置（连接池、超时和重试上限）
+OAUTH_HTTP = {
+    'CONNECT_TIMEOUT': float(os.getenv('OAUTH_HTTP_CONNECT_TIMEOUT', '3.05')),
+    'READ_TIMEOUT': float(os.getenv('OAUTH_HTTP_READ_TIMEOUT', '10')),
+    'RETRIES': int(os.getenv('OAUTH_HTTP_RETRIES', '2')),
+    'POOL_SIZE': int(os.getenv('OAUTH_HTTP_POOL_SIZE', '10')),
+    # ASGI下单个worker同时处理大量登录，异步客户端需要更大的连接池
+    'ASYNC_POOL_SIZE': int(os.getenv('OAUTH_HTTP_ASYNC_POOL_SIZE', '200')),
+    # 后台下载头像原图所用的客户端，连接池大小与AVATAR_FETCH_WORKERS相当即可
+    'AVATAR': {
+        'CONNECT_TIMEOUT': float(os.getenv('AVATAR_HTTP_CONNECT_TIMEOUT', '3.05')),
+        'READ_TIMEOUT': float(os.getenv('AVATAR_HTTP_READ_TIMEOUT', '10')),
+        'RETRIES': int(os.getenv('AVATAR_HTTP_RETRIES', '1')),
+        'POOL_SIZE': int(os.getenv('AVATAR_HTTP_POOL_SIZE', '4')),
+    },
+}
+
+# 为True时认证回调和用户同步使用异步视图，需通过ASGI服务器（如uvicorn）运行usccoursemate.asgi
+ASYNC_AUTH_VIEWS = os.getenv('ASYNC_AUTH_VIEWS', 'False') == 'True'
+
+# worker启动（django.setup()加URLconf导入）的耗时预算，由manage.py check_startup检查
+STARTUP_TIME_BUDGET = float(os.getenv('STARTUP_TIME_BUDGET', '1.5'))
+
+# Supabase令牌验证设置
+SUPABASE_URL = os.getenv('SUPABASE_URL')
+SUPABASE_JWT = {
+    'SECRET': os.getenv('SUPABASE_JWT_SECRET'),
+    'JWKS_URL': f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else None,
+    'JWKS_TTL': int(os.getenv('SUPABASE_JWKS_TTL', '600')),
+    'AUDIENCE': 'authenticated',
+    'CACHE_SIZE': int(os.getenv('SUPABASE_TOKEN_CACHE_SIZE', '10000')),
+    # 允许用户同步不带令牌、只凭请求体中的supabase_id和email（仅限本地开发，DEBUG为False时始终关闭）
+    'ALLOW_UNVERIFIED': DEBUG and os.getenv('SYNC_USER_ALLOW_UNVERIFIED', 'False') == 'True',
+}
+
+# 日志设置
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'standard': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'standard',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
+    },
+}
+
+# 请求计时：Server-Timing响应头和慢请求日志
+REQUEST_TIMING = {
+    'ENABLED': os.getenv('REQUEST_TIMING_ENABLED', 'True') == 'True',
+    # 按语句汇总SQL（用于慢日志中的top_sql）的抽样比例
+    'SAMPLE_RATE': float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', '0.1')),
+    'SLOW_THRESHOLD_MS': float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', '500')),
+    'TOP_QUERIES': 5,
+    'SERVER_TIMING': os.getenv('SERVER_TIMING_HEADER', 'True') == 'True',
+}
+
+# /metrics指标：各worker把自己的数据写入同一目录，读取时汇总
+METRICS = {
+    'DIR': os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'usccoursemate_metrics')),
+    # worker写入数据的最小间隔（秒），/metrics看到的其他worker数据最多滞后这么久
+    'FLUSH_INTERVAL': float(os.getenv('METRICS_FLUSH_INTERVAL', '1')),
+    # /metrics需要Authorization: Bearer <token>；未设置时只在DEBUG下可以访问，否则返回404
+    'TOKEN': os.getenv('METRICS_TOKEN'),
+}
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    限流桶、共享缓存和指标文件默认保存在系统临时目录中并跨进程保留，测试期间改用临时目录，
+    避免前几次运行的请求计入限额、旧的目录版本号被沿用，以及每次运行都留下指标文件
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_settings = override_settings(
+            RATE_LIMITS={**settings.RATE_LIMITS, 'FILE': os.path.join(self.temp_dir.name, 'ratelimit.bin')},
+            CACHES={**settings.CACHES, 'shared': {
+                **settings.CACHES['shared'], 'LOCATION': os.path.join(self.temp_dir.name, 'cache'),
+            }},
+            METRICS={**settings.METRICS, 'DIR': os.path.join(self.temp_dir.name, 'metrics')},
+        )
+        self.temp_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.temp_settings.disable()
+        self.temp_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,209 @@
+"""
+令牌桶限流。桶状态保存在一个内存映射文件中，同一主机上的所有gunicorn worker映射同一个文件，
+读写都在共享内存中完成，不访问数据库也不经过网络。
+文件按组划分槽位，每组用fcntl记录锁保护，不同的键通常落在不同的组，彼此不竞争。
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+try:
+    import fcntl
+except ImportError:  # Windows开发环境没有fcntl，退化为只在进程内加锁
+    fcntl = None
+
+# 每个槽位：键的64位哈希（0表示空槽）、剩余令牌数、上次更新时间
+SLOT = struct.Struct('<Qdd')
+# 每组的槽位数，键只存放在自己所在的组内
+GROUP_SIZE = 4
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'30/min'形式的速率 -> (桶容量, 每秒补充的令牌数)"""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period[0]]
+
+
+class SharedTokenBuckets:
+    """
+    存放在共享文件中的令牌桶。组内槽位全被其他键占用时，淘汰最久未更新的槽位；
+    被淘汰的键下次以满桶重新开始，只会更宽松，不会误拒请求。
+    """
+
+    def __init__(self, path, groups):
+        self.path = Path(path)
+        self.groups = groups
+        self.group_bytes = GROUP_SIZE * SLOT.size
+        self._lock = threading.Lock()
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = self.groups * self.group_bytes
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            # 多个进程同时扩展到相同大小是安全的，新增部分全为0即空槽
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+
+    @contextmanager
+    def _locked(self, offset):
+        # 记录锁属于进程，同一进程内的线程还需要_lock互斥
+        with self._lock:
+            if self._map is None:
+                self._open()
+            if fcntl is None:
+                yield
+                return
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.group_bytes, offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.group_bytes, offset)
+
+    def consume(self, key, capacity, refill_rate, cost=1):
+        """
+        从key的桶中取出cost个令牌，返回(是否允许, 需要等待的秒数)。
+        cost超过桶容量时按容量计，即满桶时仍可通过，但会取空整个桶。
+        """
+        cost = min(cost, capacity)
+        digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') or 1
+        offset = (digest % self.groups) * self.group_bytes
+        with self._locked(offset):
+            now = time.time()
+            slots = [SLOT.unpack_from(self._map, offset + index * SLOT.size) for index in range(GROUP_SIZE)]
+            index = self._find_slot(slots, digest)
+            stored, tokens, updated = slots[index]
+            if stored != digest:
+                tokens, updated = capacity, now
+            # 系统时间回拨时不补充令牌
+            tokens = min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            SLOT.pack_into(self._map, offset + index * SLOT.size, digest, tokens, now)
+        return allowed, 0.0 if allowed else (cost - tokens) / refill_rate
+
+    @staticmethod
+    def _find_slot(slots, digest):
+        for index, (stored, _, _) in enumerate(slots):
+            if stored == digest:
+                return index
+        for index, (stored, _, _) in enumerate(slots):
+            if stored == 0:
+                return index
+        return min(range(len(slots)), key=lambda index: slots[index][2])
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    """按RATE_LIMITS中的文件和组数返回共享令牌桶，进程内复用"""
+    config = settings.RATE_LIMITS
+    key = (config['FILE'], config['GROUPS'])
+    buckets = _buckets.get(key)
+    if buckets is None:
+        with _buckets_lock:
+            buckets = _buckets.setdefault(key, SharedTokenBuckets(*key))
+    return buckets
+
+
+def rate_limit_wait(scope, kind, ident, cost=1):
+    """按RATE_LIMITS['RATES']中'scope.kind'的速率为ident消耗cost个令牌；允许时返回None，否则返回需要等待的秒数"""
+    config = settings.RATE_LIMITS
+    rate = config['RATES'].get(f'{scope}.{kind}')
+    if not config['ENABLED'] or not rate or not ident:
+        return None
+    capacity, refill_rate = parse_rate(rate)
+    allowed, wait = get_buckets().consume(f'{scope}.{kind}:{ident}', capacity, refill_rate, cost)
+    return None if allowed else wait
+
+
+def request_email(data):
+    """从请求体中取出申请人或登录用户的邮箱，统一为小写"""
+    for field in ('user_email', 'email'):
+        value = data.get(field) if hasattr(data, 'get') else None
+        if isinstance(value, str) and value.strip():
+            return value.strip().lower()
+    return None
+
+
+def check_request_rates(request, scope, email):
+    """
+    同时检查按IP和按邮箱的速率，供不经过DRF的异步视图使用，email由视图确定（与get_throttle_email相同）；
+    允许时返回None，否则返回需要等待的秒数
+    """
+    waits = [
+        rate_limit_wait(scope, 'ip', BaseThrottle().get_ident(request)),
+        rate_limit_wait(scope, 'email', email),
+    ]
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+def retry_after(wait):
+    return str(math.ceil(wait))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    DRF限流类，与ScopedRateThrottle一样从视图的throttle_scope读取范围，
+    速率取RATE_LIMITS['RATES']中的'{throttle_scope}.{kind}'。
+    视图定义get_throttle_cost(request)时，每个请求消耗它返回的令牌数（如批量接口按条数计），否则消耗1个。
+    """
+    kind = None
+
+    def get_ident_for(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            self.wait_seconds = None
+            return True
+        cost = view.get_throttle_cost(request) if hasattr(view, 'get_throttle_cost') else 1
+        self.wait_seconds = rate_limit_wait(scope, self.kind, self.get_ident_for(request, view), cost)
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPRateThrottle(TokenBucketThrottle):
+    """
+    按客户端IP限流。REST_FRAMEWORK['NUM_PROXIES']为N时取X-Forwarded-For中倒数第N个地址，
+    即最外层代理追加的那一个，客户端自己伪造的前缀不影响识别结果。
+    """
+    kind = 'ip'
+
+    def get_ident_for(self, request, view):
+        return self.get_ident(request)
+
+
+class EmailRateThrottle(TokenBucketThrottle):
+    """
+    按邮箱限流，没有邮箱时不限流（仍受按IP的限制）。
+    视图定义get_throttle_email(request)时以它的返回值为键（如用户同步取已验证令牌中的邮箱），否则取请求体中的邮箱。
+    """
+    kind = 'email'
+
+    def get_ident_for(self, request, view):
+        if hasattr(view, 'get_throttle_email'):
+            return view.get_throttle_email(request)
+        return request_email(request.data)
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
 
+from .metrics import metrics_view
+
 # 简单的根路径视图函数
 def api_root(request):
     return JsonResponse({
@@ -19,6 +21,7 @@ def api_root(request):
 urlpatterns = [
     path('', api_root, name='api_root'),  # 添加根路径处理
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/auth/', include('authentication.urls')),
     path('api/', include('groups.urls')),
 ]